@@ -0,0 +1,287 @@
+import io
+import os
+import csv
+import gzip
+import logging
+import itertools
+from collections import namedtuple
+from datetime import date, datetime
+from app import db
+import models
+
+logger = logging.getLogger(__name__)
+
+# Months older than this are moved out of the live transaction table
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', 13))
+# Monthly partitions created in advance on Postgres
+PARTITIONS_AHEAD = int(os.environ.get('PARTITIONS_AHEAD', 3))
+# Rows read from the database (or written back) at a time
+ARCHIVE_BATCH_SIZE = 10000
+
+ARCHIVE_COLUMNS = ['id', 'beverage_id', 'user_id', 'quantity_change', 'timestamp', 'transaction_type']
+ArchivedTransaction = namedtuple('ArchivedTransaction', ARCHIVE_COLUMNS)
+# Same attributes as the rows of the export queries in inventory_service
+ExportRow = namedtuple('ExportRow', ['name', 'quantity_change', 'timestamp', 'price',
+                                     'transaction_type', 'user_email'])
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def _midnight(day):
+    return datetime.combine(day, datetime.min.time())
+
+# Postgres partitioning
+
+def is_partitioned():
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    return db.session.execute(db.text(
+        "SELECT c.relkind = 'p' FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = 'transaction' AND n.nspname = current_schema()"
+    )).scalar() or False
+
+def partition_name(month):
+    return f"transaction_{month:%Y_%m}"
+
+def _create_partition(month):
+    db.session.execute(db.text(
+        f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF "transaction" '
+        f"FOR VALUES FROM ('{_midnight(month).isoformat()}') TO ('{_midnight(add_months(month, 1)).isoformat()}')"
+    ))
+
+def ensure_partitions(ahead=PARTITIONS_AHEAD):
+    """Create the partitions of this month and the next ``ahead`` months.
+
+    Must run before a month starts: rows for a month without a partition
+    land in the default partition, and Postgres then refuses to create that
+    month's partition until they are moved out.
+    """
+    if not is_partitioned():
+        return 0
+    current = month_start(datetime.utcnow())
+    for offset in range(ahead + 1):
+        _create_partition(add_months(current, offset))
+    db.session.commit()
+    return ahead + 1
+
+def partition_transactions():
+    """Turn the Postgres transaction table into one partition per month.
+
+    Copies every row into a new table partitioned by timestamp, so run it
+    in a maintenance window on large databases. Ids, the id sequence and
+    the indexes are preserved; the primary key becomes (id, timestamp) as
+    Postgres requires the partition key in it.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql' or is_partitioned():
+        return False
+    execute = lambda sql: db.session.execute(db.text(sql))  # noqa: E731
+
+    first = db.session.query(db.func.min(models.Transaction.timestamp)).scalar()
+    execute("""UPDATE "transaction" SET timestamp = now() AT TIME ZONE 'utc' WHERE timestamp IS NULL""")
+    execute('ALTER TABLE "transaction" RENAME TO transaction_unpartitioned')
+    execute('ALTER TABLE transaction_unpartitioned RENAME CONSTRAINT transaction_pkey TO transaction_unpartitioned_pkey')
+    for index in models.Transaction.__table__.indexes:
+        execute(f'ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_unpartitioned')
+
+    execute("""
+        CREATE TABLE "transaction" (
+            id INTEGER NOT NULL DEFAULT nextval('transaction_id_seq'),
+            beverage_id INTEGER NOT NULL REFERENCES beverage (id),
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            quantity_change INTEGER NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            transaction_type VARCHAR(20) NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    for index in models.Transaction.__table__.indexes:
+        index.create(db.session.connection())
+    execute('CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT')
+
+    month = month_start(first or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), PARTITIONS_AHEAD)
+    while month <= last:
+        _create_partition(month)
+        month = add_months(month, 1)
+
+    execute("""
+        INSERT INTO "transaction" (id, beverage_id, user_id, quantity_change, timestamp, transaction_type)
+        SELECT id, beverage_id, user_id, quantity_change, timestamp, transaction_type
+        FROM transaction_unpartitioned
+    """)
+    execute('DROP TABLE transaction_unpartitioned')
+    return True
+
+# Archival
+
+def _encode(rows):
+    """``(gzipped CSV of rows, number of rows)``; ``rows`` is consumed as
+    it comes, so only the compressed output is held in memory"""
+    buffer = io.BytesIO()
+    count = 0
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as compressed:
+        text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(ARCHIVE_COLUMNS)
+        for row in rows:
+            writer.writerow([
+                row.id, row.beverage_id, row.user_id, row.quantity_change,
+                row.timestamp.isoformat() if row.timestamp else '', row.transaction_type
+            ])
+            count += 1
+        text.flush()
+        text.detach()
+    return buffer.getvalue(), count
+
+def _decode(data):
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as compressed:
+        reader = csv.reader(io.TextIOWrapper(compressed, encoding='utf-8', newline=''))
+        next(reader)
+        for id, beverage_id, user_id, quantity_change, timestamp, transaction_type in reader:
+            yield ArchivedTransaction(
+                int(id), int(beverage_id), int(user_id), int(quantity_change),
+                datetime.fromisoformat(timestamp) if timestamp else None, transaction_type
+            )
+
+def _month_query(month):
+    return models.Transaction.query.filter(
+        models.Transaction.timestamp >= _midnight(month),
+        models.Transaction.timestamp < _midnight(add_months(month, 1))
+    )
+
+def archive_month(month):
+    """Move one month of transactions into a compressed TransactionArchive
+    row; returns the number of rows moved. The daily rollup and the stock
+    snapshots are left untouched, so statistics and stock history keep
+    working without reading the archive."""
+    if db.session.get(models.TransactionArchive, month) is not None:
+        raise ValueError(f"{month:%Y-%m} is already archived")
+    # Plain rows, fetched in batches and compressed as they arrive, instead
+    # of the whole month as ORM objects
+    rows = db.session.execute(
+        db.select(*[getattr(models.Transaction, column) for column in ARCHIVE_COLUMNS])
+        .where(
+            models.Transaction.timestamp >= _midnight(month),
+            models.Transaction.timestamp < _midnight(add_months(month, 1))
+        )
+        .order_by(models.Transaction.timestamp.desc(), models.Transaction.id.desc())
+        .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+    )
+    data, count = _encode(rows)
+    if not count:
+        return 0
+
+    db.session.add(models.TransactionArchive(month=month, row_count=count, data=data))
+    db.session.flush()
+    if is_partitioned():
+        # Dropping the partition is instant and gives the space back at once
+        name = partition_name(month)
+        db.session.execute(db.text(f'ALTER TABLE "transaction" DETACH PARTITION {name}'))
+        db.session.execute(db.text(f'DROP TABLE {name}'))
+    # Without partitions, or for rows that ended up in the default partition
+    _month_query(month).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+def restore_month(month):
+    """Move an archived month back into the live table"""
+    archive = db.session.get(models.TransactionArchive, month)
+    if archive is None:
+        raise ValueError(f"{month:%Y-%m} is not archived")
+    if is_partitioned():
+        _create_partition(month)
+    rows = _decode(archive.data)
+    count = 0
+    while True:
+        batch = [row._asdict() for row in itertools.islice(rows, ARCHIVE_BATCH_SIZE)]
+        if not batch:
+            break
+        db.session.execute(db.insert(models.Transaction), batch)
+        count += len(batch)
+    db.session.delete(archive)
+    db.session.commit()
+    return count
+
+def archive_closed_months(older_than=ARCHIVE_AFTER_MONTHS):
+    """Archive, oldest first, every month that ended more than
+    ``older_than`` months ago; returns ``[(month, rows)]``"""
+    cutoff = add_months(month_start(datetime.utcnow()), -older_than)
+    first = db.session.query(db.func.min(models.Transaction.timestamp)).filter(
+        models.Transaction.timestamp < _midnight(cutoff)
+    ).scalar()
+    archived = []
+    month = month_start(first) if first else cutoff
+    while month < cutoff:
+        if db.session.get(models.TransactionArchive, month) is None:
+            rows = archive_month(month)
+            if rows:
+                logger.info(f"Archived {rows} transactions from {month:%Y-%m}")
+                archived.append((month, rows))
+        month = add_months(month, 1)
+    return archived
+
+# Reading archived rows
+
+def archived_until():
+    """End of the newest archived month, or None when nothing is archived"""
+    latest = db.session.query(db.func.max(models.TransactionArchive.month)).scalar()
+    return _midnight(add_months(latest, 1)) if latest else None
+
+def archived_rows(start, end):
+    """Archived transactions with ``start <= timestamp <= end``, newest first"""
+    archives = db.session.query(models.TransactionArchive).filter(
+        models.TransactionArchive.month >= month_start(start),
+        models.TransactionArchive.month <= month_start(end)
+    ).order_by(models.TransactionArchive.month.desc())
+    for archive in archives.yield_per(1):
+        for row in _decode(archive.data):
+            if row.timestamp is not None and start <= row.timestamp <= end:
+                yield row
+
+def archived_changes(start, end, beverage_ids=None, transaction_type=None):
+    """``{beverage_id: sum of quantity_change}`` of archived rows with
+    ``start <= timestamp < end``"""
+    totals = {}
+    until = archived_until()
+    if until is None or start >= min(end, until):
+        return totals
+    for row in archived_rows(start, end):
+        if row.timestamp >= end:
+            continue
+        if beverage_ids is not None and row.beverage_id not in beverage_ids:
+            continue
+        if transaction_type is not None and row.transaction_type != transaction_type:
+            continue
+        totals[row.beverage_id] = totals.get(row.beverage_id, 0) + row.quantity_change
+    return totals
+
+class WithArchived:
+    """Wraps an export query so that ``yield_per`` continues with the
+    matching archived rows once the live ones run out. Archived months are
+    always older than live rows, so the newest-first order is kept."""
+
+    def __init__(self, query, start, end, transaction_type=None):
+        self.query = query
+        self.start = start
+        self.end = end
+        self.transaction_type = transaction_type
+
+    def yield_per(self, count):
+        yield from self.query.yield_per(count)
+        until = archived_until()
+        if until is None or self.start >= until:
+            return
+        beverages = {id: (name, price) for id, name, price in db.session.query(
+            models.Beverage.id, models.Beverage.name, models.Beverage.price)}
+        emails = dict(db.session.query(models.User.id, models.User.email))
+        for row in archived_rows(self.start, self.end):
+            if self.transaction_type is not None and row.transaction_type != self.transaction_type:
+                continue
+            name, price = beverages[row.beverage_id]
+            yield ExportRow(name, row.quantity_change, row.timestamp, price,
+                            row.transaction_type, emails.get(row.user_id))
@@ -0,0 +1,47 @@
+import argparse
+from datetime import datetime
+from app import create_app, db
+import archive_service
+import inventory_service
+import models
+
+def parse_month(value):
+    return datetime.strptime(value, '%Y-%m').date()
+
+def main():
+    parser = argparse.ArgumentParser(description="Transaction partitioning and archival")
+    commands = parser.add_subparsers(dest='command', required=True)
+    archive = commands.add_parser('archive', help="create upcoming partitions and archive closed months; run monthly")
+    archive.add_argument('--older-than-months', type=int, default=archive_service.ARCHIVE_AFTER_MONTHS)
+    restore = commands.add_parser('restore', help="move an archived month back into the transaction table")
+    restore.add_argument('month', type=parse_month, help="YYYY-MM")
+    commands.add_parser('list', help="show the archived months")
+    args = parser.parse_args()
+
+    app = create_app({'START_BACKGROUND_JOBS': False})
+    with app.app_context():
+        if args.command == 'archive':
+            partitions = archive_service.ensure_partitions()
+            if partitions:
+                print(f"Partitions ready for the next {partitions} months")
+            # A snapshot at the cutoff keeps the stock ledger from ever
+            # reading archived rows for current stock
+            cutoff = archive_service.add_months(
+                archive_service.month_start(datetime.utcnow()), -args.older_than_months
+            )
+            inventory_service.take_stock_snapshot(datetime.combine(cutoff, datetime.min.time()))
+            archived = archive_service.archive_closed_months(args.older_than_months)
+            for month, rows in archived:
+                print(f"{month:%Y-%m}: archived {rows} transactions")
+            if not archived:
+                print("Nothing to archive")
+        elif args.command == 'restore':
+            rows = archive_service.restore_month(args.month)
+            print(f"{args.month:%Y-%m}: restored {rows} transactions")
+        else:
+            archives = db.session.query(models.TransactionArchive).order_by(models.TransactionArchive.month)
+            for archive in archives:
+                print(f"{archive.month:%Y-%m}: {archive.row_count} transactions, {len(archive.data)} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session, object_session
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import db
+from config import PASSWORD_HASH_METHOD
+import models
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS', 1))  # per web worker process
+KDF_NICE = int(os.environ.get('KDF_NICE', 10))
+KDF_MAX_PENDING = int(os.environ.get('KDF_MAX_PENDING', 8))
+
+LOGIN_EMAIL_BURST = int(os.environ.get('LOGIN_EMAIL_BURST', 5))
+LOGIN_EMAIL_PER_MINUTE = float(os.environ.get('LOGIN_EMAIL_PER_MINUTE', 5))
+LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', 20))
+LOGIN_IP_PER_MINUTE = float(os.environ.get('LOGIN_IP_PER_MINUTE', 30))
+LOGIN_LIMITER_SIZE = int(os.environ.get('LOGIN_LIMITER_SIZE', 10000))
+
+class UserCache:
+    """Bounded LRU of detached User rows with a per-entry TTL.
+
+    Serves Flask-Login's user_loader so authenticated requests do not pay
+    a database round trip to rehydrate ``current_user``. Entries are
+    dropped when a transaction that inserted or updated a User row
+    commits in this process; the TTL bounds staleness for changes made by
+    other processes. A row read before such a commit is not cached.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0  # bumped by every invalidation
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        user = db.session.get(models.User, user_id)
+        if user is None:
+            return None
+        db.session.expunge(user)
+
+        with self._lock:
+            if generation != self._generation:
+                # Invalidated while we read: the row may predate the change
+                return user
+            self._entries[user_id] = (user, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+user_cache = UserCache()
+
+@db.event.listens_for(models.User, 'after_insert')
+@db.event.listens_for(models.User, 'after_update')
+def _mark_user_changed(mapper, connection, user):
+    # Covers password changes, is_active toggles and registration. Flushed
+    # is not committed: evicted once the transaction commits, so a
+    # concurrent request cannot cache the old row again in between
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(user.id)
+
+@db.event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        user_cache.invalidate(user_id)
+
+@db.event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_users', None)
+
+class LoginThrottled(Exception):
+    """Raised instead of doing password work; ``retry_after`` is in seconds"""
+
+    def __init__(self, retry_after, busy=False):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+        self.busy = busy
+
+class TokenBucketLimiter:
+    """Per-key token buckets holding at most ``burst`` tokens and refilled
+    at ``per_minute``. Only the ``maxsize`` most recently seen keys are
+    tracked; a forgotten key starts again with a full bucket."""
+
+    def __init__(self, burst, per_minute, maxsize=LOGIN_LIMITER_SIZE):
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def _store(self, key, tokens, now):
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+
+    def _retry_after(self, tokens):
+        return (1 - tokens) / self.rate if self.rate else 60
+
+    def check(self, key):
+        """Like consume() but without taking a token"""
+        if self.burst <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            self._store(key, tokens, now)
+        return 0 if tokens >= 1 else self._retry_after(tokens)
+
+    def consume(self, key):
+        """Take one token; returns 0 if allowed, otherwise the seconds until
+        a token will be available"""
+        if self.burst <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._store(key, tokens, now)
+        if allowed:
+            return 0
+        return self._retry_after(tokens)
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+def _lower_thread_priority(nice):
+    # Linux applies setpriority to a single thread when given its id. The
+    # unpatched get_native_id: under gevent this runs on a real thread.
+    get_native_id = threading.get_native_id
+    if _gevent_patched():
+        from gevent import monkey
+        get_native_id = monkey.get_original('threading', 'get_native_id')
+    try:
+        os.setpriority(os.PRIO_PROCESS, get_native_id(), nice)
+    except (AttributeError, OSError):
+        pass
+
+def _call_niced(nice, function, *args):
+    _lower_thread_priority(nice)
+    return function(*args)
+
+class KDFPool:
+    """Runs password hashing on a few dedicated, low priority threads.
+
+    hashlib releases the GIL while it derives keys, so at most ``workers``
+    threads per process spend CPU on it however many logins arrive at once,
+    and at a lower priority than the request threads so sales are served
+    first. Callers beyond ``max_pending`` are turned away with
+    LoginThrottled instead of piling up on the request threads.
+
+    Under gevent workers the patched threading module only makes
+    greenlets, which would run the hash on the worker's one OS thread and
+    stall every request it serves; the pool is then a gevent ThreadPool of
+    real threads, waited on without blocking the hub. It is built on first
+    use, once gunicorn has patched the worker.
+    """
+
+    def __init__(self, workers=KDF_WORKERS, max_pending=KDF_MAX_PENDING, nice=KDF_NICE):
+        self.workers = workers
+        self.nice = nice
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._run = None
+
+    def _start(self):
+        if _gevent_patched():
+            from gevent.threadpool import ThreadPool
+            pool = ThreadPool(self.workers)
+            return lambda function, *args: pool.apply(_call_niced, (self.nice, function) + args)
+        executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='kdf',
+            initializer=_lower_thread_priority, initargs=(self.nice,)
+        )
+        return lambda function, *args: executor.submit(function, *args).result()
+
+    def call(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise LoginThrottled(1, busy=True)
+        try:
+            if self._run is None:
+                with self._lock:
+                    if self._run is None:
+                        self._run = self._start()
+            return self._run(function, *args)
+        finally:
+            self._slots.release()
+
+kdf_pool = KDFPool()
+email_limiter = TokenBucketLimiter(LOGIN_EMAIL_BURST, LOGIN_EMAIL_PER_MINUTE)
+ip_limiter = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+
+def _email_key(email):
+    return (email or '').strip().lower()
+
+def check_login_rate(email, ip):
+    """Raise LoginThrottled if this address tried too often or this email
+    failed too often. Every attempt counts against the address; only
+    failures count against the email (record_failed_login), so a user
+    logging in on several tills is not locked out."""
+    retry_after = max(ip_limiter.consume(ip), email_limiter.check(_email_key(email)))
+    if retry_after:
+        raise LoginThrottled(retry_after)
+
+def record_failed_login(email):
+    email_limiter.consume(_email_key(email))
+
+def hash_password(password):
+    return kdf_pool.call(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(user, password):
+    if not user.password_hash:
+        return False
+    return kdf_pool.call(check_password_hash, user.password_hash, password)
+
+_hash_prefix = None
+
+def needs_rehash(password_hash):
+    """True if ``password_hash`` was not made with PASSWORD_HASH_METHOD"""
+    global _hash_prefix
+    if _hash_prefix is None:
+        # werkzeug fills in default parameters ("scrypt" -> "scrypt:32768:8:1"),
+        # so normalize the configured method once by hashing with it
+        _hash_prefix = hash_password('').split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _hash_prefix
+
+def upgrade_password_hash(user, password):
+    """Rehash with PASSWORD_HASH_METHOD after a successful login if the
+    stored hash uses other parameters. Best effort: skipped while the KDF
+    pool is busy. Returns True if ``user`` was changed."""
+    try:
+        if needs_rehash(user.password_hash):
+            user.password_hash = hash_password(password)
+            return True
+    except LoginThrottled:
+        pass
+    return False
@@ -0,0 +1,115 @@
+"""Units sold per second: one request per unit against cart checkout.
+
+Sells ``--units`` units through /api/decrease, one unit per request, then
+the same number of units through /api/sales/batch in carts of each of the
+``--cart-sizes`` (distinct beverages, one unit each, with an idempotency
+key like the tills send). Reports units per second, requests and p50/p99
+latency per request, and checks that every unit reached the ledger.
+Prints a JSON report:
+
+    python bench/batch_sale.py --units 2000 --cart-sizes 1 5 20
+    python bench/batch_sale.py --database-url postgresql://localhost/bench
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+from contention import login, percentile  # noqa: E402
+
+def units_sold(db, models):
+    return db.session.scalar(
+        db.select(db.func.coalesce(db.func.sum(-models.Transaction.quantity_change), 0))
+        .where(models.Transaction.transaction_type == 'sale')
+    )
+
+def measure(app, sell, units):
+    """Run ``sell`` until ``units`` units are sold; ``sell`` returns the
+    units of one request"""
+    from app import db
+    import models
+
+    with app.app_context():
+        before = units_sold(db, models)
+    latencies = []
+    sold = 0
+    start = time.perf_counter()
+    while sold < units:
+        request_start = time.perf_counter()
+        sold += sell()
+        latencies.append(time.perf_counter() - request_start)
+    seconds = time.perf_counter() - start
+    with app.app_context():
+        recorded = units_sold(db, models) - before
+    return {
+        'units': sold,
+        'requests': len(latencies),
+        'units_per_second': round(sold / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'ok': recorded == sold,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--units', type=int, default=2000)
+    parser.add_argument('--cart-sizes', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--beverages', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(users=1, beverages=max(args.beverages, *args.cart_sizes),
+                         transactions=1000, days=30, seed=args.seed)
+        beverage_ids = db.session.scalars(db.select(models.Beverage.id)).all()
+    http = login(app, 0)
+    rng = random.Random(args.seed)
+
+    def single():
+        response = http.post(f"/api/decrease/{rng.choice(beverage_ids)}")
+        assert response.status_code == 200, f"decrease: {response.status_code}"
+        return 1
+
+    def cart(size):
+        def sell():
+            items = [{'beverage_id': beverage_id, 'quantity': 1} for beverage_id in rng.sample(beverage_ids, size)]
+            response = http.post('/api/sales/batch', json={'idempotency_key': uuid.uuid4().hex, 'items': items})
+            assert response.status_code == 200, f"batch: {response.status_code}"
+            return size
+        return sell
+
+    report = {'backend': database_url.split(':', 1)[0], 'units': args.units}
+    print("one unit per request...", file=sys.stderr)
+    report['single_unit'] = measure(app, single, args.units)
+    for size in args.cart_sizes:
+        print(f"carts of {size}...", file=sys.stderr)
+        result = measure(app, cart(size), args.units)
+        result['speedup'] = round(result['units_per_second'] / report['single_unit']['units_per_second'], 2)
+        report[f"batch_{size}"] = result
+    print(json.dumps(report, indent=2))
+    if not all(result['ok'] for result in report.values() if isinstance(result, dict)):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Concurrent single-unit sales across several beverages until they run out.
+
+Sells each of ``--beverages`` down to ``--stock`` units, then runs
+``--writers`` threads posting /api/decrease for random beverages until
+every beverage is refused as out of stock, while one more client posts
+``--restocks`` restocks of ``--restock-units`` units through the restock
+form. Checks that no stock went below zero, that for every beverage the
+sales acknowledged and the sale transactions recorded are the same number
+and that the stock moved by exactly the units restocked minus the units
+sold: a restock overwriting a concurrent sale, or the other way round,
+shows up here. Prints a JSON report with sales per second and latency:
+
+    python bench/concurrent_sales.py --writers 16
+    python bench/concurrent_sales.py --database-url postgresql://localhost/bench --writers 64
+
+Exits with status 1 when a check fails.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+from contention import login, percentile  # noqa: E402
+
+def stock_levels(beverage_ids):
+    from app import db
+    import models
+    import stock_slot_service
+
+    return dict(db.session.execute(
+        db.select(models.Beverage.id, stock_slot_service.current_quantity())
+        .where(models.Beverage.id.in_(beverage_ids))
+    ).all())
+
+def restock_during(http, beverage_ids, restocks, units, rng, ready):
+    """Post ``restocks`` restocks of random beverages once the sellers
+    start; returns the HTTP errors"""
+    from app import db
+    import models
+
+    names = dict(db.session.execute(
+        db.select(models.Beverage.id, models.Beverage.name).where(models.Beverage.id.in_(beverage_ids))
+    ).all())
+    errors = []
+    ready.wait()
+    for _ in range(restocks):
+        beverage_id = rng.choice(beverage_ids)
+        response = http.post('/api/restock', data={
+            'beverage_id': beverage_id, 'name': names[beverage_id], 'quantity': units, 'price': 1.5,
+        })
+        if response.status_code != 302:
+            errors.append(response.status_code)
+    return errors
+
+def sell_out(clients, beverage_ids, seed, restocker=None):
+    """Every client sells random beverages, dropping the ones refused as
+    out of stock, until none is left, while ``restocker(ready)`` runs
+    alongside; returns (sales per beverage, latencies, errors, seconds)"""
+    sold = Counter()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    ready = threading.Barrier(len(clients) + 1 + (restocker is not None))
+
+    def writer(http, rng):
+        available = list(beverage_ids)
+        ready.wait()
+        while available:
+            beverage_id = rng.choice(available)
+            start = time.perf_counter()
+            response = http.post(f"/api/decrease/{beverage_id}")
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    sold[beverage_id] += 1
+                    latencies.append(elapsed)
+                elif response.status_code == 400:
+                    available.remove(beverage_id)
+                else:
+                    errors.append(response.status_code)
+                    return
+
+    threads = [threading.Thread(target=writer, args=(http, random.Random(seed + index)))
+               for index, http in enumerate(clients)]
+    if restocker is not None:
+        def restock():
+            errors.extend(restocker(ready))
+        threads.append(threading.Thread(target=restock))
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return sold, latencies, errors, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--beverages', type=int, default=8)
+    parser.add_argument('--stock', type=int, default=250, help="units of each beverage to sell")
+    parser.add_argument('--restocks', type=int, default=40)
+    parser.add_argument('--restock-units', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import inventory_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(users=args.writers + 1, beverages=args.beverages, transactions=1000, days=30, seed=args.seed)
+        user_id = db.session.scalars(db.select(models.User.id)).first()
+        beverage_ids = db.session.scalars(db.select(models.Beverage.id).order_by(models.Beverage.id)).all()
+        # Down to --stock through the ledger, so the drift check still holds
+        for beverage_id, quantity in stock_levels(beverage_ids).items():
+            inventory_service.record_sale(beverage_id, user_id, quantity - args.stock)
+        db.session.commit()
+        before = stock_levels(beverage_ids)
+        last_transaction = db.session.scalar(db.select(db.func.max(models.Transaction.id)))
+    # One after another: concurrent logins queue for the password hash
+    clients = [login(app, index) for index in range(args.writers)]
+    restocker = login(app, args.writers)
+
+    def restocks(ready):
+        with app.app_context():
+            return restock_during(restocker, beverage_ids, args.restocks, args.restock_units,
+                                  random.Random(args.seed - 1), ready)
+
+    print(f"{args.writers} writers selling {args.beverages} x {args.stock} units, "
+          f"{args.restocks} restocks...", file=sys.stderr)
+    sold, latencies, errors, seconds = sell_out(clients, beverage_ids, args.seed, restocks)
+
+    with app.app_context():
+        after = stock_levels(beverage_ids)
+        recorded, restocked = (dict(db.session.execute(
+            db.select(models.Transaction.beverage_id, db.func.sum(db.func.abs(models.Transaction.quantity_change)))
+            .where(models.Transaction.id > last_transaction, models.Transaction.transaction_type == transaction_type)
+            .group_by(models.Transaction.beverage_id)
+        ).all()) for transaction_type in ('sale', 'restock'))
+        drift = inventory_service.check_stock_drift()
+
+    mismatched = [
+        beverage_id for beverage_id in beverage_ids
+        if not sold[beverage_id] == recorded.get(beverage_id, 0)
+        == before[beverage_id] + restocked.get(beverage_id, 0) - after[beverage_id]
+    ]
+    report = {
+        'backend': database_url.split(':', 1)[0],
+        'writers': args.writers,
+        'beverages': args.beverages,
+        'stock': args.stock,
+        'sold': sum(sold.values()),
+        'restocked': sum(restocked.values()),
+        'seconds': round(seconds, 2),
+        'sales_per_second': round(sum(sold.values()) / seconds, 1) if seconds else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'errors': len(errors),
+        'lowest_stock': min(after.values()),
+        'mismatched_beverages': mismatched,
+        'drift': len(drift),
+    }
+    # Without errors every writer kept selling until each beverage was
+    # refused; units restocked after that are all that can be left
+    report['ok'] = (report['lowest_stock'] >= 0 and not mismatched and not drift
+                    and (bool(errors) or sum(after.values()) <= sum(restocked.values())))
+    print(json.dumps(report, indent=2))
+    if not report['ok']:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
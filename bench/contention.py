@@ -0,0 +1,163 @@
+"""Sales of one best seller from many tills: single row against stock slots.
+
+Runs ``--writers`` threads posting /api/decrease for the same beverage for
+``--duration`` seconds, first with its stock in its own row and then split
+across each of the ``--slots`` counts (see stock_slot_service). Reports
+sales per second and p50/p99 latency, then sells the beverage down from
+``--drain-stock`` units with all writers at once and checks that exactly
+that many sales succeed and no slot goes below zero. Prints a JSON report:
+
+    python bench/contention.py --writers 32 --slots 8 32
+    python bench/contention.py --database-url postgresql://localhost/bench --writers 64
+
+On SQLite every write locks the whole database, so slots cannot help
+there; the comparison is meant for Postgres.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def login(app, index):
+    http = app.test_client()
+    response = http.post('/login', data={'email': dataset.bench_email(index), 'password': dataset.BENCH_PASSWORD})
+    assert response.status_code == 302, f"login: {response.status_code}"
+    return http
+
+def hammer(clients, beverage_id, duration=None):
+    """Every client sells ``beverage_id`` until the deadline or, without
+    one, until it is refused or fails; returns (latencies of sales,
+    refusals, errors)"""
+    latencies = []
+    refused = []
+    errors = []
+    ready = threading.Barrier(len(clients) + 1)
+    deadline = []
+
+    def writer(http):
+        ready.wait()
+        while time.perf_counter() < deadline[0]:
+            start = time.perf_counter()
+            response = http.post(f"/api/decrease/{beverage_id}")
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                (refused if response.status_code == 400 else errors).append(response.status_code)
+                if duration is None:
+                    return
+
+    threads = [threading.Thread(target=writer, args=(http,)) for http in clients]
+    for thread in threads:
+        thread.start()
+    deadline.append(time.perf_counter() + (duration if duration is not None else 3600))
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    return latencies, refused, errors
+
+def run(args, app, clients, beverage_id, slots):
+    from app import db
+    import models
+    import inventory_service
+    import stock_slot_service
+
+    with app.app_context():
+        stock_slot_service.resize(beverage_id, slots)
+        db.session.commit()
+        user_id = db.session.scalars(db.select(models.User.id)).first()
+
+    latencies, _, errors = hammer(clients, beverage_id, args.duration)
+    result = {
+        'sales_per_second': round(len(latencies) / args.duration, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'errors': len(errors),
+    }
+
+    # Sell down to --drain-stock, then let every writer race for the rest
+    with app.app_context():
+        stock = db.session.scalar(
+            db.select(stock_slot_service.current_quantity()).where(models.Beverage.id == beverage_id))
+        inventory_service.record_sale(beverage_id, user_id, stock - args.drain_stock)
+        db.session.commit()
+    latencies, _, errors = hammer(clients, beverage_id)
+    with app.app_context():
+        left = db.session.scalar(
+            db.select(stock_slot_service.current_quantity()).where(models.Beverage.id == beverage_id))
+        lowest_slot = db.session.scalar(
+            db.select(db.func.min(models.StockSlot.quantity)).where(models.StockSlot.beverage_id == beverage_id))
+        drift = inventory_service.check_stock_drift()
+    result['drain'] = {
+        'stock': args.drain_stock, 'sold': len(latencies), 'left': left, 'errors': len(errors),
+        # A writer stops at its first error, so with errors some stock may be left
+        'ok': len(latencies) + left == args.drain_stock and (lowest_slot or 0) >= 0 and not drift
+              and (left == 0 or bool(errors)),
+    }
+
+    # Restock for the next run
+    clients[0].post('/api/restock', data={'name': 'x', 'beverage_id': beverage_id,
+                                          'quantity': dataset.INITIAL_STOCK, 'price': 1})
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--writers', type=int, default=32)
+    parser.add_argument('--slots', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--drain-stock', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import models
+    import stock_slot_service
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(users=args.writers, beverages=10, transactions=1000, days=30, seed=args.seed)
+        beverage_id = db.session.scalars(db.select(models.Beverage.id).order_by(models.Beverage.id)).first()
+    # One after another: concurrent logins queue for the password hash
+    clients = [login(app, index) for index in range(args.writers)]
+    # Part of the cost of slots: the cached total is kept up to date
+    stock_slot_service.start_refresher(app)
+
+    report = {'writers': args.writers, 'duration': args.duration, 'backend': database_url.split(':', 1)[0]}
+    print("single row...", file=sys.stderr)
+    report['single_row'] = run(args, app, clients, beverage_id, 0)
+    for slots in args.slots:
+        print(f"{slots} slots...", file=sys.stderr)
+        report[f"slots_{slots}"] = run(args, app, clients, beverage_id, slots)
+    baseline = report['single_row']
+    for key, result in report.items():
+        if key.startswith('slots_'):
+            result['speedup'] = round(result['sales_per_second'] / baseline['sales_per_second'], 2) \
+                if baseline['sales_per_second'] else None
+            result['p99_vs_single_row'] = round(result['p99_ms'] / baseline['p99_ms'], 2) \
+                if baseline['p99_ms'] else None
+    print(json.dumps(report, indent=2))
+    if not all(result['drain']['ok'] for result in report.values() if isinstance(result, dict)):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Seeded synthetic dataset for benchmarks.
+
+Fills a database with users, beverages and a sales history whose volume
+follows the day of the week and the time of day of a real bar (lunch and
+evening peaks, busier weekends) with a few best sellers. The same seed
+always produces the same data, so runs on different commits or backends
+are comparable:
+
+    python bench/dataset.py --database-url sqlite:////tmp/bench.db --transactions 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_PASSWORD = 'benchmark'
+INSERT_BATCH_ROWS = 10000
+INITIAL_STOCK = 1000000  # high enough that sale benchmarks never run out
+
+# Relative sales volume per hour of the day and per weekday (Monday first)
+HOUR_WEIGHTS = [
+    0.2, 0.1, 0.05, 0, 0, 0, 0, 0.1, 0.6, 0.8, 0.9, 1.2,
+    2.5, 3.0, 2.2, 1.0, 0.9, 1.1, 1.8, 2.6, 3.2, 2.8, 1.6, 0.6,
+]
+WEEKDAY_WEIGHTS = [0.8, 0.85, 0.9, 1.0, 1.4, 1.6, 1.1]
+
+RESTOCK_FRACTION = 0.01
+
+def bench_email(index):
+    return f"bench{index}@ejemplo.com"
+
+def daily_counts(rng, total, days, end):
+    """Split ``total`` rows across the last ``days`` days by weekday weight"""
+    start = (end - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+    weights = [WEEKDAY_WEIGHTS[date.weekday()] * rng.uniform(0.85, 1.15) for date in dates]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    counts[-1] += total - sum(counts)
+    return list(zip(dates, counts))
+
+def generate(users=20, beverages=50, transactions=100000, days=365, seed=42, end=None, names=None):
+    """Replace the contents of the current app's database with a synthetic
+    dataset. Must run inside an app context. ``names`` replaces the default
+    "Bebida 001"... beverage names."""
+    from app import db
+    import models
+    import inventory_service
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    end = end or datetime.utcnow()
+
+    for model in (models.StockSlot, models.JournalCheckpoint, models.TransactionArchive, models.StockSnapshot, models.DailyRollup, models.SaleBatch, models.Transaction, models.Beverage, models.User):
+        db.session.execute(db.delete(model))
+
+    # Hashing is deliberately slow, so every user shares one hash
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    db.session.execute(db.insert(models.User), [
+        {'email': bench_email(index), 'password_hash': password_hash, 'is_active': True}
+        for index in range(users)
+    ])
+    # Ids come from the database so that its sequences stay in step
+    db.session.execute(db.insert(models.Beverage), [
+        {
+            'name': names[index] if names else f"Bebida {index + 1:03d}", 'quantity': INITIAL_STOCK,
+            'price': round(rng.uniform(1.0, 4.5), 2), 'image_path': 'default_beverage.png',
+            'image_variants_ready': False, 'is_active': True, 'version': 0,
+        }
+        for index in range(beverages)
+    ])
+    user_ids = db.session.scalars(db.select(models.User.id).order_by(models.User.id)).all()
+    beverage_ids = db.session.scalars(db.select(models.Beverage.id).order_by(models.Beverage.id)).all()
+
+    # A handful of best sellers: Zipf-like popularity
+    rng.shuffle(beverage_ids)
+    popularity = [1 / (rank + 1) ** 0.9 for rank in range(beverages)]
+    hours = list(range(24))
+
+    batch = []
+    inserted = 0
+    for date, count in daily_counts(rng, transactions, days, end):
+        day_rows = []
+        for _ in range(count):
+            timestamp = date + timedelta(
+                hours=rng.choices(hours, HOUR_WEIGHTS)[0],
+                seconds=rng.randrange(3600)
+            )
+            beverage_id = rng.choices(beverage_ids, popularity)[0]
+            if rng.random() < RESTOCK_FRACTION:
+                # Restocking is done by the first user (the manager)
+                day_rows.append((timestamp, beverage_id, user_ids[0], rng.choice((24, 48, 96)), 'restock'))
+            else:
+                units = 1 if rng.random() < 0.9 else 2
+                day_rows.append((timestamp, beverage_id, rng.choice(user_ids), -units, 'sale'))
+        day_rows.sort()
+        for timestamp, beverage_id, user_id, change, transaction_type in day_rows:
+            batch.append({
+                'beverage_id': beverage_id, 'user_id': user_id, 'quantity_change': change,
+                'timestamp': timestamp, 'transaction_type': transaction_type,
+            })
+            if len(batch) == INSERT_BATCH_ROWS:
+                db.session.execute(db.insert(models.Transaction), batch)
+                inserted += len(batch)
+                batch = []
+    if batch:
+        db.session.execute(db.insert(models.Transaction), batch)
+        inserted += len(batch)
+    db.session.commit()
+
+    # Beverages start with INITIAL_STOCK before the generated history
+    db.session.execute(db.insert(models.StockSnapshot), [
+        {'beverage_id': beverage_id, 'taken_at': inventory_service.LEDGER_EPOCH, 'quantity': INITIAL_STOCK}
+        for beverage_id in beverage_ids
+    ])
+    totals = db.session.query(
+        models.Transaction.beverage_id, db.func.sum(models.Transaction.quantity_change)
+    ).group_by(models.Transaction.beverage_id).all()
+    for beverage_id, change in totals:
+        db.session.execute(
+            db.update(models.Beverage).where(models.Beverage.id == beverage_id)
+            .values(quantity=INITIAL_STOCK + int(change))
+        )
+    db.session.commit()
+
+    inventory_service.rebuild_rollup()
+    inventory_service.rebuild_stock_snapshots()
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('ANALYZE')
+    else:
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+    return {
+        'users': users,
+        'beverages': beverages,
+        'transactions': inserted,
+        'days': days,
+        'seed': seed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--beverages', type=int, default=50)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import create_app
+    from update_schema import update_schema
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    start = time.perf_counter()
+    with app.app_context():
+        dataset = generate(args.users, args.beverages, args.transactions, args.days, args.seed)
+    print(f"Generated {dataset['transactions']} transactions in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Forecast load and refresh times for many beverages.
+
+Generates a sales history (see dataset.py), then times a full load of the
+forecast (queries and NumPy computation for every beverage at once), an
+incremental refresh after a burst of new sales and the /api/forecast
+response, and prints a JSON report:
+
+    python bench/forecast.py --beverages 2000 --transactions 2000000 --days 730
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+def timed(function, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, {
+        'median_ms': round(statistics.median(timings) * 1000, 1),
+        'max_ms': round(max(timings) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--reuse-data', action='store_true',
+                        help="benchmark the data already in --database-url")
+    parser.add_argument('--beverages', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=500000)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--new-sales', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'forecast.db')}"
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import forecast_service
+    import inventory_service
+    import models
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+
+    with app.app_context():
+        if args.reuse_data:
+            data = {'transactions': db.session.query(db.func.count(models.Transaction.id)).scalar()}
+        else:
+            print(f"Generating {args.transactions} transactions for {args.beverages} beverages...", file=sys.stderr)
+            data = dataset.generate(beverages=args.beverages, transactions=args.transactions,
+                                    days=args.days, seed=args.seed)
+        rollup_rows = db.session.query(db.func.count()).select_from(models.DailyRollup).scalar()
+        report = {'dataset': data, 'rollup_rows': rollup_rows, 'backend': database_url.split(':', 1)[0]}
+
+        forecast, report['full_load'] = timed(lambda: forecast_service.Forecast.load(datetime.utcnow()), args.rounds)
+        report['compute'] = timed(lambda: forecast._compute(datetime.utcnow()), args.rounds)[1]
+
+        user_id = db.session.query(models.User.id).first()[0]
+        beverage_ids = forecast.beverage_ids
+        for index in range(args.new_sales):
+            inventory_service.record_sale(beverage_ids[index % len(beverage_ids)], user_id)
+        db.session.commit()
+        updated, report['incremental_refresh'] = timed(
+            lambda: forecast.with_new_sales(datetime.utcnow()), args.rounds)
+        report['incremental_refresh']['new_sales'] = args.new_sales
+
+        beverages = models.Beverage.query.all()
+        forecast_service.forecast_cache.get()
+        rows, report['forecast_rows'] = timed(lambda: forecast_service.forecast_rows(beverages), args.rounds)
+        report['low_stock'] = sum(row['low_stock'] for row in rows)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
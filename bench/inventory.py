@@ -0,0 +1,111 @@
+"""Inventory page latency with a large catalogue.
+
+Generates ``--beverages`` beverages (500 by default), points a share of
+them at image files that do not exist, then times GET / and GET
+/api/inventory rendered in full and revalidated with If-None-Match (304).
+Counts the SQL statements of each request and checks that the page stays
+read only: no INSERT/UPDATE/DELETE and the missing images are left for the
+reconciler. Prints a JSON report:
+
+    python bench/inventory.py --beverages 500
+    python bench/inventory.py --database-url postgresql://localhost/bench --beverages 500
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+from contention import login  # noqa: E402
+from run import measure  # noqa: E402
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--beverages', type=int, default=500)
+    parser.add_argument('--missing-images', type=float, default=0.1,
+                        help="share of beverages whose image file does not exist")
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from sqlalchemy import event
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url, 'UPLOAD_FOLDER': folder, 'START_BACKGROUND_JOBS': False,
+    })
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(users=1, beverages=args.beverages, transactions=10000, days=30, seed=args.seed)
+        missing = db.session.scalars(
+            db.select(models.Beverage.id).order_by(models.Beverage.id)
+            .limit(int(args.beverages * args.missing_images))
+        ).all()
+        for beverage_id in missing:
+            db.session.execute(
+                db.update(models.Beverage).where(models.Beverage.id == beverage_id)
+                .values(image_path=f"uploads/missing-{beverage_id}.png")
+            )
+        db.session.commit()
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda connection, cursor, statement, *rest: statements.append(statement))
+
+    http = login(app, 0)
+
+    def timed(path, revalidate):
+        etag = http.get(path).headers['ETag']
+        headers = {'If-None-Match': etag} if revalidate else {}
+        status = 304 if revalidate else 200
+
+        def request():
+            response = http.get(path, headers=headers)
+            assert response.status_code == status, f"{path}: {response.status_code}"
+            return response.get_data()
+        return request
+
+    report = {'backend': database_url.split(':', 1)[0], 'beverages': args.beverages,
+              'missing_images': len(missing)}
+    for name, path, revalidate in (
+        ('inventory_page', '/', False),
+        ('inventory_page_304', '/', True),
+        ('inventory_json', '/api/inventory', False),
+        ('inventory_json_304', '/api/inventory', True),
+    ):
+        print(f"{name}...", file=sys.stderr)
+        request = timed(path, revalidate)
+        result = measure(request, args.rounds, warmup=3)
+        del statements[:]
+        result['bytes'] = len(request())
+        result['statements'] = len(statements)
+        result['writes'] = sum(1 for statement in statements if statement.lstrip().upper().startswith(WRITES))
+        report[name] = result
+
+    with app.app_context():
+        untouched = db.session.scalar(
+            db.select(db.func.count()).select_from(models.Beverage)
+            .where(models.Beverage.id.in_(missing), models.Beverage.image_path.like('uploads/missing-%'))
+        )
+    report['ok'] = untouched == len(missing) and not any(
+        result['writes'] for result in report.values() if isinstance(result, dict))
+    print(json.dumps(report, indent=2))
+    if not report['ok']:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Sale throughput with one commit per sale against the sale journal.
+
+Runs ``--clients`` threads posting /api/decrease for ``--duration``
+seconds, first in the default mode (one database commit per sale) and then
+in write-behind mode (SALE_JOURNAL_DIR) with each of the ``--group-sizes``.
+Reports acknowledged sales per second, p50/p99 latency, database commits
+and how long the flusher took to catch up, checks that every acknowledged
+sale reached the database and prints a JSON report:
+
+    python bench/journal.py --group-sizes 1 10 100 1000
+    python bench/journal.py --database-url postgresql://localhost/bench --journal-dir /var/lib/bar/journal
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def sale_count(db, models):
+    return db.session.query(db.func.count(models.Transaction.id)).filter(
+        models.Transaction.transaction_type == 'sale').scalar()
+
+def run(args, database_url, journal_dir, group_size):
+    from sqlalchemy import event
+    from app import create_app, db
+    from update_schema import update_schema
+    import models
+
+    config = {'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False}
+    setup = create_app(config)
+    update_schema(setup)
+    with setup.app_context():
+        dataset.generate(users=args.clients, beverages=args.beverages, transactions=1000, days=30, seed=args.seed)
+        beverage_ids = db.session.scalars(db.select(models.Beverage.id)).all()
+        before = sale_count(db, models)
+
+    if journal_dir:
+        config.update({'SALE_JOURNAL_DIR': journal_dir, 'SALE_JOURNAL_GROUP_SIZE': group_size,
+                       'WEB_CONCURRENCY': 1})
+    app = create_app(config)
+    commits = []
+    with app.app_context():
+        event.listen(db.engine, 'commit', lambda connection: commits.append(1))
+
+    latencies = []
+    errors = []
+    ready = threading.Barrier(args.clients + 1)
+    deadline = []
+
+    def client(index):
+        rng = random.Random(index)
+        http = app.test_client()
+        http.post('/login', data={'email': dataset.bench_email(index), 'password': dataset.BENCH_PASSWORD})
+        ready.wait()
+        ready.wait()
+        while time.perf_counter() < deadline[0]:
+            start = time.perf_counter()
+            response = http.post(f"/api/decrease/{rng.choice(beverage_ids)}")
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    # Logged in: count from here
+    ready.wait()
+    del commits[:]
+    deadline.append(time.perf_counter() + args.duration)
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    sold = len(latencies)
+
+    result = {
+        'sales_per_second': round(sold / args.duration, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'errors': len(errors),
+    }
+    journal = app.extensions.get('sale_journal')
+    if journal is not None:
+        start = time.perf_counter()
+        journal.stop()
+        result['drain_seconds'] = round(time.perf_counter() - start, 3)
+    result['commits'] = len(commits)
+    with setup.app_context():
+        result['all_sales_stored'] = sale_count(db, models) - before == sold
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--journal-dir', help="default: a temporary directory")
+    parser.add_argument('--group-sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--beverages', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    import auth_service
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+    journal_dir = args.journal_dir or os.path.join(folder, 'journal')
+
+    report = {'clients': args.clients, 'duration': args.duration, 'backend': database_url.split(':', 1)[0]}
+    print("commit per sale...", file=sys.stderr)
+    report['commit_per_sale'] = run(args, database_url, None, None)
+    for group_size in args.group_sizes:
+        print(f"journal, group size {group_size}...", file=sys.stderr)
+        report[f"journal_group_{group_size}"] = run(args, database_url, journal_dir, group_size)
+    baseline = report['commit_per_sale']['sales_per_second']
+    for key, result in report.items():
+        if key.startswith('journal_'):
+            result['speedup'] = round(result['sales_per_second'] / baseline, 2) if baseline else None
+    print(json.dumps(report, indent=2))
+    if not all(result['all_sales_stored'] for key, result in report.items() if isinstance(result, dict)):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Point-in-time stock: snapshot + delta against a full scan.
+
+Generates several years of history (see dataset.py), then answers "stock
+at instant X" for random instants both with the ledger query
+(inventory_service.stock_as_of) and naively by summing every earlier
+transaction, checks that both agree and prints a JSON report:
+
+    python bench/ledger.py --days 1095 --transactions 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+def naive_stock(at, beverage_ids=None):
+    """Opening balance plus every transaction before ``at``"""
+    from app import db
+    import inventory_service
+    import models
+
+    query = db.session.query(
+        models.Transaction.beverage_id, db.func.sum(models.Transaction.quantity_change)
+    ).filter(models.Transaction.timestamp < at)
+    if beverage_ids is not None:
+        query = query.filter(models.Transaction.beverage_id.in_(beverage_ids))
+    stock = {beverage_id: int(change) for beverage_id, change in query.group_by(models.Transaction.beverage_id)}
+    opening = db.session.query(models.StockSnapshot.beverage_id, models.StockSnapshot.quantity).filter(
+        models.StockSnapshot.taken_at == inventory_service.LEDGER_EPOCH
+    )
+    for beverage_id, quantity in opening:
+        if beverage_ids is None or beverage_id in beverage_ids:
+            stock[beverage_id] = stock.get(beverage_id, 0) + quantity
+    return stock
+
+def timed(function, instants):
+    timings = []
+    results = []
+    for at in instants:
+        start = time.perf_counter()
+        results.append(function(at))
+        timings.append(time.perf_counter() - start)
+    return results, {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p99_ms': round(sorted(timings)[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--days', type=int, default=1095)
+    parser.add_argument('--transactions', type=int, default=300000)
+    parser.add_argument('--beverages', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'ledger.db')}"
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import inventory_service
+    import models
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+
+    with app.app_context():
+        print(f"Generating {args.transactions} transactions over {args.days} days...", file=sys.stderr)
+        data = dataset.generate(beverages=args.beverages, transactions=args.transactions,
+                                days=args.days, seed=args.seed)
+        first, last = db.session.query(
+            db.func.min(models.Transaction.timestamp), db.func.max(models.Transaction.timestamp)
+        ).one()
+        rng = random.Random(args.seed)
+        span = (last - first).total_seconds()
+        instants = [first + timedelta(seconds=rng.uniform(0, span)) for _ in range(args.queries)]
+        beverage_id = db.session.query(models.Beverage.id).first()[0]
+
+        report = {'dataset': data, 'queries': args.queries, 'backend': database_url.split(':', 1)[0]}
+        for label, ids in (('all_beverages', None), ('one_beverage', [beverage_id])):
+            ledger, ledger_timing = timed(lambda at: inventory_service.stock_as_of(at, ids), instants)
+            naive, naive_timing = timed(lambda at: naive_stock(at, ids), instants)
+            mismatches = sum(
+                1 for expected, actual in zip(naive, ledger)
+                if any(actual.get(key, 0) != value for key, value in expected.items())
+            )
+            report[label] = {
+                'snapshot_delta': ledger_timing,
+                'full_scan': naive_timing,
+                'speedup': round(naive_timing['median_ms'] / max(ledger_timing['median_ms'], 0.001), 1),
+                'mismatches': mismatches,
+            }
+        drift = inventory_service.check_stock_drift()
+        report['drift'] = len(drift)
+
+    print(json.dumps(report, indent=2))
+    if report['drift'] or report['all_beverages']['mismatches'] or report['one_beverage']['mismatches']:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Concurrent load test against a running server.
+
+Logs in, then has ``--clients`` threads alternate inventory GETs and sale
+POSTs for ``--duration`` seconds and reports throughput and p50/p99
+latency per request type. Run against the production entry point, e.g.:
+
+    gunicorn -c gunicorn.conf.py main:app
+    python bench/loadtest.py --url http://localhost:5000 --email a@b.c --password secret
+"""
+import argparse
+import http.client
+import json
+import random
+import re
+import statistics
+import threading
+import time
+import urllib.parse
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class Client:
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{k}={v}" for k, v in self.cookies.items())
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            raise
+        data = response.read()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = header.split(';', 1)[0].partition('=')
+            self.cookies[name] = value
+        return response.status, data
+
+    def login(self, email, password):
+        body = urllib.parse.urlencode({'email': email, 'password': password})
+        status, _ = self.request('POST', '/login', body,
+                                 {'Content-Type': 'application/x-www-form-urlencoded'})
+        if status != 302:
+            raise SystemExit(f"Login failed with status {status}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--sale-ratio', type=float, default=0.5,
+                        help='fraction of requests that are sales')
+    args = parser.parse_args()
+
+    setup = Client(args.url)
+    setup.login(args.email, args.password)
+    status, page = setup.request('GET', '/')
+    beverage_ids = [int(i) for i in re.findall(rb'data-beverage-id="(\d+)"', page)]
+    if not beverage_ids:
+        raise SystemExit("No active beverages to sell; restock some first")
+
+    latencies = {'inventory GET': [], 'sale POST': []}
+    errors = {'inventory GET': 0, 'sale POST': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        client = Client(args.url)
+        client.login(args.email, args.password)
+        rng = random.Random(index)
+        while time.monotonic() < deadline:
+            if rng.random() < args.sale_ratio:
+                kind = 'sale POST'
+                path = f"/api/decrease/{rng.choice(beverage_ids)}"
+                method = 'POST'
+            else:
+                kind = 'inventory GET'
+                path, method = '/', 'GET'
+            start = time.perf_counter()
+            try:
+                status, _ = client.request(method, path)
+                ok = status < 500
+            except (http.client.HTTPException, OSError):
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[kind].append(elapsed)
+                if not ok:
+                    errors[kind] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+
+    report = {}
+    for kind, values in latencies.items():
+        report[kind] = {
+            'requests': len(values),
+            'errors': errors[kind],
+            'per_second': round(len(values) / wall, 1),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            'mean_ms': round(statistics.mean(values) * 1000, 2) if values else 0.0,
+        }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Sale latency during a login storm, against a running server.
+
+A single till sells continuously, first alone and then while
+``--storm-clients`` threads keep posting logins with wrong passwords. The
+report shows sale p50/p99 for both phases and how the storm's logins were
+answered (200 rejected password, 429 throttled, 503 KDF pool busy).
+
+All requests come from one address, so to measure the KDF pool rather
+than the per-address limit start the server with ``LOGIN_IP_BURST=0``:
+
+    LOGIN_IP_BURST=0 gunicorn -c gunicorn.conf.py main:app
+    python bench/login_storm.py --url http://localhost:5000 --email a@b.c --password secret
+"""
+import argparse
+import http.client
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+from loadtest import Client, percentile
+
+def sell(client, beverage_ids, duration, rng):
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        client.request('POST', f"/api/decrease/{rng.choice(beverage_ids)}")
+        latencies.append(time.perf_counter() - start)
+    return {
+        'sales': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--storm-clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15, help='seconds per phase')
+    args = parser.parse_args()
+
+    till = Client(args.url)
+    till.login(args.email, args.password)
+    _, page = till.request('GET', '/')
+    beverage_ids = [int(i) for i in re.findall(rb'data-beverage-id="(\d+)"', page)]
+    if not beverage_ids:
+        raise SystemExit("No active beverages to sell; restock some first")
+    rng = random.Random(0)
+
+    report = {'idle': sell(till, beverage_ids, args.duration, rng)}
+
+    statuses = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def storm(index):
+        client = Client(args.url)
+        storm_rng = random.Random(index)
+        while not stop.is_set():
+            body = urllib.parse.urlencode({
+                'email': f"storm{storm_rng.randrange(1000)}@ejemplo.com" if storm_rng.random() < 0.5 else args.email,
+                'password': 'incorrecta',
+            })
+            try:
+                status, _ = client.request('POST', '/login', body,
+                                           {'Content-Type': 'application/x-www-form-urlencoded'})
+            except (http.client.HTTPException, OSError):
+                status = 'error'
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=storm, args=(i,), daemon=True) for i in range(args.storm_clients)]
+    for thread in threads:
+        thread.start()
+    try:
+        report['storm'] = sell(till, beverage_ids, args.duration, rng)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    report['storm']['logins'] = {str(status): count for status, count in sorted(statuses.items(), key=str)}
+    report['p99_ratio'] = round(report['storm']['p99_ms'] / max(report['idle']['p99_ms'], 0.01), 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Bulk delivery import against one restock form post per line.
+
+Builds two identical databases (see dataset.py) and a delivery of
+``--lines`` lines for existing and new beverages, applies it to one with
+POST /api/restock/import and to the other with a POST /api/restock per
+line, checks that both end with the same stock and prints a JSON report:
+
+    python bench/restock_import.py --lines 10000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+def delivery_lines(rng, existing, lines, new_fraction):
+    """``lines`` (name, quantity, price) rows; price is only set for new beverages"""
+    new_count = int(len(existing) * new_fraction) or 1
+    new = [(f"Nueva {index + 1:05d}", round(rng.uniform(1.0, 4.5), 2)) for index in range(new_count)]
+    rows = []
+    for _ in range(lines):
+        if rng.random() < new_fraction:
+            name, price = rng.choice(new)
+        else:
+            name, price = rng.choice(existing), None
+        rows.append((name, rng.choice((6, 12, 24, 48)), price))
+    return rows
+
+def stock(db, models):
+    return sorted(db.session.query(models.Beverage.name, models.Beverage.quantity, models.Beverage.price))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--beverages', type=int, default=500)
+    parser.add_argument('--new-fraction', type=float, default=0.2)
+    parser.add_argument('--transactions', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    report = {'lines': args.lines, 'beverages': args.beverages, 'new_fraction': args.new_fraction}
+    results = {}
+    for method in ('form_posts', 'bulk_import'):
+        folder = tempfile.mkdtemp(prefix='bench-')
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(folder, 'bench.db')}",
+            'UPLOAD_FOLDER': os.path.join(ROOT, 'static', 'uploads'),
+            'START_BACKGROUND_JOBS': False,
+        })
+        update_schema(app)
+        with app.app_context():
+            dataset.generate(beverages=args.beverages, transactions=args.transactions, days=90, seed=args.seed)
+            existing = sorted(db.session.scalars(db.select(models.Beverage.name)))
+        rows = delivery_lines(random.Random(args.seed), existing, args.lines, args.new_fraction)
+
+        client = app.test_client()
+        client.post('/login', data={'email': dataset.bench_email(0), 'password': dataset.BENCH_PASSWORD})
+        print(f"{method}...", file=sys.stderr)
+        start = time.perf_counter()
+        if method == 'form_posts':
+            prices = {name: price for name, _, price in rows if price is not None}
+            for name, quantity, _ in rows:
+                # The form sends the current price of existing beverages
+                response = client.post('/api/restock', data={
+                    'name': name, 'quantity': quantity, 'price': prices.get(name, 1.0),
+                })
+                assert response.status_code == 302, response.status_code
+        else:
+            text = io.StringIO()
+            writer = csv.writer(text)
+            writer.writerow(['nombre', 'cantidad', 'precio'])
+            writer.writerows((name, quantity, '' if price is None else price) for name, quantity, price in rows)
+            response = client.post('/api/restock/import', data={
+                'file': (io.BytesIO(text.getvalue().encode()), 'entrega.csv'),
+            }, content_type='multipart/form-data')
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - start
+        report[method] = {'seconds': round(elapsed, 3), 'lines_per_second': round(args.lines / elapsed, 1)}
+        with app.app_context():
+            results[method] = stock(db, models)
+
+    report['speedup'] = round(report['form_posts']['seconds'] / report['bulk_import']['seconds'], 1)
+    report['identical_stock'] = results['form_posts'] == results['bulk_import']
+    print(json.dumps(report, indent=2))
+    if not report['identical_stock']:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""Benchmark scenarios for the main routes.
+
+Generates a seeded dataset (see dataset.py), then times each scenario
+in-process through the Flask test client and writes a JSON report in the
+spirit of pytest-benchmark (min/max/mean/median/stddev/p99 seconds per
+call). Works against SQLite or Postgres:
+
+    python bench/run.py --output before.json
+    python bench/run.py --database-url postgresql://localhost/bench --transactions 1000000
+    python bench/run.py --compare before.json
+    python bench/run.py --transactions 5000000 --only stats_rollup stats_raw
+
+With ``--compare`` the median of every scenario is checked against a
+previous report and the run exits with status 1 when one is more than
+``--max-regression`` slower.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+SCENARIOS = []
+
+def scenario(function):
+    SCENARIOS.append(function)
+    return function
+
+def logged_in_client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'email': dataset.bench_email(0), 'password': dataset.BENCH_PASSWORD})
+    assert response.status_code == 302, f"login failed: {response.status_code}"
+    return client
+
+def check(response, status=200):
+    assert response.status_code == status, f"{response.request.path}: {response.status_code}"
+    return response
+
+# Each scenario receives the app and the dataset and returns the callable
+# to time; setup done here is not measured
+
+@scenario
+def inventory(app, data):
+    client = logged_in_client(app)
+    return lambda: check(client.get('/'))
+
+@scenario
+def decrease_inventory(app, data):
+    client = logged_in_client(app)
+    beverage_ids = data['beverage_ids']
+    rng = random.Random(data['seed'])
+    return lambda: check(client.post(f"/api/decrease/{rng.choice(beverage_ids)}"))
+
+@scenario
+def get_stats(app, data):
+    client = logged_in_client(app)
+    return lambda: check(client.get('/api/stats'))
+
+def history_range(data):
+    """The whole generated history, from midnight ``days`` ago to now"""
+    end = datetime.now()
+    start = datetime.combine((end - timedelta(days=data['days'])).date(), datetime.min.time())
+    return start, end
+
+@scenario
+def stats_rollup(app, data):
+    # Units per beverage over the whole history as /api/stats reads them:
+    # whole days from the daily rollup, raw rows for today only
+    import inventory_service
+
+    start, end = history_range(data)
+    with app.app_context():
+        rollup = {beverage_id: units for beverage_id, _, units in inventory_service.sales_by_beverage(start, end)}
+        raw = {beverage_id: int(units) for beverage_id, units in inventory_service.raw_sales_query(start, end)}
+    assert rollup == raw, "rollup and raw transactions disagree"
+
+    def stats():
+        with app.app_context():
+            return inventory_service.sales_by_beverage(start, end)
+    return stats
+
+@scenario
+def stats_raw(app, data):
+    # The same totals summed from every sale row, as before the rollup
+    import inventory_service
+
+    start, end = history_range(data)
+
+    def stats():
+        with app.app_context():
+            return inventory_service.raw_sales_query(start, end).all()
+    return stats
+
+@scenario
+def export_sales_csv(app, data):
+    client = logged_in_client(app)
+    return lambda: check(client.get('/api/export/sales')).get_data()
+
+@scenario
+def export_transactions_csv(app, data):
+    client = logged_in_client(app)
+    return lambda: check(client.get('/api/export/transactions')).get_data()
+
+@scenario
+def login(app, data):
+    form = {'email': dataset.bench_email(1), 'password': dataset.BENCH_PASSWORD}
+    return lambda: check(app.test_client().post('/login', data=form), 302)
+
+@scenario
+def add_restock_image(app, data):
+    from PIL import Image
+
+    client = logged_in_client(app)
+    beverage_names = data['beverage_names']
+    rng = random.Random(data['seed'])
+
+    def restock():
+        # A new image every call, so the upload is never deduplicated
+        image = io.BytesIO()
+        color = tuple(rng.randrange(256) for _ in range(3))
+        Image.new('RGB', (800, 600), color).save(image, format='JPEG', quality=85)
+        image.seek(0)
+        check(client.post('/api/restock', data={
+            'name': rng.choice(beverage_names), 'quantity': 24, 'price': 1.5,
+            'image': (image, 'bebida.jpg'),
+        }, content_type='multipart/form-data'), 302)
+    return restock
+
+def measure(function, rounds, warmup):
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'rounds': rounds,
+        'min': timings[0],
+        'max': timings[-1],
+        'mean': statistics.mean(timings),
+        'median': statistics.median(timings),
+        'stddev': statistics.stdev(timings) if rounds > 1 else 0.0,
+        'p99': timings[min(rounds - 1, int(rounds * 0.99))],
+        'ops': rounds / sum(timings),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline_path, max_regression):
+    """Print the change of every median against a previous report; returns
+    False if any scenario got slower than allowed"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    ok = True
+    for name, result in report['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if previous is None:
+            print(f"{name}: no baseline")
+            continue
+        change = result['median'] / previous['median'] - 1
+        regressed = change > max_regression
+        ok = ok and not regressed
+        print(f"{name}: {previous['median'] * 1000:.2f} ms -> {result['median'] * 1000:.2f} ms "
+              f"({change:+.1%}){' REGRESSION' if regressed else ''}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--beverages', type=int, default=50)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reuse-data', action='store_true',
+                        help="benchmark the data already in --database-url")
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--export-rounds', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help="scenario names to run")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--compare', help="previous JSON report to compare with")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import image_service
+    import models
+
+    # Every scenario logs in from the same address; login throttling has
+    # its own benchmark (login_storm.py)
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'UPLOAD_FOLDER': folder,
+        'START_BACKGROUND_JOBS': False,
+    })
+    update_schema(app)
+
+    with app.app_context():
+        if args.reuse_data:
+            data = {
+                'transactions': db.session.query(db.func.count(models.Transaction.id)).scalar(),
+                'days': args.days,
+                'seed': args.seed,
+            }
+        else:
+            print(f"Generating {args.transactions} transactions...", file=sys.stderr)
+            data = dataset.generate(args.users, args.beverages, args.transactions, args.days, args.seed)
+        beverages = models.Beverage.query.order_by(models.Beverage.id).all()
+    data['beverage_ids'] = [beverage.id for beverage in beverages]
+    data['beverage_names'] = [beverage.name for beverage in beverages]
+
+    # Exports read the whole month and stats_raw every sale, so they get
+    # fewer rounds
+    long_running = {'export_sales_csv', 'export_transactions_csv', 'stats_raw'}
+    results = {}
+    for function in SCENARIOS:
+        name = function.__name__
+        if args.only and name not in args.only:
+            continue
+        rounds = args.export_rounds if name in long_running else args.rounds
+        warmup = min(args.warmup, rounds)
+        print(f"{name}...", file=sys.stderr)
+        results[name] = measure(function(app, data), rounds, warmup)
+    image_service._get_pool().shutdown(wait=True)
+
+    report = {
+        'commit': git_commit(),
+        'datetime': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'backend': database_url.split(':', 1)[0],
+        'dataset': {key: data[key] for key in ('users', 'beverages', 'transactions', 'days', 'seed') if key in data},
+        'benchmarks': results,
+    }
+    if 'stats_rollup' in results and 'stats_raw' in results:
+        report['stats_rollup_speedup'] = results['stats_raw']['median'] / results['stats_rollup']['median']
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if args.compare and not compare(report, args.compare, args.max_regression):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
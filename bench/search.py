@@ -0,0 +1,138 @@
+"""Beverage search and restock table pagination on large catalogues.
+
+For each of ``--sizes`` generates that many beverages with realistic names
+(brand, kind, variant and size, see dataset.py), then measures the median
+and p99 latency of /api/beverages/search for whole-name prefixes, prefixes
+of a later word, misspelt names and one or two letter queries, of the first
+and a deep page of /api/beverages and of the restock page, and prints a
+JSON report:
+
+    python bench/search.py --sizes 10000 100000
+    python bench/search.py --database-url postgresql://localhost/bench
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+BRANDS = [
+    'Coca', 'Pepsi', 'Fanta', 'Schweppes', 'Mahou', 'Estrella', 'Alhambra', 'Heineken', 'Corona',
+    'Ambar', 'Moritz', 'Damm', 'Aquarius', 'Nestea', 'Trina', 'Kas', 'Solán', 'Lanjarón', 'Bezoya',
+    'Font Vella', 'Red Bull', 'Monster', 'Bacardí', 'Beefeater', 'Larios', 'Tanqueray', 'Havana',
+    'Ballantines', 'Jameson', 'Martini', 'Ruavieja', 'Freixenet', 'Codorníu', 'Rioja', 'Ribera',
+]
+KINDS = [
+    'Cola', 'Naranja', 'Limón', 'Tónica', 'Lager', 'Tostada', 'Sin Alcohol', 'Radler', 'Agua',
+    'Con Gas', 'Té Verde', 'Energética', 'Ron', 'Ginebra', 'Whisky', 'Vermut', 'Cava', 'Tinto',
+    'Blanco', 'Rosado', 'Licor de Hierbas', 'Café', 'Mosto',
+]
+VARIANTS = ['', 'Zero', 'Light', 'Clásica', 'Premium', 'Reserva', 'Especial', 'Original', 'Ecológica']
+SIZES = ['20cl', '25cl', '33cl', '50cl', '75cl', '1L', '1,5L', '2L', 'Barril 30L']
+
+def beverage_names(rng, count):
+    names = set()
+    while len(names) < count:
+        parts = [rng.choice(BRANDS), rng.choice(KINDS), rng.choice(VARIANTS), rng.choice(SIZES)]
+        name = ' '.join(part for part in parts if part)
+        if name in names:
+            name = f"{name} Lote {rng.randint(1, 9999)}"
+        names.add(name)
+    return sorted(names, key=lambda _: rng.random())
+
+def typo(rng, name):
+    """``name`` with two adjacent letters swapped in one of its words"""
+    words = name.split()
+    index = max(range(len(words)), key=lambda i: len(words[i]))
+    word = words[index]
+    if len(word) > 3:
+        position = rng.randrange(1, len(word) - 2)
+        words[index] = word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    return ' '.join(words)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def measure(client, urls):
+    timings = []
+    results = []
+    for url in urls:
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, f"{url}: {response.status_code}"
+        data = response.get_json()
+        if data is not None:
+            results.append(len(data['beverages']))
+    summary = {
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+    }
+    if results:
+        summary['mean_results'] = round(sum(results) / len(results), 1)
+    return summary
+
+def run(args, database_url, size):
+    from app import create_app, db
+    from update_schema import update_schema
+    import models
+    import search_service
+
+    rng = random.Random(args.seed)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    names = beverage_names(rng, size)
+    with app.app_context():
+        dataset.generate(beverages=size, transactions=1000, days=30, seed=args.seed, names=names)
+        backend = search_service._backend()
+
+    client = app.test_client()
+    client.post('/login', data={'email': dataset.bench_email(0), 'password': dataset.BENCH_PASSWORD})
+    sample = rng.sample(names, args.queries)
+    query = lambda text: f"/api/beverages/search?q={text}"  # noqa: E731
+
+    result = {'backend': backend}
+    # The first search builds the in-memory index when there is no pg_trgm
+    start = time.perf_counter()
+    client.get(query('a'))
+    result['first_search_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    result['prefix'] = measure(client, [query(name[:rng.randint(4, 10)]) for name in sample])
+    result['word_prefix'] = measure(client, [query(name.split()[-2][:4]) for name in sample])
+    result['misspelt'] = measure(client, [query(typo(rng, name)) for name in sample])
+    result['short'] = measure(client, [query(name[:rng.randint(1, 2)]) for name in sample])
+    result['first_page'] = measure(client, ['/api/beverages'] * args.queries)
+    deep = sorted(names)[size * 9 // 10]
+    result['deep_page'] = measure(client, [f"/api/beverages?after={deep}"] * args.queries)
+    result['restock_page'] = measure(client, ['/restock'] * args.queries)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    import auth_service
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    report = {}
+    for size in args.sizes:
+        print(f"{size} beverages...", file=sys.stderr)
+        database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')}"
+        report[f"beverages_{size}"] = run(args, database_url, size)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
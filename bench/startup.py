@@ -0,0 +1,87 @@
+"""Startup cost of the application.
+
+Measures, in fresh interpreters, the cumulative import time of ``app``
+(from ``python -X importtime``), the slowest modules it pulls in, the time
+to run ``create_app()`` and the latency of the first request. Prints a
+JSON report so results can be compared between commits:
+
+    python bench/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({'START_BACKGROUND_JOBS': False})
+created = time.perf_counter()
+response = app.test_client().get('/login')
+done = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (done - created) * 1000,
+}))
+"""
+
+def run_python(args, env):
+    return subprocess.run(
+        [sys.executable] + args, cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    )
+
+def import_times(env):
+    """Cumulative import time of ``app`` and its top-level imports, in ms"""
+    stderr = run_python(['-X', 'importtime', '-c', 'import app'], env).stderr
+    # Children are listed before their parent, so collect the direct
+    # imports seen since the previous top-level module
+    total, children, top = 0.0, {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name[1:].rstrip()
+        if not name.startswith(' '):
+            if name == 'app':
+                total, top = int(cumulative) / 1000, children
+            children = {}
+        elif not name.startswith('   '):
+            children[name.strip()] = int(cumulative) / 1000
+    top = dict(sorted(top.items(), key=lambda item: -item[1])[:10])
+    return total, top
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/startup.db")
+
+    totals, samples, top = [], [], {}
+    for _ in range(args.runs):
+        total, top = import_times(env)
+        totals.append(total)
+        samples.append(json.loads(run_python(['-c', FIRST_REQUEST], env).stdout))
+
+    report = {
+        'runs': args.runs,
+        'importtime_app_ms': round(statistics.median(totals), 1),
+        'slowest_imports_ms': {name: round(ms, 1) for name, ms in top.items()},
+    }
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms'):
+        report[key] = round(statistics.median(sample[key] for sample in samples), 1)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
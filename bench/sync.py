@@ -0,0 +1,94 @@
+"""Delta sync against a full inventory reload.
+
+Generates ``--beverages`` beverages (see dataset.py), then measures
+response size (raw and gzipped) and latency of the inventory page,
+/api/inventory and a full /api/sync, and of /api/sync from a cursor after
+``--changes`` sales on random beverages, and prints a JSON report:
+
+    python bench/sync.py --beverages 1000 --changes 1 10 100
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+
+def measure(client, url, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, f"{url}: {response.status_code}"
+    body = response.get_data()
+    return {
+        'bytes': len(body),
+        'gzip_bytes': len(gzip.compress(body)),
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+    }, body
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--beverages', type=int, default=1000)
+    parser.add_argument('--changes', type=int, nargs='+', default=[0, 1, 10, 100])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import inventory_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(beverages=args.beverages, transactions=10000, days=30, seed=args.seed)
+        beverage_ids = db.session.scalars(db.select(models.Beverage.id)).all()
+        user_id = db.session.scalars(db.select(models.User.id)).first()
+
+    client = app.test_client()
+    client.post('/login', data={'email': dataset.bench_email(0), 'password': dataset.BENCH_PASSWORD})
+    report = {'beverages': args.beverages, 'backend': database_url.split(':', 1)[0]}
+    report['inventory_page'] = measure(client, '/', args.rounds)[0]
+    report['api_inventory'] = measure(client, '/api/inventory', args.rounds)[0]
+    report['full_sync'], body = measure(client, '/api/sync?since=0', args.rounds)
+
+    rng = random.Random(args.seed)
+    cursor = json.loads(body)['cursor']
+    for changes in args.changes:
+        with app.app_context():
+            for beverage_id in rng.sample(beverage_ids, changes):
+                inventory_service.record_sale(beverage_id, user_id)
+            db.session.commit()
+        result, body = measure(client, f"/api/sync?since={cursor}", args.rounds)
+        data = json.loads(body)
+        result['beverages'] = len(data['beverages'])
+        report[f"delta_sync_{changes}_changes"] = result
+        cursor = data['cursor']
+
+    full = report['api_inventory']
+    for key, result in report.items():
+        if key.startswith('delta_sync'):
+            result['bytes_vs_api_inventory'] = round(result['bytes'] / full['bytes'], 4)
+            result['latency_vs_api_inventory'] = round(result['median_ms'] / full['median_ms'], 3)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Authenticated request throughput with and without the user cache.
+
+Times a sale (POST /api/decrease) and a revalidated inventory poll (GET
+/api/inventory answered 304, where loading the user is most of the work)
+first with the user cache serving Flask-Login's user_loader and then with
+it disabled (TTL 0: every request loads the user from the database).
+Reports requests per second, SQL statements per request and the cache
+hit/miss counters. Prints a JSON report:
+
+    python bench/user_cache.py --rounds 500
+    python bench/user_cache.py --database-url postgresql://localhost/bench
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataset  # noqa: E402
+from contention import login  # noqa: E402
+from run import measure  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--rounds', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from sqlalchemy import event
+    from app import create_app, db
+    from update_schema import update_schema
+    import auth_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(users=1, beverages=50, transactions=1000, days=30, seed=args.seed)
+        beverage_ids = db.session.scalars(db.select(models.Beverage.id)).all()
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *_: statements.append(1))
+
+    http = login(app, 0)
+    rng = random.Random(args.seed)
+    http.get('/')  # shows the login flash; pages with pending flashes are never 304
+    etag = http.get('/api/inventory').headers['ETag']
+
+    def sale():
+        response = http.post(f"/api/decrease/{rng.choice(beverage_ids)}")
+        assert response.status_code == 200, f"decrease: {response.status_code}"
+
+    def poll():
+        response = http.get('/api/inventory', headers={'If-None-Match': etag})
+        assert response.status_code == 304, f"inventory: {response.status_code}"
+
+    cache = auth_service.user_cache
+    ttl = cache.ttl
+    report = {'backend': database_url.split(':', 1)[0], 'rounds': args.rounds}
+    for mode, mode_ttl in (('cached', ttl), ('uncached', 0)):
+        cache.ttl = mode_ttl
+        cache.clear()
+        for name, request in (('inventory_304', poll), ('sale', sale)):
+            print(f"{name} {mode}...", file=sys.stderr)
+            hits, misses = cache.hits, cache.misses
+            del statements[:]
+            result = measure(request, args.rounds, warmup=0)
+            result['statements_per_request'] = round(len(statements) / args.rounds, 2)
+            result['hits'] = cache.hits - hits
+            result['misses'] = cache.misses - misses
+            report[f"{name}_{mode}"] = result
+        # The sale changed the inventory; poll the new version next time
+        etag = http.get('/api/inventory').headers['ETag']
+    cache.ttl = ttl
+    for name in ('inventory_304', 'sale'):
+        report[f"{name}_speedup"] = round(report[f"{name}_cached"]['ops'] / report[f"{name}_uncached"]['ops'], 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+
+# Shared by gunicorn.conf.py and the engine pool sizing so that the number
+# of database connections follows the number of workers and threads.
+# The sale journal (SALE_JOURNAL_DIR) only works in a single process, so
+# the default drops to one worker when it is enabled.
+WEB_CONCURRENCY = int(os.environ.get(
+    'WEB_CONCURRENCY', 1 if os.environ.get('SALE_JOURNAL_DIR') else 2 * (os.cpu_count() or 1) + 1
+))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 90))
+
+# werkzeug hash method for new passwords; existing hashes made with other
+# parameters are upgraded on the next successful login
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+# Live stock updates on /api/events. Each open stream is a long-lived
+# request, so gunicorn.conf.py then defaults to gevent workers and refuses
+# to start several workers with the in-process event broker; without it
+# inventory pages poll /api/sync instead.
+SSE_ENABLED = _env_flag('SSE_ENABLED', True)
+
+# Number of reverse proxies in front of the app that append to
+# X-Forwarded-For. The login rate limiter keys on the client address, so
+# behind a proxy this must be set or every till shares the proxy's bucket;
+# left at 0 without one, as the header could then be forged.
+PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+
+def engine_options(database_url):
+    """SQLAlchemy engine options tuned from the environment.
+
+    Each worker process gets ``DB_POOL_SIZE`` connections (by default its
+    thread count, capped by its share of ``DB_MAX_CONNECTIONS``) plus
+    ``DB_MAX_OVERFLOW``. Pre-ping is off by default: stale connections are
+    avoided with ``pool_recycle`` and a disconnect error invalidates the
+    pool so the next checkout reconnects, instead of paying a round trip
+    on every checkout.
+    """
+    options = {
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 300)),
+        "pool_pre_ping": _env_flag('DB_POOL_PRE_PING', False),
+    }
+    if database_url.startswith('sqlite'):
+        return options
+
+    per_worker = max(1, DB_MAX_CONNECTIONS // max(1, WEB_CONCURRENCY))
+    options.update({
+        "pool_size": int(os.environ.get('DB_POOL_SIZE', max(1, min(WEB_THREADS, per_worker)))),
+        "max_overflow": int(os.environ.get('DB_MAX_OVERFLOW', max(0, per_worker - WEB_THREADS))),
+        "pool_timeout": float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    })
+    return options
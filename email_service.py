@@ -1,50 +1,267 @@
 import os
+import time
+import atexit
+import queue
 import logging
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+import metrics_service
 
 logger = logging.getLogger(__name__)
 
-def send_low_stock_alert(beverage_name, current_quantity):
-    """Send email alert when beverage stock is low"""
-    try:
-        smtp_server = os.environ['SMTP_SERVER']
-        smtp_port = int(os.environ['SMTP_PORT'])
-        smtp_user = os.environ['SMTP_USER']
-        smtp_password = os.environ['SMTP_PASSWORD']
+ALERT_QUEUE_SIZE = int(os.environ.get('ALERT_QUEUE_SIZE', 1000))
+ALERT_DEBOUNCE_SECONDS = float(os.environ.get('ALERT_DEBOUNCE_SECONDS', 3600))
+ALERT_COALESCE_SECONDS = float(os.environ.get('ALERT_COALESCE_SECONDS', 30))
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', 60))
+# How long a worker exiting waits for queued alerts to be sent (below
+# gunicorn's graceful_timeout)
+ALERT_FLUSH_TIMEOUT = float(os.environ.get('ALERT_FLUSH_TIMEOUT', 10))
 
-        msg = MIMEMultipart()
-        msg['From'] = smtp_user
-        msg['To'] = smtp_user  # Send to the same email address
-        msg['Subject'] = f'¡Alerta de Stock Bajo! - {beverage_name}'
+def _smtp_settings():
+    return (
+        os.environ['SMTP_SERVER'],
+        int(os.environ['SMTP_PORT']),
+        os.environ['SMTP_USER'],
+        os.environ['SMTP_PASSWORD'],
+    )
 
-        body = f"""
+def _connect_smtp():
+    smtp_server, smtp_port, smtp_user, smtp_password = _smtp_settings()
+    server = smtplib.SMTP(smtp_server, smtp_port)
+    server.starttls()
+    server.login(smtp_user, smtp_password)
+    return server
+
+def _build_message(subject, body):
+    smtp_user = os.environ['SMTP_USER']
+    msg = MIMEMultipart()
+    msg['From'] = smtp_user
+    msg['To'] = smtp_user  # Send to the same email address
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+def _build_alert_message(items):
+    """Build a single email for one or more (beverage_name, quantity) pairs"""
+    if len(items) == 1:
+        subject = f'¡Alerta de Stock Bajo! - {items[0][0]}'
+    else:
+        subject = f'¡Alerta de Stock Bajo! - {len(items)} productos'
+
+    rows = "\n".join(
+        f"<li><strong>{name}:</strong> {quantity} unidades</li>"
+        for name, quantity in items
+    )
+    body = f"""
         <html>
             <body>
                 <h2>Alerta de Stock Bajo</h2>
-                <p>El siguiente producto tiene un nivel de stock bajo:</p>
+                <p>Los siguientes productos tienen un nivel de stock bajo:</p>
                 <ul>
-                    <li><strong>Producto:</strong> {beverage_name}</li>
-                    <li><strong>Cantidad actual:</strong> {current_quantity}</li>
+                    {rows}
                 </ul>
                 <p>Por favor, reabastezca el inventario pronto.</p>
                 <p><small>Enviado el {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</small></p>
             </body>
         </html>
         """
+    return _build_message(subject, body)
+
+class SMTPConnection:
+    """Persistent SMTP connection reused across messages.
+
+    The connection is opened lazily, closed after SMTP_IDLE_TIMEOUT seconds
+    without traffic and transparently re-established once if the server
+    dropped it between sends.
+    """
+
+    def __init__(self, connect=_connect_smtp, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self._connect = connect
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def send(self, msg):
+        with self._lock, metrics_service.smtp_send_duration.time():
+            try:
+                self._send(msg)
+            except Exception:
+                metrics_service.smtp_send_failures.inc()
+                raise
+
+    def _send(self, msg):
+        for attempt in range(2):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.send_message(msg)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                if attempt:
+                    raise
+
+    def close_if_idle(self):
+        with self._lock:
+            if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                self._close()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+class LowStockAlertDispatcher:
+    """Background worker that batches low stock alerts into digest emails.
 
-        msg.attach(MIMEText(body, 'html'))
+    Sale requests only call ``enqueue``, which never blocks. The worker waits
+    ALERT_COALESCE_SECONDS after the first pending alert so that several
+    beverages running low together end up in one email, and each beverage is
+    alerted at most once per ALERT_DEBOUNCE_SECONDS after a successful send
+    unless it is restocked in between; an alert that fails to send is
+    allowed again on the next sale. Alerts still queued when the process
+    exits are sent first, for up to ALERT_FLUSH_TIMEOUT seconds.
+    """
 
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+    def __init__(self, connection=None, maxsize=ALERT_QUEUE_SIZE,
+                 debounce=ALERT_DEBOUNCE_SECONDS, coalesce=ALERT_COALESCE_SECONDS):
+        self.connection = connection or SMTPConnection()
+        self.debounce = debounce
+        self.coalesce = coalesce
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._last_alerted = {}
+        self._last_alerted_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_at_exit = False
 
-        logger.info(f"Low stock alert sent successfully for {beverage_name}")
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='low-stock-alerts', daemon=True
+                )
+                self._thread.start()
+            if not self._flush_at_exit:
+                # The worker thread is a daemon and dies with the process
+                atexit.register(self.flush, ALERT_FLUSH_TIMEOUT)
+                self._flush_at_exit = True
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def enqueue(self, beverage_id, beverage_name, current_quantity):
+        """Queue an alert; returns False if it was deduplicated or dropped"""
+        now = time.monotonic()
+        with self._last_alerted_lock:
+            last = self._last_alerted.get(beverage_id)
+            if last is not None and now - last < self.debounce:
+                return False
+            # Also keeps further sales from queueing it again until the
+            # send settles it (see _send_digest)
+            self._last_alerted[beverage_id] = now
+
+        self.start()
+        try:
+            self._queue.put_nowait((beverage_id, beverage_name, current_quantity))
+            return True
+        except queue.Full:
+            logger.warning(f"Low stock alert queue full, dropping alert for {beverage_name}")
+            with self._last_alerted_lock:
+                self._last_alerted.pop(beverage_id, None)
+            return False
+
+    def reset(self, beverage_id):
+        """Allow a new alert for a beverage, e.g. after it has been restocked"""
+        with self._last_alerted_lock:
+            self._last_alerted.pop(beverage_id, None)
+
+    def flush(self, timeout=None):
+        """Block until every queued alert has been sent, or for at most
+        ``timeout`` seconds (used on shutdown); returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.start()
+        try:
+            self._queue.put((None, None, None), timeout=timeout)
+        except queue.Full:
+            return False
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
         return True
 
-    except Exception as e:
-        logger.error(f"Failed to send low stock alert for {beverage_name}: {str(e)}")
-        return False
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.connection.idle_timeout)
+            except queue.Empty:
+                self.connection.close_if_idle()
+                continue
+
+            pending = {}
+            done = 1
+            flush_now = item[0] is None
+            if not flush_now:
+                pending[item[0]] = item[1:]
+
+            deadline = time.monotonic() + self.coalesce
+            while not flush_now:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                done += 1
+                if item[0] is None:
+                    flush_now = True
+                else:
+                    pending[item[0]] = item[1:]
+
+            try:
+                if pending:
+                    self._send_digest(pending)
+            finally:
+                for _ in range(done):
+                    self._queue.task_done()
+
+    def _send_digest(self, pending):
+        """Email ``{beverage_id: (name, quantity)}`` as one message"""
+        items = list(pending.values())
+        try:
+            self.connection.send(_build_alert_message(items))
+        except Exception as e:
+            logger.error(f"Failed to send low stock alert: {str(e)}")
+            self.connection.close()
+            with self._last_alerted_lock:
+                for beverage_id in pending:
+                    self._last_alerted.pop(beverage_id, None)
+            return
+        logger.info(f"Low stock alert sent successfully for {', '.join(name for name, _ in items)}")
+        sent = time.monotonic()
+        with self._last_alerted_lock:
+            for beverage_id in pending:
+                # Not for beverages restocked (reset) while the email was out
+                if beverage_id in self._last_alerted:
+                    self._last_alerted[beverage_id] = sent
+
+alert_dispatcher = LowStockAlertDispatcher()
+
+metrics_service.Gauge(
+    'low_stock_alert_queue_depth', 'Low stock alerts waiting to be emailed',
+    alert_dispatcher.qsize)
@@ -0,0 +1,168 @@
+import os
+import json
+import queue
+import select
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+EVENT_BACKEND = os.environ.get('EVENT_BACKEND')
+EVENT_CHANNEL = 'inventory_events'
+SUBSCRIBER_QUEUE_SIZE = 256
+
+class Subscription:
+    """One connected client. Events that do not fit in its queue are dropped
+    and the client is told to resync from /api/inventory instead."""
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """Next event, ``{'resync': True}`` after an overflow, or None on timeout"""
+        if self.overflowed:
+            self.overflowed = False
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            return {'resync': True}
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._broker.unsubscribe(self)
+
+class MemoryBroker:
+    """Fans events out to the subscribers of this process only"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event):
+        self._deliver(event)
+
+    def _deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+class PostgresBroker(MemoryBroker):
+    """Relays events between worker processes with LISTEN/NOTIFY.
+
+    Each process keeps one listening connection and fans notifications out
+    to its local subscribers, so a sale handled by any worker reaches every
+    connected till.
+    """
+
+    def __init__(self, dsn):
+        super().__init__()
+        self._dsn = dsn
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+        self._listener = None
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self._dsn)
+        conn.autocommit = True
+        return conn
+
+    def subscribe(self):
+        if self._listener is None or not self._listener.is_alive():
+            self._listener = threading.Thread(target=self._listen, name='inventory-events', daemon=True)
+            self._listener.start()
+        return super().subscribe()
+
+    def publish(self, event):
+        payload = json.dumps(event)
+        with self._publish_lock:
+            try:
+                if self._publish_conn is None or self._publish_conn.closed:
+                    self._publish_conn = self._connect()
+                with self._publish_conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (EVENT_CHANNEL, payload))
+            except Exception as e:
+                logger.error(f"Error publishing inventory event: {str(e)}")
+                self._publish_conn = None
+
+    def _listen(self):
+        while True:
+            try:
+                conn = self._connect()
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {EVENT_CHANNEL}")
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._deliver(json.loads(conn.notifies.pop(0).payload))
+            except Exception as e:
+                logger.error(f"Inventory event listener failed, reconnecting: {str(e)}")
+                self._deliver({'resync': True})
+                threading.Event().wait(5)
+
+def default_backend(database_url):
+    """EVENT_BACKEND when set; otherwise postgres on a Postgres database, so
+    that events reach the tills connected to every worker, and memory
+    (this process only) elsewhere"""
+    if EVENT_BACKEND:
+        return EVENT_BACKEND
+    return 'postgres' if database_url.startswith(('postgresql', 'postgres:')) else 'memory'
+
+def create_broker(backend='memory', dsn=None):
+    if backend == 'postgres':
+        return PostgresBroker(dsn)
+    if backend != 'memory':
+        raise RuntimeError(f"Unknown EVENT_BACKEND: {backend}")
+    return MemoryBroker()
+
+def init_app(app):
+    app.extensions['event_broker'] = create_broker(
+        app.config.get('EVENT_BACKEND') or default_backend(app.config['SQLALCHEMY_DATABASE_URI']),
+        dsn=app.config['SQLALCHEMY_DATABASE_URI']
+    )
+
+def get_broker():
+    from flask import current_app
+    return current_app.extensions['event_broker']
+
+def beverage_event(beverage_id, quantity, is_active):
+    return {'beverage_id': beverage_id, 'quantity': quantity, 'is_active': is_active}
+
+def sse_stream(subscription, keepalive=15):
+    """Yield Server-Sent Events for ``subscription`` until the client leaves"""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            event = subscription.get(timeout=keepalive)
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {json.dumps(event)}\n\n"
+    finally:
+        subscription.close()
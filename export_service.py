@@ -0,0 +1,225 @@
+import io
+import csv
+import zlib
+from collections import namedtuple
+import metrics_service
+
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_BATCH_ROWS = 10000  # rows per Parquet row group / Arrow record batch
+
+# format name -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+# header/to_row produce the Spanish formatted CSV, fields/to_record the typed
+# columns used by the columnar formats
+Export = namedtuple('Export', ['name', 'header', 'to_row', 'fields', 'to_record'])
+
+def sale_row(sale):
+    return [
+        sale.name,
+        abs(sale.quantity_change),
+        sale.user_email,
+        sale.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        f"${sale.price:.2f}",
+        f"${abs(sale.quantity_change * sale.price):.2f}"
+    ]
+
+def sale_record(sale):
+    return (
+        sale.name,
+        abs(sale.quantity_change),
+        sale.user_email,
+        sale.timestamp,
+        sale.price,
+        abs(sale.quantity_change * sale.price)
+    )
+
+def transaction_row(transaction):
+    return [
+        transaction.name,
+        abs(transaction.quantity_change),
+        'Venta' if transaction.transaction_type == 'sale' else 'Reabastecimiento',
+        transaction.user_email,
+        transaction.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    ]
+
+def transaction_record(transaction):
+    return (
+        transaction.name,
+        transaction.quantity_change,
+        transaction.transaction_type,
+        transaction.user_email,
+        transaction.timestamp
+    )
+
+SALES = Export(
+    name='sales',
+    header=['Producto', 'Cantidad', 'Usuario', 'Fecha', 'Precio Unitario', 'Total'],
+    to_row=sale_row,
+    fields=[('producto', 'string'), ('cantidad', 'int64'), ('usuario', 'string'),
+            ('fecha', 'timestamp'), ('precio_unitario', 'float64'), ('total', 'float64')],
+    to_record=sale_record,
+)
+
+TRANSACTIONS = Export(
+    name='transactions',
+    header=['Producto', 'Cantidad', 'Tipo', 'Usuario', 'Fecha'],
+    to_row=transaction_row,
+    fields=[('producto', 'string'), ('cantidad', 'int64'), ('tipo', 'string'),
+            ('usuario', 'string'), ('fecha', 'timestamp')],
+    to_record=transaction_record,
+)
+
+def check_format(export_format):
+    """Raise ValueError if ``export_format`` is unknown or cannot be produced here"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación no válido. Formatos permitidos: {', '.join(EXPORT_FORMATS)}")
+    if export_format in ('parquet', 'arrow'):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"El formato {export_format} requiere el paquete pyarrow")
+
+def stream_export(query, export, export_format='csv'):
+    """Yield ``query`` serialized as ``export_format`` (see EXPORT_FORMATS)"""
+    if export_format in ('csv', 'csv.gz'):
+        convert = export.to_row
+    else:
+        convert = export.to_record
+    if metrics_service.enabled:
+        convert = _RowCounter(convert)
+
+    if export_format == 'csv':
+        chunks = stream_csv(query, export.header, convert)
+    elif export_format == 'csv.gz':
+        chunks = gzip_chunks(stream_csv(query, export.header, convert))
+    else:
+        chunks = stream_arrow(query, export.fields, convert, export_format)
+
+    if metrics_service.enabled:
+        return _measured(chunks, convert, (export.name, export_format))
+    return chunks
+
+class _RowCounter:
+    def __init__(self, convert):
+        self.convert = convert
+        self.count = 0
+
+    def __call__(self, row):
+        self.count += 1
+        return self.convert(row)
+
+def _measured(chunks, rows, labels):
+    """Record exported rows and bytes once per chunk"""
+    reported = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        metrics_service.export_bytes.inc(*labels, amount=len(chunk))
+        metrics_service.export_rows.inc(*labels, amount=rows.count - reported)
+        reported = rows.count
+        yield chunk
+
+def stream_csv(query, header, to_row, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield a CSV export in chunks of ``chunk_rows`` rows.
+
+    Rows are fetched with ``yield_per`` (a server-side cursor on Postgres),
+    so memory use stays flat no matter how long the exported range is. The
+    header is yielded on its own so the first byte goes out before the
+    query has produced any rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    pending = 0
+    for row in query.yield_per(chunk_rows):
+        writer.writerow(to_row(row))
+        pending += 1
+        if pending == chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks without buffering the whole output"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after every batch"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_arrow(query, fields, to_record, export_format, chunk_rows=EXPORT_BATCH_ROWS):
+    """Yield ``query`` as Parquet (one row group per chunk) or an Arrow IPC stream"""
+    import pyarrow as pa
+
+    types = {
+        'string': pa.string(),
+        'int64': pa.int64(),
+        'float64': pa.float64(),
+        'timestamp': pa.timestamp('us'),
+    }
+    schema = pa.schema([(name, types[type_name]) for name, type_name in fields])
+
+    sink = _ChunkSink()
+    if export_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    def write_batch(records):
+        columns = list(zip(*records))
+        writer.write_batch(pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
+
+    records = []
+    for row in query.yield_per(chunk_rows):
+        records.append(to_record(row))
+        if len(records) == chunk_rows:
+            write_batch(records)
+            records = []
+            data = sink.drain()
+            if data:
+                yield data
+    if records:
+        write_batch(records)
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,359 @@
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from app import db
+import models
+import inventory_service
+
+logger = logging.getLogger(__name__)
+
+# Daily sales read from the rollup; 52 whole weeks for weekday seasonality
+FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', 364))
+# Raw transactions read for the hour of day profile
+FORECAST_HOURLY_DAYS = int(os.environ.get('FORECAST_HOURLY_DAYS', 28))
+# Weight of a day's sales in the velocity halves every this many days
+FORECAST_HALF_LIFE_DAYS = float(os.environ.get('FORECAST_HALF_LIFE_DAYS', 14))
+FORECAST_REFRESH_SECONDS = float(os.environ.get('FORECAST_REFRESH_SECONDS', 60))
+# Days between placing an order and having it on the shelf
+LEAD_TIME_DAYS = float(os.environ.get('LEAD_TIME_DAYS', 2))
+# Safety stock in standard deviations of lead time demand; 1.65 is about
+# a 95% chance of not running out before an order arrives
+SERVICE_LEVEL_Z = float(os.environ.get('SERVICE_LEVEL_Z', 1.65))
+
+VARIABILITY_DAYS = 28
+COVER_HORIZON_DAYS = 56
+# Pseudo-observations that pull the seasonality of slow sellers towards
+# flat (units per day) and towards the profile of all beverages (units)
+WEEKDAY_PRIOR = 1.0
+HOURLY_PRIOR = 24.0
+
+class Forecast:
+    """Sales history of every beverage as NumPy arrays, one row per
+    beverage, and the statistics derived from it.
+
+    ``daily`` holds units sold per day from FORECAST_HISTORY_DAYS ago up to
+    today (the last, partial column) and ``hourly`` units sold per hour of
+    the day over the last FORECAST_HOURLY_DAYS. Instances are never
+    modified, so requests can keep using one while the next is computed.
+    """
+
+    def __init__(self, beverage_ids, first_day, daily, hourly, last_transaction_id, now):
+        self.beverage_ids = beverage_ids
+        self.rows = {beverage_id: row for row, beverage_id in enumerate(beverage_ids)}
+        self.first_day = first_day
+        self.daily = daily
+        self.hourly = hourly
+        self.last_transaction_id = last_transaction_id
+        self.computed_at = now
+        self._compute(now)
+        self.version = self._content_version()
+
+    @classmethod
+    def load(cls, now):
+        """Read the history of every beverage with a handful of queries"""
+        import numpy as np
+
+        beverage_ids = db.session.scalars(db.select(models.Beverage.id).order_by(models.Beverage.id)).all()
+        rows = {beverage_id: row for row, beverage_id in enumerate(beverage_ids)}
+        # Read first: sales committed while loading are counted at the next refresh
+        last_transaction_id = db.session.query(db.func.max(models.Transaction.id)).scalar() or 0
+
+        first_day = now.date() - timedelta(days=FORECAST_HISTORY_DAYS)
+        daily = np.zeros((len(beverage_ids), FORECAST_HISTORY_DAYS + 1))
+        sales = db.session.execute(
+            db.select(models.DailyRollup.beverage_id, models.DailyRollup.day, db.func.sum(models.DailyRollup.units))
+            .where(models.DailyRollup.transaction_type == 'sale', models.DailyRollup.day >= first_day)
+            .group_by(models.DailyRollup.beverage_id, models.DailyRollup.day)
+        ).all()
+        if sales:
+            beverages, days, units = zip(*sales)
+            daily[
+                np.fromiter((rows[beverage_id] for beverage_id in beverages), np.intp, len(sales)),
+                np.fromiter((day.toordinal() for day in days), np.intp, len(sales)) - first_day.toordinal()
+            ] = units
+
+        hourly = np.zeros((len(beverage_ids), 24))
+        hour = db.extract('hour', models.Transaction.timestamp)
+        sales = db.session.execute(
+            db.select(models.Transaction.beverage_id, hour, db.func.sum(-models.Transaction.quantity_change))
+            .where(
+                models.Transaction.transaction_type == 'sale',
+                models.Transaction.timestamp >= now - timedelta(days=FORECAST_HOURLY_DAYS),
+                models.Transaction.id <= last_transaction_id
+            ).group_by(models.Transaction.beverage_id, hour)
+        ).all()
+        if sales:
+            beverages, hours, units = zip(*sales)
+            hourly[[rows[beverage_id] for beverage_id in beverages], [int(h) for h in hours]] = units
+
+        return cls(beverage_ids, first_day.toordinal(), daily, hourly, last_transaction_id, now)
+
+    def with_new_sales(self, now):
+        """A copy including the sales recorded since this one was loaded,
+        or None when a full load is needed (new day or new beverage)"""
+        import numpy as np
+
+        if now.date().toordinal() != self.first_day + self.daily.shape[1] - 1:
+            return None
+        sales = db.session.execute(
+            db.select(models.Transaction.id, models.Transaction.beverage_id,
+                      models.Transaction.timestamp, models.Transaction.quantity_change)
+            .where(models.Transaction.transaction_type == 'sale',
+                   models.Transaction.id > self.last_transaction_id)
+        ).all()
+        daily = self.daily.copy()
+        hourly = self.hourly.copy()
+        last_transaction_id = self.last_transaction_id
+        if sales:
+            if any(sale.beverage_id not in self.rows for sale in sales):
+                return None
+            rows = [self.rows[sale.beverage_id] for sale in sales]
+            units = [-sale.quantity_change for sale in sales]
+            columns = np.array([sale.timestamp.toordinal() for sale in sales]) - self.first_day
+            # Sales timestamped before today are rare (in flight at midnight)
+            np.add.at(daily, (rows, np.clip(columns, 0, daily.shape[1] - 1)), units)
+            np.add.at(hourly, (rows, [sale.timestamp.hour for sale in sales]), units)
+            last_transaction_id = max(sale.id for sale in sales)
+        return Forecast(self.beverage_ids, self.first_day, daily, hourly, last_transaction_id, now)
+
+    def _compute(self, now):
+        import numpy as np
+
+        days = self.daily.shape[1]
+        full = self.daily[:, :-1]
+        weekdays = (np.arange(self.first_day, self.first_day + days) - 1) % 7  # Monday is 0
+        full_weekdays = weekdays[:-1]
+
+        # Weekday seasonality: mean sales per weekday over the overall mean
+        per_weekday = full @ np.eye(7)[full_weekdays] / np.bincount(full_weekdays, minlength=7)
+        mean = full.mean(axis=1, keepdims=True)
+        factors = (per_weekday + WEEKDAY_PRIOR) / (mean + WEEKDAY_PRIOR)
+        self.weekday_factors = factors / factors.mean(axis=1, keepdims=True)
+
+        # Hour of day profile, shrunk towards the profile of all beverages
+        pooled = self.hourly.sum(axis=0)
+        pooled = pooled / pooled.sum() if pooled.sum() else np.full(24, 1 / 24)
+        self.hourly_profile = (self.hourly + HOURLY_PRIOR * pooled) / (
+            self.hourly.sum(axis=1, keepdims=True) + HOURLY_PRIOR)
+        self.elapsed_today = (
+            self.hourly_profile[:, :now.hour].sum(axis=1)
+            + self.hourly_profile[:, now.hour] * (now.minute * 60 + now.second) / 3600
+        )
+
+        # Velocity: exponentially weighted deseasonalized units per day.
+        # Days before a beverage's first sale do not count, today counts for
+        # the share of its usual sales that should have happened by now, and
+        # at least one day is counted so a first sale is not extrapolated.
+        deseasonalized = full / self.weekday_factors[:, full_weekdays]
+        first_sale = np.where((full > 0).any(axis=1), np.argmax(full > 0, axis=1), days - 1)
+        selling = np.arange(days - 1) >= first_sale[:, None]
+        weights = 0.5 ** (np.arange(days - 1, 0, -1) / FORECAST_HALF_LIFE_DAYS) * selling
+        today_factor = self.weekday_factors[:, weekdays[-1]]
+        self.velocity = (
+            (deseasonalized * weights).sum(axis=1) + self.daily[:, -1] / today_factor
+        ) / np.maximum(weights.sum(axis=1) + self.elapsed_today, 1)
+        self.has_history = self.daily.sum(axis=1) > 0
+
+        recent = deseasonalized[:, -VARIABILITY_DAYS:]
+        self.daily_deviation = recent.std(axis=1)
+
+        # Reorder point: expected demand over the lead time plus safety stock
+        lead_time_demand = self._cumulative_demand(now, np.array([LEAD_TIME_DAYS]))[:, 0]
+        reorder = np.ceil(lead_time_demand + SERVICE_LEVEL_Z * self.daily_deviation * math.sqrt(LEAD_TIME_DAYS))
+        self.reorder_points = np.where(
+            self.has_history, np.maximum(reorder, 1), inventory_service.LOW_STOCK_THRESHOLD
+        ).astype(int)
+
+    def _content_version(self):
+        """Number identifying what tills are shown (the beverages and their
+        reorder points). It is part of the inventory ETag and of /api/sync,
+        so it is derived from the content: every worker that computes the
+        same reorder points gives the same version. 48 bits, an exact
+        integer in JavaScript."""
+        import numpy as np
+
+        digest = hashlib.blake2b(digest_size=6)
+        digest.update(np.asarray(self.beverage_ids, dtype=np.int64).tobytes())
+        digest.update(np.asarray(self.reorder_points, dtype=np.int64).tobytes())
+        return int.from_bytes(digest.digest(), 'big')
+
+    def _demand_periods(self, now, horizon):
+        """Expected units for the rest of today and each of the next
+        ``horizon`` days, with the length of each period in days"""
+        import numpy as np
+
+        weekday = now.weekday()
+        rest_of_today = self.velocity * self.weekday_factors[:, weekday] * (1 - self.elapsed_today)
+        following = self.velocity[:, None] * self.weekday_factors[:, (weekday + np.arange(1, horizon + 1)) % 7]
+        demand = np.concatenate([rest_of_today[:, None], following], axis=1)
+        clock = (now - datetime.combine(now.date(), datetime.min.time())).total_seconds() / 86400
+        lengths = np.concatenate([[1 - clock], np.ones(horizon)])
+        return demand, lengths
+
+    def _cumulative_demand(self, now, spans):
+        """Expected units sold between now and ``now + span`` for each span
+        (in days); the last period is prorated"""
+        import numpy as np
+
+        demand, lengths = self._demand_periods(now, int(math.ceil(spans.max())) + 1)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        covered = np.clip((spans[:, None] - starts) / lengths, 0, 1)  # spans × periods
+        return demand @ covered.T
+
+    def days_of_cover(self, quantities, now):
+        """Days until each beverage runs out at the forecast rate (NaN when
+        it does not sell); ``quantities`` is aligned with ``beverage_ids``"""
+        import numpy as np
+
+        quantities = np.asarray(quantities, dtype=float)
+        demand, lengths = self._demand_periods(now, COVER_HORIZON_DAYS)
+        cumulative = np.cumsum(demand, axis=1)
+        crossed = cumulative >= quantities[:, None]
+        period = np.argmax(crossed, axis=1)
+        rows = np.arange(len(quantities))
+        before = np.where(period > 0, cumulative[rows, period - 1], 0)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            within = starts[period] + lengths[period] * (quantities - before) / demand[rows, period]
+            # Past the horizon: extrapolate at the horizon's average rate
+            beyond = quantities / (cumulative[:, -1] / lengths.sum())
+        cover = np.where(crossed.any(axis=1), within, beyond)
+        return np.where(self.velocity > 0, np.maximum(cover, 0), np.nan)
+
+    def reorder_point(self, beverage_id):
+        row = self.rows.get(beverage_id)
+        if row is None:
+            return inventory_service.LOW_STOCK_THRESHOLD
+        return int(self.reorder_points[row])
+
+class ForecastCache:
+    """Latest Forecast of this process.
+
+    Loaded from scratch on first use and at the start of every day, and
+    otherwise brought up to date with just the sales recorded since the
+    previous refresh, at most every FORECAST_REFRESH_SECONDS. Once
+    start_refresher() runs, only its thread refreshes: requests are served
+    the forecast at hand, even a stale one, instead of waiting for a load.
+    """
+
+    def __init__(self, refresh_seconds=FORECAST_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.background = False
+        self._forecast = None
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        return self._forecast is not None and time.monotonic() - self._refreshed < self.refresh_seconds
+
+    def peek(self):
+        """The current forecast without refreshing it (None before the first load)"""
+        return self._forecast
+
+    def get(self):
+        forecast = self._forecast
+        if forecast is None:
+            # Nothing to serve yet
+            return self.refresh()
+        if not self.background and not self._fresh() and self._lock.acquire(blocking=False):
+            # No refresher thread (scripts, checks): one request refreshes
+            # while the others keep the current forecast
+            try:
+                self._refresh()
+            finally:
+                self._lock.release()
+        return self._forecast
+
+    def refresh(self):
+        """Bring the forecast up to date unless it already is; returns it"""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        if self._fresh():
+            return self._forecast
+        now = datetime.utcnow()
+        start = time.perf_counter()
+        previous = self._forecast
+        forecast = previous.with_new_sales(now) if previous is not None else None
+        if forecast is None:
+            forecast = Forecast.load(now)
+            logger.info(f"Forecast loaded for {len(forecast.beverage_ids)} beverages "
+                        f"in {time.perf_counter() - start:.2f}s")
+        self._forecast = forecast
+        self._refreshed = time.monotonic()
+        return forecast
+
+    def clear(self):
+        with self._lock:
+            self._forecast = None
+
+forecast_cache = ForecastCache()
+
+def reorder_point(beverage_id):
+    """Quantity below which a beverage counts as low on stock. Never
+    queries the database, so it is safe on the sale path; before the first
+    forecast has been loaded it is LOW_STOCK_THRESHOLD."""
+    forecast = forecast_cache.peek()
+    if forecast is None:
+        return inventory_service.LOW_STOCK_THRESHOLD
+    return forecast.reorder_point(beverage_id)
+
+def forecast_rows(beverages, now=None):
+    """Forecast of each Beverage as a dict for the API and the restock page"""
+    import numpy as np
+
+    forecast = forecast_cache.get()
+    now = now or datetime.utcnow()
+    known = [beverage for beverage in beverages if beverage.id in forecast.rows]
+    rows = np.array([forecast.rows[beverage.id] for beverage in known], dtype=np.intp)
+    quantities = np.zeros(len(forecast.beverage_ids))
+    quantities[rows] = [beverage.quantity or 0 for beverage in known]
+    cover = forecast.days_of_cover(quantities, now)
+
+    result = []
+    for beverage in beverages:
+        row = forecast.rows.get(beverage.id)
+        if row is None:
+            # Created after the forecast was loaded
+            result.append({
+                'beverage_id': beverage.id, 'name': beverage.name, 'quantity': beverage.quantity,
+                'daily_sales': None, 'weekday_factors': None, 'hourly_profile': None,
+                'reorder_point': inventory_service.LOW_STOCK_THRESHOLD, 'days_of_cover': None,
+                'low_stock': (beverage.quantity or 0) < inventory_service.LOW_STOCK_THRESHOLD,
+            })
+            continue
+        result.append({
+            'beverage_id': beverage.id,
+            'name': beverage.name,
+            'quantity': beverage.quantity,
+            'daily_sales': round(float(forecast.velocity[row]), 2),
+            'weekday_factors': [round(float(factor), 3) for factor in forecast.weekday_factors[row]],
+            'hourly_profile': [round(float(share), 4) for share in forecast.hourly_profile[row]],
+            'reorder_point': int(forecast.reorder_points[row]),
+            'days_of_cover': None if np.isnan(cover[row]) else round(float(cover[row]), 1),
+            'low_stock': bool((beverage.quantity or 0) < forecast.reorder_points[row]),
+        })
+    return result
+
+def start_refresher(app, interval=FORECAST_REFRESH_SECONDS):
+    """Keep the forecast of this process loaded, so that the sale path
+    always has reorder points to compare against"""
+    forecast_cache.background = True
+
+    def run():
+        while True:
+            try:
+                with app.app_context():
+                    forecast_cache.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing forecast: {str(e)}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='forecast-refresher', daemon=True)
+    thread.start()
+    return thread
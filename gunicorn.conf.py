@@ -0,0 +1,79 @@
+import os
+from dotenv import load_dotenv
+
+# Same environment as the app, read before the settings below
+load_dotenv()
+
+from config import WEB_CONCURRENCY, WEB_THREADS, SSE_ENABLED  # noqa: E402
+import event_service  # noqa: E402
+
+# Production server settings: gunicorn -c gunicorn.conf.py main:app
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = WEB_CONCURRENCY
+# Every till keeps an /api/events stream open; under gthread each one
+# would hold one of the WEB_THREADS threads of a worker, so with live
+# events on the default is gevent (a greenlet per connection)
+worker_class = os.environ.get('WORKER_CLASS', 'gevent' if SSE_ENABLED else 'gthread')
+threads = WEB_THREADS
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.environ.get('MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+# Background threads (alert dispatcher, image reconciler) and database
+# pools must be created in each worker, not inherited from the master
+preload_app = False
+
+accesslog = os.environ.get('ACCESS_LOG', '-')
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+def _uses_gevent(server):
+    return 'gevent' in server.cfg.worker_class_str.lower()
+
+def on_starting(server):
+    """Refuse settings under which /api/events would starve the workers or
+    miss events handled by other workers"""
+    if not SSE_ENABLED:
+        return
+    if not _uses_gevent(server):
+        raise RuntimeError(
+            f"SSE_ENABLED needs WORKER_CLASS=gevent, not {server.cfg.worker_class_str}: "
+            "each open /api/events stream would hold a worker thread. Set SSE_ENABLED=0 to serve without it."
+        )
+    backend = event_service.default_backend(os.environ.get('DATABASE_URL', ''))
+    if server.cfg.workers > 1 and backend == 'memory':
+        raise RuntimeError(
+            f"EVENT_BACKEND=memory only reaches the tills of one worker, but WEB_CONCURRENCY is "
+            f"{server.cfg.workers}. Use EVENT_BACKEND=postgres, WEB_CONCURRENCY=1 or SSE_ENABLED=0."
+        )
+
+def _gevent_wait_callback(conn, timeout=None):
+    # Yield to other greenlets while psycopg2 waits on the socket
+    from gevent.socket import wait_read, wait_write
+    import psycopg2
+    from psycopg2 import extensions
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+def post_fork(server, worker):
+    # gevent patches sockets but not libpq: without a wait callback every
+    # query blocks the whole worker, and every till connected to it
+    if _uses_gevent(server):
+        try:
+            from psycopg2 import extensions
+        except ImportError:
+            return
+        extensions.set_wait_callback(_gevent_wait_callback)
@@ -0,0 +1,247 @@
+import os
+import io
+import time
+import imghdr
+import hashlib
+import logging
+import tempfile
+import threading
+import metrics_service
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'avif'}
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+IMAGE_RECONCILE_SECONDS = float(os.environ.get('IMAGE_RECONCILE_SECONDS', 300))
+
+# Resized copies generated for every uploaded image, as (max width, max height)
+IMAGE_VARIANTS = {
+    'card': (400, 400),
+    'thumb': (120, 120),
+}
+# (file extension, Pillow format, save options); WebP first, JPEG as fallback
+VARIANT_FORMATS = [
+    ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class ImageIndex:
+    """In-memory set of the files present in the upload folder.
+
+    Loaded with a single directory scan and kept up to date by
+    store_upload, remove_image and the variant pipeline, so request
+    handlers never need to stat image files.
+    """
+
+    def __init__(self):
+        self._files = None
+        self._folder = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self, upload_folder):
+        if self._files is None or self._folder != upload_folder:
+            self.refresh(upload_folder)
+
+    def refresh(self, upload_folder):
+        with os.scandir(upload_folder) as entries:
+            files = {entry.name for entry in entries if entry.is_file()}
+        with self._lock:
+            self._files = files
+            self._folder = upload_folder
+        return files
+
+    def contains(self, filename, upload_folder):
+        self._ensure_loaded(upload_folder)
+        return filename in self._files
+
+    def add(self, filename):
+        with self._lock:
+            if self._files is not None:
+                self._files.add(filename)
+
+    def discard(self, filename):
+        with self._lock:
+            if self._files is not None:
+                self._files.discard(filename)
+
+image_index = ImageIndex()
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def validate_image(stream):
+    header = stream.read(512)
+    stream.seek(0)
+    format = imghdr.what(None, header)
+    if not format:
+        return None
+    return '.' + (format if format != 'jpeg' else 'jpg')
+
+def variant_filename(filename, variant, ext):
+    """Name of a generated variant, e.g. ``<hash>_card.webp`` for ``<hash>.png``"""
+    return f"{os.path.splitext(filename)[0]}_{variant}.{ext}"
+
+def variant_filenames(filename):
+    return [
+        variant_filename(filename, variant, ext)
+        for variant in IMAGE_VARIANTS
+        for ext, _, _ in VARIANT_FORMATS
+    ]
+
+def variants_exist(filename, upload_folder):
+    return all(
+        image_index.contains(name, upload_folder)
+        for name in variant_filenames(filename)
+    )
+
+def store_upload(file, upload_folder):
+    """Validate an uploaded image and store it under its content hash.
+
+    Returns ``(filename, created)``; ``created`` is False when an identical
+    image was already stored (for this or another beverage). Raises
+    ValueError with a user facing message for invalid uploads.
+    """
+    if not allowed_file(file.filename):
+        raise ValueError("El formato de archivo no está permitido. Formatos permitidos: " +
+                         ", ".join(ALLOWED_EXTENSIONS))
+
+    file_ext = validate_image(file.stream)
+    if file.filename.lower().endswith('.webp'):
+        file_ext = '.webp'
+    if not file_ext:
+        raise ValueError("El formato de imagen no es válido")
+
+    data = file.stream.read()
+    try:
+        from PIL import Image
+        import PIL.WebPImagePlugin  # Explicit WebP support
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+    except Exception:
+        raise ValueError("Error al procesar la imagen. Por favor, intente con otra imagen")
+
+    filename = hashlib.sha256(data).hexdigest()[:32] + file_ext
+    filepath = os.path.join(upload_folder, filename)
+    if os.path.exists(filepath):
+        image_index.add(filename)
+        return filename, False
+
+    os.makedirs(upload_folder, exist_ok=True)
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, filepath)
+    image_index.add(filename)
+    return filename, True
+
+def remove_image(filename, upload_folder):
+    """Delete a stored image together with its generated variants"""
+    for name in [filename] + variant_filenames(filename):
+        path = os.path.join(upload_folder, name)
+        image_index.discard(name)
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Removed image: {path}")
+
+def generate_variants(master_path):
+    """Write every IMAGE_VARIANTS x VARIANT_FORMATS copy of ``master_path``.
+
+    Runs in a worker process. Each file is written to a unique temporary
+    name and renamed, so a variant is never served half written.
+    """
+    from PIL import Image
+    import PIL.WebPImagePlugin  # noqa: F401
+
+    upload_folder, filename = os.path.split(master_path)
+    with Image.open(master_path) as img:
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.split()[3])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        written = []
+        for variant, size in IMAGE_VARIANTS.items():
+            resized = img.copy()
+            resized.thumbnail(size)
+            for ext, format, save_options in VARIANT_FORMATS:
+                path = os.path.join(upload_folder, variant_filename(filename, variant, ext))
+                # A name of its own: two workers may write the same variant
+                # when a master is uploaded twice
+                with tempfile.NamedTemporaryFile(dir=upload_folder, prefix=os.path.basename(path) + '.',
+                                                 suffix='.tmp', delete=False) as tmp:
+                    try:
+                        resized.save(tmp, format=format, **save_options)
+                    except BaseException:
+                        tmp.close()
+                        os.remove(tmp.name)
+                        raise
+                os.chmod(tmp.name, 0o644)
+                os.replace(tmp.name, path)
+                written.append(path)
+    return written
+
+def _generate_variants_timed(master_path):
+    start = time.perf_counter()
+    written = generate_variants(master_path)
+    return written, time.perf_counter() - start
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn keeps the worker processes free of the web app's state
+            # (database connections, threads)
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            _pool = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+def submit_variants(master_path, on_ready):
+    """Generate variants in the background and call ``on_ready(filename)``
+    from a pool thread once they are all written"""
+    filename = os.path.basename(master_path)
+
+    def done(future):
+        try:
+            written, duration = future.result()
+        except Exception as e:
+            metrics_service.image_processing_failures.inc()
+            logger.error(f"Error generating variants for {master_path}: {str(e)}")
+            return
+        metrics_service.image_processing_duration.observe(duration)
+        for path in written:
+            image_index.add(os.path.basename(path))
+        logger.info(f"Image variants ready: {filename}")
+        try:
+            on_ready(filename)
+        except Exception as e:
+            logger.error(f"Error marking variants ready for {filename}: {str(e)}")
+
+    # Timed in the worker so the histogram excludes time spent queued
+    future = _get_pool().submit(_generate_variants_timed, master_path)
+    future.add_done_callback(done)
+    return future
+
+def start_reconciler(reconcile, interval=IMAGE_RECONCILE_SECONDS):
+    """Run ``reconcile()`` every ``interval`` seconds in a daemon thread"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                reconcile()
+            except Exception as e:
+                logger.error(f"Error reconciling images: {str(e)}")
+
+    thread = threading.Thread(target=run, name='image-reconciler', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,51 @@
+import os
+import argparse
+from app import create_app, db
+import image_service
+import import_service
+import models
+import views
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a delivery file (CSV or XLSX) into the inventory")
+    parser.add_argument('file', help="columns: nombre, cantidad, precio (new beverages), imagen (optional)")
+    parser.add_argument('--user', required=True, help="email of the user recorded on the restock transactions")
+    parser.add_argument('--dry-run', action='store_true', help="only validate the file")
+    args = parser.parse_args()
+
+    app = create_app({'START_BACKGROUND_JOBS': False})
+    with app.app_context():
+        user = models.User.query.filter_by(email=args.user).first()
+        if user is None:
+            raise SystemExit(f"Unknown user: {args.user}")
+        upload_folder = app.config['UPLOAD_FOLDER']
+        try:
+            file_format = import_service.detect_format(args.file)
+            with open(args.file, 'rb') as f:
+                delivery = import_service.parse_delivery(f, file_format, upload_folder)
+        except ValueError as e:
+            raise SystemExit(str(e))
+
+        for line, message in delivery.errors:
+            print(f"Line {line}: {message}")
+        if delivery.error_count > len(delivery.errors):
+            print(f"... {delivery.error_count - len(delivery.errors)} more errors")
+        if delivery.error_count:
+            raise SystemExit(f"{delivery.error_count} of {delivery.line_count} lines have errors, nothing imported")
+        if args.dry_run:
+            print(f"{delivery.line_count} lines are valid")
+            return
+
+        result = import_service.apply_delivery(delivery, user.id, upload_folder)
+        db.session.commit()
+        # No worker pool to hand them to here: generate missing variants inline
+        for filename in result.pending_variants:
+            image_service.generate_variants(os.path.join(upload_folder, filename))
+            views.mark_variants_ready(app, filename)
+        result = result._replace(pending_variants=[])
+        views.announce_import(app, result)
+        print(f"Imported {result.lines} lines: {result.units} units of {len(result.beverages)} beverages "
+              f"({result.created} new)")
+
+if __name__ == "__main__":
+    main()
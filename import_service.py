@@ -0,0 +1,324 @@
+import io
+import os
+import csv
+import logging
+import itertools
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db, DEFAULT_IMAGE
+import models
+import image_service
+import inventory_service
+import search_service
+import stock_slot_service
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+MAX_REPORTED_ERRORS = 100
+# Rows per multi-row INSERT, well under SQLite's bound parameter limit
+UPSERT_BATCH_ROWS = 500
+
+# Accepted header names for each column, compared in lower case
+COLUMNS = {
+    'name': ('name', 'nombre', 'producto', 'bebida'),
+    'quantity': ('quantity', 'cantidad'),
+    'price': ('price', 'precio', 'precio unitario'),
+    'image': ('image', 'imagen'),
+}
+
+DeliveryLine = namedtuple('DeliveryLine', ['line', 'name', 'quantity', 'price', 'image'])
+ImportResult = namedtuple('ImportResult', [
+    'lines', 'units', 'created', 'beverages', 'pending_variants', 'replaced_images',
+])
+
+class Delivery:
+    """Valid lines of a delivery file and the errors of the others"""
+
+    def __init__(self):
+        self.lines = []
+        self.errors = []
+        self.error_count = 0
+        self.line_count = 0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        return {
+            'lines': self.line_count,
+            'valid_lines': len(self.lines),
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'error': message} for line, message in sorted(self.errors)],
+        }
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension not in IMPORT_FORMATS:
+        raise ValueError(f"Formato de archivo no válido. Formatos permitidos: {', '.join(IMPORT_FORMATS)}")
+    if extension == 'xlsx':
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise ValueError("El formato xlsx requiere el paquete openpyxl")
+    return extension
+
+def read_csv(stream):
+    """Yield the rows of a CSV file without reading it whole; the
+    delimiter (comma, semicolon or tab) is detected from the first lines"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    sample += text.readline()
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(itertools.chain(io.StringIO(sample, newline=''), text), dialect)
+
+def read_xlsx(stream):
+    """Yield the rows of the first sheet; openpyxl's read-only mode loads
+    rows as they are iterated"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+def _header_columns(header):
+    names = [str(cell).strip().lower() for cell in header]
+    columns = {}
+    for column, aliases in COLUMNS.items():
+        for index, name in enumerate(names):
+            if name in aliases:
+                columns[column] = index
+                break
+    missing = [COLUMNS[column][1] for column in ('name', 'quantity') if column not in columns]
+    if missing:
+        raise ValueError(f"Faltan columnas en el archivo: {', '.join(missing)}")
+    return columns
+
+def _parse_quantity(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    quantity = int(str(value).strip())
+    if quantity <= 0:
+        raise ValueError
+    return quantity
+
+def _parse_price(value):
+    if isinstance(value, (int, float)):
+        price = float(value)
+    else:
+        text = str(value).strip().lstrip('$').strip()
+        if ',' in text and '.' not in text:
+            text = text.replace(',', '.')  # decimal comma
+        price = float(text)
+    if not price > 0:
+        raise ValueError
+    return price
+
+def parse_delivery(stream, file_format, upload_folder):
+    """Validate a delivery file row by row.
+
+    Columns are matched by header name (see COLUMNS): name and quantity are
+    required, price is required for beverages that do not exist yet and
+    image names a file already in the upload folder. Names are matched to
+    existing beverages ignoring case, like the restock form, and lines of a
+    new beverage are grouped under the first spelling in the file. A
+    beverage may appear on several lines. Raises ValueError when the file
+    as a whole cannot be read; problems with single lines are collected in
+    the Delivery.
+    """
+    rows = read_xlsx(stream) if file_format == 'xlsx' else read_csv(stream)
+    delivery = Delivery()
+    try:
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("El archivo está vacío")
+        columns = _header_columns(header)
+        max_length = models.Beverage.name.type.length
+
+        def cell(row, column):
+            index = columns.get(column)
+            if index is None or index >= len(row):
+                return ''
+            return row[index]
+
+        first_line = {}
+        for line, row in enumerate(rows, start=2):
+            if not any(str(value).strip() for value in row):
+                continue
+            delivery.line_count += 1
+            name = str(cell(row, 'name')).strip()
+            if not name:
+                delivery.error(line, "Falta el nombre de la bebida")
+                continue
+            if len(name) > max_length:
+                delivery.error(line, f"El nombre supera los {max_length} caracteres")
+                continue
+            try:
+                quantity = _parse_quantity(cell(row, 'quantity'))
+            except ValueError:
+                delivery.error(line, "La cantidad debe ser un número entero mayor que cero")
+                continue
+            price = None
+            if str(cell(row, 'price')).strip():
+                try:
+                    price = _parse_price(cell(row, 'price'))
+                except ValueError:
+                    delivery.error(line, "El precio debe ser un número mayor que cero")
+                    continue
+            image = str(cell(row, 'image')).strip() or None
+            # Checked on disk: another worker may have stored it
+            if image is not None and not (
+                image_service.allowed_file(image) and os.path.basename(image) == image
+                and os.path.isfile(os.path.join(upload_folder, image))
+            ):
+                delivery.error(line, f"La imagen {image} no existe en la carpeta de imágenes")
+                continue
+            delivery.lines.append(DeliveryLine(line, name, quantity, price, image))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(f"No se pudo leer el archivo: {str(e)}")
+
+    existing = search_service.find_names({line.name for line in delivery.lines})
+    spelling = {}
+    for index, line in enumerate(delivery.lines):
+        name = existing.get(line.name) or spelling.setdefault(line.name.casefold(), line.name)
+        delivery.lines[index] = line = line._replace(name=name)
+        first_line.setdefault(name, line.line)
+    existing = set(existing.values())
+
+    # New beverages need a price on at least one of their lines
+    priced = {line.name for line in delivery.lines if line.price is not None}
+    unpriced = sorted(set(first_line) - priced)
+    missing_price = {name for name in unpriced if name not in existing}
+    if missing_price:
+        for name in sorted(missing_price, key=first_line.get):
+            delivery.error(first_line[name], f"{name} no existe: indique el precio para crearla")
+        delivery.lines = [line for line in delivery.lines if line.name not in missing_price]
+    return delivery
+
+def _upsert(rows, set_image):
+    """Insert new beverages and add quantities to existing ones (matched by
+    name) in one statement; returns the resulting rows"""
+    returning = (models.Beverage.id, models.Beverage.name, models.Beverage.quantity,
+                 models.Beverage.price, models.Beverage.is_active)
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(models.Beverage).values(rows)
+        set_ = {
+            'quantity': models.Beverage.quantity + stmt.excluded.quantity,
+            'version': models.Beverage.version + 1,
+            'updated_at': stmt.excluded.updated_at,
+        }
+        if set_image:
+            set_['image_path'] = stmt.excluded.image_path
+            set_['image_variants_ready'] = stmt.excluded.image_variants_ready
+        stmt = stmt.on_conflict_do_update(index_elements=['name'], set_=set_).returning(*returning)
+        return db.session.execute(stmt).all()
+
+    result = []
+    for row in rows:
+        beverage = models.Beverage.query.filter_by(name=row['name']).first()
+        if beverage is None:
+            beverage = models.Beverage(**row)
+            db.session.add(beverage)
+        else:
+            beverage.quantity += row['quantity']
+            beverage.version += 1
+            if set_image:
+                beverage.image_path = row['image_path']
+                beverage.image_variants_ready = row['image_variants_ready']
+        db.session.flush()
+        result.append(tuple(getattr(beverage, column.key) for column in returning))
+    return result
+
+def apply_delivery(delivery, user_id, upload_folder, now=None):
+    """Add a validated delivery to the inventory: one upsert per batch of
+    beverages, then every restock transaction in one bulk INSERT. Runs in
+    the current database transaction; the caller commits."""
+    now = now or datetime.utcnow()
+    totals = {}
+    for line in delivery.lines:
+        quantity, price, image = totals.get(line.name, (0, None, None))
+        totals[line.name] = (quantity + line.quantity, price or line.price, line.image or image)
+
+    # Images being replaced, to delete them afterwards if nothing else uses them
+    with_image = sorted(name for name, (_, _, image) in totals.items() if image)
+    replaced_images = set()
+    for start in range(0, len(with_image), UPSERT_BATCH_ROWS):
+        replaced_images.update(db.session.scalars(
+            db.select(models.Beverage.image_path).where(
+                models.Beverage.name.in_(with_image[start:start + UPSERT_BATCH_ROWS]))
+        ))
+    new_images = {image for _, _, image in totals.values() if image}
+    replaced_images -= new_images | {DEFAULT_IMAGE, None}
+
+    ready = {image: image_service.variants_exist(image, upload_folder) for image in new_images}
+    existing_before = db.session.query(db.func.count(models.Beverage.id)).scalar()
+    beverages = {}
+    for set_image in (False, True):
+        rows = [
+            {
+                'name': name, 'quantity': quantity,
+                # Only used when the beverage is new; validated by parse_delivery
+                'price': price or 0,
+                'image_path': image or DEFAULT_IMAGE,
+                'image_variants_ready': ready.get(image, False),
+                'is_active': True, 'version': 0, 'created_at': now, 'updated_at': now,
+            }
+            for name, (quantity, price, image) in sorted(totals.items())
+            if bool(image) == set_image
+        ]
+        for start in range(0, len(rows), UPSERT_BATCH_ROWS):
+            for row in _upsert(rows[start:start + UPSERT_BATCH_ROWS], set_image):
+                beverages[row[1]] = row
+    created = db.session.query(db.func.count(models.Beverage.id)).scalar() - existing_before
+    # Beverages with stock slots get the units in their slots too
+    added = [(row[0], totals[name][0]) for name, row in beverages.items()]
+    totals_by_id = {}
+    for start in range(0, len(added), UPSERT_BATCH_ROWS):
+        totals_by_id.update(stock_slot_service.restock(dict(added[start:start + UPSERT_BATCH_ROWS])))
+
+    transactions = [
+        {
+            'beverage_id': beverages[line.name][0], 'user_id': user_id,
+            'quantity_change': line.quantity, 'timestamp': now, 'transaction_type': 'restock',
+        }
+        for line in delivery.lines
+    ]
+    db.session.execute(db.insert(models.Transaction), transactions)
+
+    names = sorted(totals)
+    for start in range(0, len(names), UPSERT_BATCH_ROWS):
+        inventory_service.add_to_rollup([
+            (now, beverages[name][0], 'restock', totals[name][0], totals[name][0] * beverages[name][3])
+            for name in names[start:start + UPSERT_BATCH_ROWS]
+        ])
+
+    return ImportResult(
+        lines=len(delivery.lines),
+        units=sum(line.quantity for line in delivery.lines),
+        created=created,
+        beverages=[(row[0], row[1], totals_by_id.get(row[0], row[2]), row[4]) for row in beverages.values()],
+        pending_variants=sorted(image for image, done in ready.items() if not done and image != DEFAULT_IMAGE),
+        replaced_images=sorted(replaced_images),
+    )
+
+def remove_unused_images(filenames, upload_folder):
+    """Delete the images no beverage refers to any more"""
+    if not filenames:
+        return
+    used = set(db.session.scalars(
+        db.select(models.Beverage.image_path).where(models.Beverage.image_path.in_(filenames))
+    ))
+    for filename in filenames:
+        if filename not in used:
+            image_service.remove_image(filename, upload_folder)
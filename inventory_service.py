@@ -0,0 +1,518 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+import models
+import archive_service
+import stock_slot_service
+
+logger = logging.getLogger(__name__)
+
+LOW_STOCK_THRESHOLD = 5
+
+def _decrement_stock(beverage_id, units):
+    return db.session.execute(
+        db.update(models.Beverage)
+        .where(models.Beverage.id == beverage_id, models.Beverage.quantity >= units,
+               models.Beverage.stock_slots == 0)
+        .values(quantity=models.Beverage.quantity - units, version=models.Beverage.version + 1)
+        .returning(models.Beverage.name, models.Beverage.quantity, models.Beverage.price,
+                   models.Beverage.is_active)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+def _take_stock(beverage_id, units):
+    """Decrement the stock of a beverage if it holds ``units``: its own row,
+    or one of its stock slots when it has them. Returns ``(name,
+    new_quantity, price, is_active)`` or None, and the slot for the rollup."""
+    # A beverage split or merged meanwhile fails one path and takes the other
+    for _ in range(3):
+        row = _decrement_stock(beverage_id, units)
+        if row is not None:
+            return row, 0
+        if not stock_slot_service.slot_count(beverage_id):
+            return None, 0
+        slot = stock_slot_service.take(beverage_id, units)
+        if slot is not None:
+            return stock_slot_service.stock_row(beverage_id), slot
+        if stock_slot_service.slot_count(beverage_id):
+            return None, 0
+    return None, 0
+
+def inventory_version():
+    """Cheap validator for everything the inventory views render.
+
+    Every write that changes a beverage bumps its ``version``; since rows
+    are never deleted, (row count, sum of versions) changes whenever any
+    beverage does. Returns ``(token, last_modified)``.
+    """
+    count, versions, last_modified = db.session.query(
+        db.func.count(models.Beverage.id),
+        db.func.coalesce(db.func.sum(models.Beverage.version), 0),
+        db.func.max(models.Beverage.updated_at)
+    ).one()
+    return f"{count}-{versions}", last_modified
+
+def add_to_rollup(entries, slots=None):
+    """Add ``(timestamp, beverage_id, transaction_type, units, revenue)``
+    entries to the daily rollup in the current database transaction.
+    ``slots`` maps beverage ids to the rollup row of the stock slot their
+    sale came from, so that sales of different slots do not wait for each
+    other here either."""
+    totals = {}
+    for timestamp, beverage_id, transaction_type, units, revenue in entries:
+        slot = slots.get(beverage_id, 0) if slots else 0
+        key = (timestamp.date(), beverage_id, transaction_type, slot)
+        prev_units, prev_revenue = totals.get(key, (0, 0.0))
+        totals[key] = (prev_units + units, prev_revenue + revenue)
+    if not totals:
+        return
+
+    rows = [
+        {'day': day, 'beverage_id': beverage_id, 'transaction_type': transaction_type,
+         'slot': slot, 'units': units, 'revenue': revenue}
+        for (day, beverage_id, transaction_type, slot), (units, revenue) in totals.items()
+    ]
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(models.DailyRollup).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'beverage_id', 'transaction_type', 'slot'],
+            set_={
+                'units': models.DailyRollup.units + stmt.excluded.units,
+                'revenue': models.DailyRollup.revenue + stmt.excluded.revenue,
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    for row in rows:
+        rollup = db.session.get(
+            models.DailyRollup, (row['day'], row['beverage_id'], row['transaction_type'], row['slot'])
+        )
+        if rollup is None:
+            db.session.add(models.DailyRollup(**row))
+        else:
+            rollup.units += row['units']
+            rollup.revenue += row['revenue']
+
+def record_sale(beverage_id, user_id, units=1):
+    """Atomically decrement stock and record the sale transaction.
+
+    The stock check and the decrement are a single conditional UPDATE (of
+    the beverage row or one of its stock slots), so concurrent sales of the
+    same beverage can never take quantity below zero. Returns ``(name,
+    new_quantity, is_active)`` or ``None`` when there is not enough stock
+    (or the beverage does not exist). The caller commits.
+    """
+    row, slot = _take_stock(beverage_id, units)
+    if row is None:
+        return None
+
+    now = datetime.utcnow()
+    db.session.add(models.Transaction(
+        beverage_id=beverage_id,
+        user_id=user_id,
+        quantity_change=-units,
+        timestamp=now,
+        transaction_type='sale'
+    ))
+    add_to_rollup([(now, beverage_id, 'sale', units, units * row.price)], {beverage_id: slot})
+    return row.name, row.quantity, row.is_active
+
+def record_sales(items, user_id):
+    """Apply a cart of ``{beverage_id: units}`` as one all-or-nothing sale.
+
+    Beverages are decremented in id order so concurrent carts lock rows in
+    the same order, and all sale transactions are written with a single
+    bulk INSERT. Returns ``({beverage_id: (name, new_quantity, is_active)}, None)`` on
+    success or ``(None, beverage_id)`` for the first line that could not be
+    fulfilled; in that case the caller must roll back.
+    """
+    results = {}
+    prices = {}
+    slots = {}
+    for beverage_id in sorted(items):
+        row, slots[beverage_id] = _take_stock(beverage_id, items[beverage_id])
+        if row is None:
+            return None, beverage_id
+        results[beverage_id] = (row.name, row.quantity, row.is_active)
+        prices[beverage_id] = row.price
+
+    now = datetime.utcnow()
+    db.session.execute(db.insert(models.Transaction), [
+        {
+            'beverage_id': beverage_id,
+            'user_id': user_id,
+            'quantity_change': -units,
+            'timestamp': now,
+            'transaction_type': 'sale',
+        }
+        for beverage_id, units in items.items()
+    ])
+    add_to_rollup([
+        (now, beverage_id, 'sale', units, units * prices[beverage_id])
+        for beverage_id, units in items.items()
+    ], slots)
+    return results, None
+
+def rebuild_rollup():
+    """Recompute the daily rollup from the transaction table. Days of
+    archived months are kept as they are.
+
+    Transactions do not record the price they were made at, so revenue
+    keeps the average unit price of the rollup being replaced for each day,
+    beverage and type; only days the rollup did not have yet are valued at
+    the current price."""
+    day = db.func.date(models.Transaction.timestamp)
+    units = db.func.sum(db.func.abs(models.Transaction.quantity_change))
+    archived_until = archive_service.archived_until()
+    delete = db.delete(models.DailyRollup)
+    kept = db.true()
+    live = db.true()
+    if archived_until is not None:
+        kept = models.DailyRollup.day >= archived_until.date()
+        delete = delete.where(kept)
+        live = models.Transaction.timestamp >= archived_until
+
+    connection = db.session.connection()
+    prices = db.Table(
+        'rollup_unit_price', db.MetaData(),
+        db.Column('day', db.Date, primary_key=True),
+        db.Column('beverage_id', db.Integer, primary_key=True),
+        db.Column('transaction_type', db.String(20), primary_key=True),
+        db.Column('unit_price', db.Float, nullable=False),
+        prefixes=['TEMPORARY'],
+    )
+    prices.create(connection)
+    db.session.execute(
+        db.insert(prices).from_select(
+            ['day', 'beverage_id', 'transaction_type', 'unit_price'],
+            db.select(
+                models.DailyRollup.day,
+                models.DailyRollup.beverage_id,
+                models.DailyRollup.transaction_type,
+                db.func.sum(models.DailyRollup.revenue) / db.func.sum(models.DailyRollup.units)
+            ).where(
+                kept
+            ).group_by(
+                models.DailyRollup.day,
+                models.DailyRollup.beverage_id,
+                models.DailyRollup.transaction_type
+            ).having(
+                db.func.sum(models.DailyRollup.units) > 0
+            )
+        )
+    )
+    db.session.execute(delete)
+    unit_price = db.func.coalesce(prices.c.unit_price, models.Beverage.price)
+    db.session.execute(
+        db.insert(models.DailyRollup).from_select(
+            ['day', 'beverage_id', 'transaction_type', 'slot', 'units', 'revenue'],
+            db.select(
+                day,
+                models.Transaction.beverage_id,
+                models.Transaction.transaction_type,
+                db.literal(0),
+                units,
+                units * unit_price
+            ).join(
+                models.Beverage
+            ).outerjoin(
+                prices,
+                db.and_(
+                    prices.c.day == day,
+                    prices.c.beverage_id == models.Transaction.beverage_id,
+                    prices.c.transaction_type == models.Transaction.transaction_type
+                )
+            ).where(
+                live
+            ).group_by(
+                day,
+                models.Transaction.beverage_id,
+                models.Transaction.transaction_type,
+                unit_price
+            )
+        )
+    )
+    prices.drop(connection)
+    db.session.commit()
+    return db.session.query(db.func.count()).select_from(models.DailyRollup).scalar()
+
+def raw_sales_query(start, end):
+    return db.session.query(
+        models.Transaction.beverage_id,
+        db.func.sum(db.func.abs(models.Transaction.quantity_change))
+    ).filter(
+        models.Transaction.transaction_type == 'sale',
+        models.Transaction.timestamp >= start,
+        models.Transaction.timestamp <= end
+    ).group_by(
+        models.Transaction.beverage_id
+    )
+
+def sales_by_beverage(start, end):
+    """Units sold per beverage between ``start`` and ``end`` (inclusive).
+
+    Whole days inside the range are read from the daily rollup and only the
+    partial days at either edge touch raw transaction rows. Returns a list
+    of ``(beverage_id, name, units)``.
+    """
+    first_day = datetime.combine(start.date(), datetime.min.time())
+    if first_day < start:
+        first_day += timedelta(days=1)
+    last_day_end = datetime.combine(end.date(), datetime.min.time())
+
+    def raw_part(part_start, part_end):
+        # Partial days may fall in an archived month
+        units = dict(raw_sales_query(part_start, part_end).all())
+        archived = archive_service.archived_changes(
+            part_start, part_end + timedelta(microseconds=1), transaction_type='sale'
+        )
+        for beverage_id, change in archived.items():
+            units[beverage_id] = (units.get(beverage_id) or 0) - change
+        return units.items()
+
+    totals = {}
+    if first_day < last_day_end:
+        parts = [
+            raw_part(start, first_day - timedelta(microseconds=1)) if start < first_day else [],
+            db.session.query(
+                models.DailyRollup.beverage_id,
+                db.func.sum(models.DailyRollup.units)
+            ).filter(
+                models.DailyRollup.transaction_type == 'sale',
+                models.DailyRollup.day >= first_day.date(),
+                models.DailyRollup.day < last_day_end.date()
+            ).group_by(
+                models.DailyRollup.beverage_id
+            ).all(),
+            raw_part(last_day_end, end),
+        ]
+    else:
+        parts = [raw_part(start, end)]
+
+    for part in parts:
+        for beverage_id, units in part:
+            totals[beverage_id] = totals.get(beverage_id, 0) + int(units or 0)
+    if not totals:
+        return []
+
+    names = dict(db.session.query(models.Beverage.id, models.Beverage.name).filter(
+        models.Beverage.id.in_(totals)
+    ).all())
+    return [
+        (beverage_id, names[beverage_id], units)
+        for beverage_id, units in totals.items()
+        if units and beverage_id in names
+    ]
+
+def sales_export_query(start, end):
+    return db.session.query(
+        models.Beverage.name,
+        models.Transaction.quantity_change,
+        models.Transaction.timestamp,
+        models.Beverage.price,
+        models.User.email.label('user_email')
+    ).join(
+        models.Beverage
+    ).join(
+        models.User
+    ).filter(
+        models.Transaction.transaction_type == 'sale',
+        models.Transaction.timestamp >= start,
+        models.Transaction.timestamp <= end
+    ).order_by(models.Transaction.timestamp.desc(), models.Transaction.id.desc())
+
+def transactions_export_query(start, end):
+    return db.session.query(
+        models.Beverage.name,
+        models.Transaction.quantity_change,
+        models.Transaction.timestamp,
+        models.Transaction.transaction_type,
+        models.User.email.label('user_email')
+    ).join(
+        models.Beverage
+    ).join(
+        models.User
+    ).filter(
+        models.Transaction.timestamp >= start,
+        models.Transaction.timestamp <= end
+    ).order_by(models.Transaction.timestamp.desc(), models.Transaction.id.desc())
+
+def sales_export_rows(start, end):
+    """Rows for the sales export, live and archived"""
+    return archive_service.WithArchived(sales_export_query(start, end), start, end, 'sale')
+
+def transactions_export_rows(start, end):
+    """Rows for the transactions export, live and archived"""
+    return archive_service.WithArchived(transactions_export_query(start, end), start, end)
+
+# Stock ledger: Transaction rows are the source of truth for quantities.
+# StockSnapshot rows checkpoint the running total so that the stock at any
+# instant is one snapshot plus the few transactions after it, and
+# Beverage.quantity is a cached copy that check_stock_drift() verifies.
+LEDGER_EPOCH = datetime(1970, 1, 1)  # opening balances recorded by the migration
+SNAPSHOT_LAG = timedelta(minutes=10)  # let in-flight transactions commit first
+
+def _ledger_query(at=None, beverage_ids=None):
+    """``(beverage_id, quantity)`` for every beverage from its latest
+    snapshot before ``at`` plus the transactions since (all of them when
+    ``at`` is None)"""
+    snapshot = models.StockSnapshot
+    transaction = models.Transaction
+
+    latest = db.select(
+        snapshot.beverage_id,
+        db.func.max(snapshot.taken_at).label('taken_at')
+    ).group_by(snapshot.beverage_id)
+    if at is not None:
+        latest = latest.where(snapshot.taken_at <= at)
+    if beverage_ids is not None:
+        latest = latest.where(snapshot.beverage_id.in_(beverage_ids))
+    latest = latest.subquery()
+
+    base = db.select(
+        models.Beverage.id.label('beverage_id'),
+        db.func.coalesce(snapshot.quantity, 0).label('quantity'),
+        db.func.coalesce(latest.c.taken_at, LEDGER_EPOCH).label('taken_at')
+    ).outerjoin(
+        latest, latest.c.beverage_id == models.Beverage.id
+    ).outerjoin(
+        snapshot, db.and_(snapshot.beverage_id == latest.c.beverage_id,
+                          snapshot.taken_at == latest.c.taken_at)
+    )
+    if beverage_ids is not None:
+        base = base.where(models.Beverage.id.in_(beverage_ids))
+    base = base.subquery()
+
+    window = db.and_(transaction.beverage_id == base.c.beverage_id,
+                     transaction.timestamp >= base.c.taken_at)
+    if at is not None:
+        window = db.and_(window, transaction.timestamp < at)
+    return db.select(
+        base.c.beverage_id,
+        (base.c.quantity + db.func.coalesce(db.func.sum(transaction.quantity_change), 0)).label('quantity'),
+        base.c.taken_at
+    ).outerjoin(
+        transaction, window
+    ).group_by(base.c.beverage_id, base.c.quantity, base.c.taken_at)
+
+def stock_as_of(at, beverage_ids=None):
+    """``{beverage_id: quantity}`` counting every transaction before ``at``"""
+    stock = {}
+    since = {}
+    until = archive_service.archived_until()
+    for beverage_id, quantity, taken_at in db.session.execute(_ledger_query(at, beverage_ids)):
+        stock[beverage_id] = int(quantity)
+        if until is not None and taken_at < until:
+            since.setdefault(taken_at, []).append(beverage_id)
+    # Only when asking about a moment inside an archived month
+    for taken_at, ids in since.items():
+        for beverage_id, change in archive_service.archived_changes(taken_at, at, set(ids)).items():
+            stock[beverage_id] += change
+    return stock
+
+def check_stock_drift():
+    """``[(beverage_id, name, cached quantity, ledger quantity)]`` for every
+    beverage whose Beverage.quantity (the sum of its stock slots if it has
+    them) disagrees with the ledger. One query, so sales committed
+    meanwhile cannot show up as drift."""
+    ledger = _ledger_query().subquery()
+    quantity = stock_slot_service.current_quantity()
+    return db.session.execute(
+        db.select(
+            models.Beverage.id, models.Beverage.name, quantity, ledger.c.quantity
+        ).join(
+            ledger, ledger.c.beverage_id == models.Beverage.id
+        ).where(
+            quantity != ledger.c.quantity
+        ).order_by(models.Beverage.id)
+    ).all()
+
+def fix_stock_drift():
+    """Reset Beverage.quantity (or the stock slots) from the ledger; returns
+    the repaired rows"""
+    drift = check_stock_drift()
+    for beverage_id, _, _, quantity in drift:
+        slots = db.session.execute(
+            db.update(models.Beverage)
+            .where(models.Beverage.id == beverage_id)
+            .values(quantity=quantity, version=models.Beverage.version + 1)
+            .returning(models.Beverage.stock_slots)
+        ).scalar()
+        if slots:
+            stock_slot_service.resize(beverage_id, slots, quantity)
+    db.session.commit()
+    return drift
+
+def _insert_snapshots(rows):
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        db.session.execute(insert(models.StockSnapshot).values(rows).on_conflict_do_nothing())
+        return
+    for row in rows:
+        db.session.merge(models.StockSnapshot(**row))
+
+def take_stock_snapshot(at=None):
+    """Snapshot every beverage at ``at`` (default: the last midnight UTC at
+    least SNAPSHOT_LAG ago). Safe to run repeatedly and from several
+    processes: an existing snapshot is left alone."""
+    latest_allowed = datetime.utcnow() - SNAPSHOT_LAG
+    if at is None:
+        at = datetime.combine(latest_allowed.date(), datetime.min.time())
+    elif at > latest_allowed:
+        # A sale still in flight could commit a timestamp before ``at``
+        # after the snapshot has been taken
+        raise ValueError(f"Snapshots must be at least {SNAPSHOT_LAG} in the past")
+    rows = [
+        {'beverage_id': beverage_id, 'taken_at': at, 'quantity': quantity}
+        for beverage_id, quantity in stock_as_of(at).items()
+    ]
+    _insert_snapshots(rows)
+    db.session.commit()
+    return at, len(rows)
+
+def rebuild_stock_snapshots():
+    """Recreate the daily snapshots of every complete day from the opening
+    balances and the daily rollup; returns the number of snapshots"""
+    opening = dict(db.session.query(
+        models.StockSnapshot.beverage_id, models.StockSnapshot.quantity
+    ).filter(models.StockSnapshot.taken_at == LEDGER_EPOCH).all())
+    db.session.execute(db.delete(models.StockSnapshot).where(models.StockSnapshot.taken_at > LEDGER_EPOCH))
+
+    today = datetime.utcnow().date()
+    net = db.case((models.DailyRollup.transaction_type == 'sale', -models.DailyRollup.units),
+                  else_=models.DailyRollup.units)
+    days = db.session.query(
+        models.DailyRollup.beverage_id, models.DailyRollup.day, db.func.sum(net)
+    ).filter(
+        models.DailyRollup.day < today
+    ).group_by(
+        models.DailyRollup.beverage_id, models.DailyRollup.day
+    ).order_by(
+        models.DailyRollup.beverage_id, models.DailyRollup.day
+    )
+
+    rows = []
+    count = 0
+    running = {}
+    for beverage_id, day, change in days:
+        running[beverage_id] = running.get(beverage_id, opening.get(beverage_id, 0)) + int(change)
+        rows.append({
+            'beverage_id': beverage_id,
+            'taken_at': datetime.combine(day + timedelta(days=1), datetime.min.time()),
+            'quantity': running[beverage_id],
+        })
+        if len(rows) == 1000:
+            _insert_snapshots(rows)
+            count += len(rows)
+            rows = []
+    _insert_snapshots(rows)
+    count += len(rows)
+    db.session.commit()
+    return count
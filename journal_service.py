@@ -0,0 +1,418 @@
+import os
+import glob
+import json
+import zlib
+import uuid
+import fcntl
+import atexit
+import logging
+import itertools
+import threading
+from collections import Counter, deque, namedtuple
+from datetime import datetime
+from app import db
+import models
+import inventory_service
+import metrics_service
+import stock_slot_service
+
+logger = logging.getLogger(__name__)
+
+# Write-behind mode for /api/decrease, off unless a directory is set. The
+# directory must be on local disk and kept across restarts.
+SALE_JOURNAL_DIR = os.environ.get('SALE_JOURNAL_DIR', '')
+# Most journaled sales applied in one database commit
+SALE_JOURNAL_GROUP_SIZE = int(os.environ.get('SALE_JOURNAL_GROUP_SIZE', 500))
+# Longest a journaled sale waits before the flusher applies it
+SALE_JOURNAL_FLUSH_SECONDS = float(os.environ.get('SALE_JOURNAL_FLUSH_SECONDS', 0.05))
+# A fully applied journal file is emptied once it grows past this size
+SALE_JOURNAL_MAX_BYTES = int(os.environ.get('SALE_JOURNAL_MAX_BYTES', 16 * 1024 * 1024))
+
+JournalEntry = namedtuple('JournalEntry', ['sequence', 'beverage_id', 'user_id', 'units', 'timestamp'])
+
+def encode_entry(entry):
+    """One journal line: CRC32 of the JSON payload, a space, the payload"""
+    payload = json.dumps([entry.sequence, entry.beverage_id, entry.user_id, entry.units,
+                          entry.timestamp.isoformat()], separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+def read_entries(path):
+    """Yield the entries of a journal file. Reading stops at the first
+    incomplete or corrupt line: only the last append can be cut short by a
+    crash, and a sale is acknowledged after its line is fsynced."""
+    with open(path, 'rb') as f:
+        for number, line in enumerate(f, start=1):
+            checksum, _, payload = line.rstrip(b'\n').partition(b' ')
+            if not line.endswith(b'\n') or checksum != b'%08x' % zlib.crc32(payload):
+                logger.warning(f"Ignoring torn journal line {number} and after in {path}")
+                return
+            sequence, beverage_id, user_id, units, timestamp = json.loads(payload)
+            yield JournalEntry(sequence, beverage_id, user_id, units, datetime.fromisoformat(timestamp))
+
+def applied_sequence(journal_id):
+    return db.session.scalar(
+        db.select(models.JournalCheckpoint.sequence).where(models.JournalCheckpoint.journal == journal_id)
+    ) or 0
+
+def apply_entries(journal_id, entries):
+    """Apply journaled sales in one database transaction: one UPDATE per
+    beverage, one bulk INSERT of the sale transactions, the daily rollup and
+    the journal checkpoint, committed together so each entry is applied
+    exactly once.
+
+    The decrement is unconditional: the stock was checked when the sale was
+    journaled and the till already has its answer. Beverages with stock
+    slots are decremented in their slots instead of their row.
+    """
+    units = {}
+    for entry in entries:
+        units[entry.beverage_id] = units.get(entry.beverage_id, 0) + entry.units
+
+    prices = {}
+    for beverage_id in sorted(units):
+        sharded = models.Beverage.stock_slots > 0
+        row = db.session.execute(
+            db.update(models.Beverage)
+            .where(models.Beverage.id == beverage_id)
+            .values(quantity=db.case((sharded, models.Beverage.quantity),
+                                     else_=models.Beverage.quantity - units[beverage_id]),
+                    version=models.Beverage.version + 1)
+            .returning(models.Beverage.quantity, models.Beverage.price, models.Beverage.stock_slots)
+            .execution_options(synchronize_session=False)
+        ).first()
+        prices[beverage_id] = row.price
+        quantity = row.quantity
+        if row.stock_slots:
+            stock_slot_service.take(beverage_id, units[beverage_id], allow_negative=True)
+            quantity = db.session.scalar(db.select(stock_slot_service.slot_total(beverage_id)))
+        if quantity < 0:
+            logger.warning(f"Beverage {beverage_id} stock is {quantity} after journaled sales")
+
+    db.session.execute(db.insert(models.Transaction), [
+        {
+            'beverage_id': entry.beverage_id, 'user_id': entry.user_id, 'quantity_change': -entry.units,
+            'timestamp': entry.timestamp, 'transaction_type': 'sale',
+        }
+        for entry in entries
+    ])
+    inventory_service.add_to_rollup([
+        (entry.timestamp, entry.beverage_id, 'sale', entry.units, entry.units * prices[entry.beverage_id])
+        for entry in entries
+    ])
+    db.session.merge(models.JournalCheckpoint(journal=journal_id, sequence=entries[-1].sequence))
+    db.session.commit()
+
+def _forget(journal_id):
+    db.session.execute(db.delete(models.JournalCheckpoint).where(models.JournalCheckpoint.journal == journal_id))
+    db.session.commit()
+
+def recover(directory, group_size=SALE_JOURNAL_GROUP_SIZE):
+    """Replay the journals left behind by processes that died before
+    flushing them. Journals of running processes are locked and skipped.
+    Returns the number of sales applied."""
+    for path in glob.glob(os.path.join(directory, 'sales-*.journal.new')):
+        # Created by a process that died before its first sale was written
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.unlink(path)
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        finally:
+            os.close(fd)
+
+    applied = 0
+    for path in sorted(glob.glob(os.path.join(directory, 'sales-*.journal'))):
+        journal_id = os.path.basename(path)[:-len('.journal')]
+        fd = os.open(path, os.O_RDWR)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if not os.path.exists(path):
+                continue  # recovered by another process meanwhile
+            done = applied_sequence(journal_id)
+            entries = (entry for entry in read_entries(path) if entry.sequence > done)
+            for group in iter(lambda: list(itertools.islice(entries, group_size)), []):
+                apply_entries(journal_id, group)
+                applied += len(group)
+            # Unlink before dropping the checkpoint: a crash in between
+            # leaves a stale row, never a journal without its checkpoint
+            os.unlink(path)
+            _forget(journal_id)
+        finally:
+            os.close(fd)
+    if applied:
+        logger.info(f"Recovered {applied} journaled sales")
+    return applied
+
+class SaleJournal:
+    """Durable write-behind log of single sales for this process.
+
+    ``record_sale`` checks the stock, appends the sale to an append-only
+    file and returns once the file is fsynced; concurrent callers share one
+    fsync. A background thread applies the journaled sales to the database
+    in groups of up to ``group_size`` per commit. The journal file is
+    locked for the life of the process so ``recover`` can tell it from the
+    journal of a process that crashed.
+    """
+
+    def __init__(self, app, directory, group_size=SALE_JOURNAL_GROUP_SIZE,
+                 flush_seconds=SALE_JOURNAL_FLUSH_SECONDS, max_bytes=SALE_JOURNAL_MAX_BYTES):
+        self.app = app
+        self.directory = directory
+        self.group_size = group_size
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes
+        self.journal_id = f"sales-{uuid.uuid4().hex}"
+        self.path = os.path.join(directory, f"{self.journal_id}.journal")
+        self._fd = None
+        self._next_sequence = 1
+        self._durable_sequence = 0
+        self._failed = set()         # sequences released after a failed write, until their caller hears
+        self._buffer = []            # entries not written yet
+        self._unflushed = deque()    # durable entries not applied to the database yet
+        self._pending = {}           # beverage_id -> deque of (sequence, units) recently journaled
+        self._committed_sequence = 0
+        self._readers = Counter()    # committed sequence seen by sellers still checking stock
+        self._lock = threading.Lock()        # sequence numbers, buffer and pending sales
+        self._sync_lock = threading.Lock()   # one write and fsync at a time
+        self._flush_lock = threading.Lock()  # one group applied at a time
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def _open(self):
+        # Locked under a temporary name first so recover() never sees an
+        # unlocked live journal
+        temporary = f"{self.path}.new"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(temporary, self.path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._fd = fd
+
+    def record_sale(self, beverage_id, user_id, units=1):
+        """Journal one sale. Returns ``(name, new_quantity, is_active)`` or
+        ``None`` when there is not enough stock, like
+        ``inventory_service.record_sale``, but nothing is left for the
+        caller to commit."""
+        with self._lock:
+            floor = self._committed_sequence
+            self._readers[floor] += 1
+        try:
+            row = self._read_stock(beverage_id)
+            if row is not None and (row.applied or 0) < floor:
+                # Snapshot taken before our last flush (a read transaction
+                # opened earlier in the request): read again in a new one
+                db.session.rollback()
+                row = self._read_stock(beverage_id)
+            if row is None:
+                return None
+            with self._lock:
+                # Sales up to the checkpoint read with the quantity are in
+                # the quantity; the ones after it are still pending here
+                applied = row.applied or 0
+                pending = self._pending.get(beverage_id, ())
+                new_quantity = row.quantity - sum(count for sequence, count in pending if sequence > applied) - units
+                if new_quantity < 0:
+                    return None
+                entry = JournalEntry(self._next_sequence, beverage_id, user_id, units, datetime.utcnow())
+                self._next_sequence += 1
+                self._buffer.append(entry)
+                self._pending.setdefault(beverage_id, deque()).append((entry.sequence, units))
+        finally:
+            with self._lock:
+                self._readers[floor] -= 1
+                if not self._readers[floor]:
+                    del self._readers[floor]
+        self._sync(entry.sequence)
+        return row.name, new_quantity, row.is_active
+
+    def _read_stock(self, beverage_id):
+        return db.session.execute(
+            db.select(
+                models.Beverage.name, stock_slot_service.current_quantity().label('quantity'),
+                models.Beverage.is_active,
+                db.select(models.JournalCheckpoint.sequence)
+                .where(models.JournalCheckpoint.journal == self.journal_id)
+                .scalar_subquery().label('applied'),
+            ).where(models.Beverage.id == beverage_id)
+        ).first()
+
+    def _sync(self, sequence):
+        """Make sure ``sequence`` is on disk. Whoever gets the sync lock
+        writes everything buffered so far, so waiting callers usually find
+        their entry already synced. Raises OSError if the write carrying
+        ``sequence`` failed, even when later entries were written since."""
+        with self._sync_lock:
+            with self._lock:
+                if sequence in self._failed:
+                    self._failed.discard(sequence)
+                    raise OSError(f"Sale journal write failed for sequence {sequence}")
+            if self._durable_sequence >= sequence:
+                return
+            with self._lock:
+                entries, self._buffer = self._buffer, []
+            if not entries:
+                raise OSError(f"Sale journal entry {sequence} is neither buffered nor written")
+            try:
+                if self._fd is None:
+                    self._open()
+                offset = os.fstat(self._fd).st_size
+                data = b''.join(encode_entry(entry) for entry in entries)
+                try:
+                    while data:
+                        data = data[os.write(self._fd, data):]
+                    os.fdatasync(self._fd)
+                except OSError:
+                    # Drop a torn tail: recovery stops reading at the first
+                    # bad line, which would hide the entries written after it
+                    os.ftruncate(self._fd, offset)
+                    raise
+            except OSError:
+                # None of these sales was acknowledged; the callers of the
+                # others find out from _failed
+                self._release(entries)
+                with self._lock:
+                    self._failed.update(entry.sequence for entry in entries if entry.sequence != sequence)
+                raise
+            with self._lock:
+                self._unflushed.extend(entries)
+                self._durable_sequence = entries[-1].sequence
+                backlog = len(self._unflushed)
+        if backlog >= self.group_size:
+            self._wakeup.set()
+
+    def _release(self, entries):
+        """Drop entries that were never acknowledged"""
+        with self._lock:
+            for entry in entries:
+                pending = self._pending[entry.beverage_id]
+                pending.remove((entry.sequence, entry.units))
+                if not pending:
+                    del self._pending[entry.beverage_id]
+
+    def _prune(self):
+        """Forget applied sales no seller can still need. A seller that read
+        the stock before a checkpoint was committed subtracts every pending
+        sale after the checkpoint it saw, so those stay until it is done."""
+        floor = min(self._readers, default=self._committed_sequence)
+        for beverage_id, pending in list(self._pending.items()):
+            while pending and pending[0][0] <= floor:
+                pending.popleft()
+            if not pending:
+                del self._pending[beverage_id]
+
+    def flush(self):
+        """Apply every durable entry to the database. Returns the number applied."""
+        applied = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    group = list(itertools.islice(self._unflushed, self.group_size))
+                if not group:
+                    break
+                with self.app.app_context():
+                    try:
+                        apply_entries(self.journal_id, group)
+                    except Exception:
+                        db.session.rollback()
+                        raise
+                with self._lock:
+                    for _ in group:
+                        self._unflushed.popleft()
+                    self._committed_sequence = group[-1].sequence
+                    self._prune()
+                applied += len(group)
+            self._truncate()
+        return applied
+
+    def _truncate(self):
+        if self._fd is None or os.fstat(self._fd).st_size < self.max_bytes:
+            return
+        with self._sync_lock, self._lock:
+            if not self._buffer and not self._unflushed:
+                # O_APPEND: the next write starts again at offset 0
+                os.ftruncate(self._fd, 0)
+                os.fsync(self._fd)
+
+    def backlog(self):
+        return len(self._unflushed)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error applying journaled sales: {str(e)}")
+                self._wakeup.wait(1)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sale-journal', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher and apply what is left. The journal is removed
+        only when everything in it reached the database; otherwise it stays
+        for recover()."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Journaled sales left for recovery: {str(e)}")
+        if self._fd is None:
+            return
+        if not self._unflushed and not self._buffer:
+            os.unlink(self.path)
+            with self.app.app_context():
+                _forget(self.journal_id)
+        os.close(self._fd)
+        self._fd = None
+
+def init_app(app):
+    """Recover journals left by crashed processes and start this process's
+    journal when SALE_JOURNAL_DIR is set"""
+    directory = app.config.get('SALE_JOURNAL_DIR', SALE_JOURNAL_DIR)
+    if not directory:
+        return
+    # Each process checks stock against its own pending sales only, so two
+    # workers could both sell the last units of a beverage
+    if app.config['WEB_CONCURRENCY'] > 1:
+        raise RuntimeError(
+            f"SALE_JOURNAL_DIR needs a single worker process, but WEB_CONCURRENCY is "
+            f"{app.config['WEB_CONCURRENCY']}. Set WEB_CONCURRENCY=1 or unset SALE_JOURNAL_DIR."
+        )
+    os.makedirs(directory, exist_ok=True)
+    group_size = app.config.get('SALE_JOURNAL_GROUP_SIZE', SALE_JOURNAL_GROUP_SIZE)
+    with app.app_context():
+        recover(directory, group_size)
+    journal = SaleJournal(app, directory, group_size,
+                          app.config.get('SALE_JOURNAL_FLUSH_SECONDS', SALE_JOURNAL_FLUSH_SECONDS))
+    journal.start()
+    app.extensions['sale_journal'] = journal
+    _journals.append(journal)
+
+def get_journal():
+    """This process's sale journal, or None when write-behind mode is off"""
+    from flask import current_app
+    return current_app.extensions.get('sale_journal')
+
+_journals = []
+
+metrics_service.Gauge(
+    'sale_journal_backlog', 'Journaled sales not applied to the database yet',
+    lambda: sum(journal.backlog() for journal in _journals))
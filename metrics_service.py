@@ -0,0 +1,209 @@
+import os
+import time
+import bisect
+import threading
+
+# Prometheus text format metrics kept in process memory. Every gunicorn
+# worker has its own counters, so a scrape of /metrics reports the worker
+# that answered it; aggregate with sum() across scrapes in Prometheus.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes', 'on')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+enabled = METRICS_ENABLED
+_registry = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        if not enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram:
+    """Cumulative bucket histogram, optionally split by labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        if not enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(entry) for labels, entry in self._values.items()}
+        for labels, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                le = (('le', _format_value(bound)),)
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), cumulative
+            le = (('le', '+Inf'),)
+            yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), entry[-1]
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), entry[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), entry[-1]
+
+class Gauge:
+    """Value read from ``function`` at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        _registry.append(self)
+
+    def samples(self):
+        yield self.name, '', self.function()
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+# Metrics recorded by the service modules
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent building the response, by route',
+    ['method', 'route'])
+requests_total = Counter(
+    'http_requests_total', 'Requests handled, by route and status code',
+    ['method', 'route', 'status'])
+db_queries = Histogram(
+    'db_queries_per_request', 'SQL statements executed per request, by route',
+    ['route'], buckets=COUNT_BUCKETS)
+db_query_duration = Histogram(
+    'db_query_duration_seconds_per_request', 'Time spent in SQL statements per request, by route',
+    ['route'])
+image_processing_duration = Histogram(
+    'image_processing_duration_seconds', 'Time to generate all variants of an uploaded image')
+image_processing_failures = Counter(
+    'image_processing_failures_total', 'Uploaded images whose variants could not be generated')
+smtp_send_duration = Histogram(
+    'smtp_send_duration_seconds', 'Time to send one email, including reconnects')
+smtp_send_failures = Counter(
+    'smtp_send_failures_total', 'Emails that could not be sent')
+export_rows = Counter(
+    'export_rows_total', 'Rows written to exports, by export and format',
+    ['export', 'format'])
+export_bytes = Counter(
+    'export_bytes_total', 'Bytes streamed by exports, by export and format',
+    ['export', 'format'])
+
+def _route():
+    from flask import request
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_query_start'] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    from flask import g, has_request_context
+    if has_request_context() and 'metrics_start' in g:
+        g.db_queries += 1
+        g.db_seconds += time.perf_counter() - conn.info['metrics_query_start']
+
+def _start_request():
+    from flask import g
+    g.metrics_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+
+def _finish_request(response):
+    from flask import g, request
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        route = _route()
+        request_duration.observe(time.perf_counter() - start, request.method, route)
+        requests_total.inc(request.method, route, str(response.status_code))
+        db_queries.observe(g.db_queries, route)
+        db_query_duration.observe(g.db_seconds, route)
+    return response
+
+def init_app(app):
+    """Install the request and SQL hooks; without them (METRICS_ENABLED=0)
+    the only cost left on the hot paths is one flag check per metric."""
+    global enabled
+    enabled = app.config.get('METRICS_ENABLED', METRICS_ENABLED)
+    if not enabled:
+        return
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -2,6 +2,7 @@ from datetime import datetime
 from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from config import PASSWORD_HASH_METHOD
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,7 +13,7 @@ class User(UserMixin, db.Model):
     transactions = db.relationship('Transaction', backref='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -23,9 +24,16 @@ class Beverage(db.Model):
     quantity = db.Column(db.Integer, default=0)
     price = db.Column(db.Float, nullable=False)
     image_path = db.Column(db.String(255))
+    image_variants_ready = db.Column(db.Boolean, default=False, nullable=False)  # resized copies generated
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)  # bumped on every change shown to tills
+    change_seq = db.Column(db.BigInteger, index=True)  # set by a database trigger on every write, see sync_service
+    change_xid = db.Column(db.BigInteger, index=True)  # Postgres: transaction of the last write, set by the same trigger
+    # With N > 0 the stock is split across N StockSlot rows and quantity is
+    # their cached total, see stock_slot_service
+    stock_slots = db.Column(db.Integer, default=0, server_default='0', nullable=False, index=True)
     transactions = db.relationship('Transaction', backref='beverage', lazy=True)
 
 class Transaction(db.Model):
@@ -35,3 +43,59 @@ class Transaction(db.Model):
     quantity_change = db.Column(db.Integer, nullable=False)  # negative for sales, positive for restocks
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     transaction_type = db.Column(db.String(20), nullable=False)  # 'sale' or 'restock'
+
+    __table_args__ = (
+        # Sales stats/exports filter on type + time range, full exports on time range only
+        db.Index('ix_transaction_type_timestamp', 'transaction_type', 'timestamp'),
+        db.Index('ix_transaction_timestamp', 'timestamp'),
+        db.Index('ix_transaction_beverage_timestamp', 'beverage_id', 'timestamp'),
+    )
+
+class SaleBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    response = db.Column(db.Text, nullable=False)  # JSON body returned to the till (one sale's result for offline sales)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Keys are made up by the tills, so each user has their own
+        db.UniqueConstraint('user_id', 'idempotency_key', name='uq_sale_batch_user_key'),
+    )
+
+class DailyRollup(db.Model):
+    """Per beverage, per day totals of Transaction rows, maintained on every
+    write. Sales of a beverage with stock slots spread over one row per
+    slot, so readers sum over ``slot``."""
+    day = db.Column(db.Date, primary_key=True)
+    beverage_id = db.Column(db.Integer, db.ForeignKey('beverage.id'), primary_key=True)
+    transaction_type = db.Column(db.String(20), primary_key=True)
+    slot = db.Column(db.Integer, primary_key=True, default=0, server_default='0')
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class StockSnapshot(db.Model):
+    """Stock of a beverage counting every Transaction before ``taken_at``"""
+    beverage_id = db.Column(db.Integer, db.ForeignKey('beverage.id'), primary_key=True)
+    taken_at = db.Column(db.DateTime, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+
+class StockSlot(db.Model):
+    """Part of the stock of a beverage with ``stock_slots`` > 0; concurrent
+    sales decrement different slots instead of one row"""
+    beverage_id = db.Column(db.Integer, db.ForeignKey('beverage.id'), primary_key=True)
+    slot = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+
+class TransactionArchive(db.Model):
+    """One calendar month of Transaction rows moved out of the live table"""
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    row_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)  # gzipped CSV, newest first
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class JournalCheckpoint(db.Model):
+    """Last sequence of a sale journal applied to the database, committed
+    with the sales themselves so a journal is never replayed twice"""
+    journal = db.Column(db.String(64), primary_key=True)
+    sequence = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,11 @@
+from app import create_app
+from inventory_service import rebuild_rollup
+
+def main():
+    app = create_app({'START_BACKGROUND_JOBS': False})
+    with app.app_context():
+        rows = rebuild_rollup()
+        print(f"Daily rollup rebuilt with {rows} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import os
+import re
+import bisect
+import logging
+import threading
+import unicodedata
+from sqlalchemy.dialects.postgresql import ARRAY
+from app import db
+import models
+
+logger = logging.getLogger(__name__)
+
+# Rows per page of the restock table
+BEVERAGE_PAGE_SIZE = int(os.environ.get('BEVERAGE_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = 200
+# Suggestions returned by the type-ahead search
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+# Same default as pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+# Names scored for a fuzzy match by the in-memory index, taken from the
+# postings of the rarest trigrams of the query first
+MAX_FUZZY_CANDIDATES = 2000
+
+WORD = re.compile(r'\w+')
+
+def fold(text):
+    """Lower case without accents, so that 'cafe' finds 'Café'"""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+def trigrams(text):
+    """Trigrams as pg_trgm makes them: every word padded with two spaces in
+    front and one behind"""
+    result = set()
+    for word in WORD.findall(text):
+        padded = f"  {word} "
+        result.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return result
+
+def similarity(a, b):
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared) if a or b else 0.0
+
+class NameIndex:
+    """Prefix and trigram index of beverage names kept in memory, used when
+    the database has no pg_trgm (SQLite in particular).
+
+    Beverages are never deleted and never renamed, so bringing the index up
+    to date is reading the ids above the last one it has: one indexed range
+    query, usually empty, per search.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._names = {}     # id -> folded name
+        self._full = []      # sorted (folded name, id)
+        self._words = []     # sorted (folded name from its 2nd, 3rd... word, id)
+        self._postings = {}  # trigram -> ids
+
+    def refresh(self):
+        rows = db.session.execute(
+            db.select(models.Beverage.id, models.Beverage.name)
+            .where(models.Beverage.id > self._last_id).order_by(models.Beverage.id)
+        ).all()
+        if not rows:
+            return
+        with self._lock:
+            full, words = [], []
+            for beverage_id, name in rows:
+                if beverage_id in self._names:
+                    continue  # added meanwhile by another thread
+                folded = fold(name)
+                self._names[beverage_id] = folded
+                full.append((folded, beverage_id))
+                words.extend((folded[match.start():], beverage_id) for match in WORD.finditer(folded)
+                             if match.start())
+                for trigram in trigrams(folded):
+                    self._postings.setdefault(trigram, []).append(beverage_id)
+            self._full = self._merge(self._full, full)
+            self._words = self._merge(self._words, words)
+            self._last_id = max(self._last_id, rows[-1][0])
+
+    @staticmethod
+    def _merge(entries, new):
+        if len(new) > 100:
+            return sorted(entries + new)
+        entries = list(entries)  # searches hold on to the old list
+        for entry in new:
+            bisect.insort(entries, entry)
+        return entries
+
+    @staticmethod
+    def _prefixed(entries, prefix, limit, found):
+        index = bisect.bisect_left(entries, (prefix,))
+        while index < len(entries) and len(found) < limit and entries[index][0].startswith(prefix):
+            found.setdefault(entries[index][1], None)
+            index += 1
+
+    def search(self, query, limit):
+        """Ids of the best matches: names starting with ``query`` in name
+        order, then names with a later word starting with it, then the most
+        similar names by trigrams"""
+        self.refresh()
+        folded = fold(query).strip()
+        found = {}  # ordered set
+        full, words, postings = self._full, self._words, self._postings
+        self._prefixed(full, folded, limit, found)
+        self._prefixed(words, folded, limit, found)
+        if len(found) < limit:
+            wanted = trigrams(folded)
+            candidates = set()
+            for trigram in sorted(wanted, key=lambda trigram: len(postings.get(trigram, ()))):
+                if candidates and len(candidates) + len(postings.get(trigram, ())) > MAX_FUZZY_CANDIDATES:
+                    break
+                candidates.update(postings.get(trigram, ()))
+            scored = []
+            for beverage_id in candidates - found.keys():
+                name = self._names[beverage_id]
+                score = similarity(wanted, trigrams(name))
+                if score >= SIMILARITY_THRESHOLD:
+                    scored.append((-score, name, beverage_id))
+            for _, _, beverage_id in sorted(scored)[:limit - len(found)]:
+                found[beverage_id] = None
+        return list(found)
+
+    def find(self, name):
+        """Id of the beverage whose name equals ``name`` ignoring case and accents"""
+        self.refresh()
+        folded = fold(name).strip()
+        full = self._full
+        index = bisect.bisect_left(full, (folded,))
+        if index < len(full) and full[index][0] == folded:
+            return full[index][1]
+        return None
+
+_indexes = {}
+_backends = {}
+
+def _backend():
+    """'trigram' on Postgres with the search key function installed
+    (pg_trgm and unaccent), otherwise 'memory'"""
+    engine = db.engine
+    if engine not in _backends:
+        backend = 'memory'
+        if engine.dialect.name == 'postgresql':
+            installed = db.session.scalar(db.text(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm' "
+                "AND EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'beverage_search_key')"
+            ))
+            if installed:
+                backend = 'trigram'
+            else:
+                logger.warning("pg_trgm or unaccent is not installed, beverage search uses an in-memory index")
+        _backends[engine] = backend
+    return _backends[engine]
+
+def _name_index():
+    return _indexes.setdefault(db.engine, NameIndex())
+
+def _search_key(text):
+    """lower(unaccent(text)) in Postgres, the counterpart of fold()"""
+    return db.func.beverage_search_key(text)
+
+def _ordered(key):
+    # Under the "C" collation, like the btree index on the key: LIKE 'prefix%'
+    # and ORDER BY are then answered from that index, in code point order as
+    # in NameIndex
+    return key.collate('C')
+
+def _like_prefix(key):
+    # '!' as the LIKE escape character avoids backslash quoting differences.
+    # Escaped in SQL: the query is folded by the database, not by fold(). All
+    # immutable, so the planner folds it into a constant and still uses the index
+    for char in '!%_':
+        key = db.func.replace(key, char, '!' + char)
+    return key.concat('%')
+
+def _trigram_search(query, limit):
+    # Same order as NameIndex.search. Names starting with the query come
+    # from the prefix index in search key order, so a short query matching
+    # thousands of names stops at ``limit``; the trigram index finds the rest
+    key = _search_key(models.Beverage.name)
+    folded = _search_key(db.literal(query.strip()))
+    prefix = _like_prefix(folded)
+    word_prefix = db.literal('% ').concat(prefix)
+    ids = db.session.scalars(
+        db.select(models.Beverage.id)
+        .where(_ordered(key).like(prefix, escape='!'))
+        .order_by(_ordered(key), models.Beverage.id)
+        .limit(limit)
+    ).all()
+    if len(ids) < limit:
+        ids += db.session.scalars(
+            db.select(models.Beverage.id)
+            .where(
+                db.or_(key.like(word_prefix, escape='!'), key.op('%')(folded)),
+                db.not_(_ordered(key).like(prefix, escape='!')),
+            )
+            .order_by(
+                key.like(word_prefix, escape='!').desc(),
+                db.func.similarity(key, folded).desc(),
+                _ordered(key),
+                models.Beverage.id,
+            )
+            .limit(limit - len(ids))
+        ).all()
+    return ids
+
+def search(query, limit=SEARCH_LIMIT):
+    """Beverages matching ``query`` for type-ahead, best first"""
+    if not query.strip():
+        return []
+    if _backend() == 'trigram':
+        ids = _trigram_search(query, limit)
+    else:
+        ids = _name_index().search(query, limit)
+    beverages = {
+        beverage.id: beverage
+        for beverage in models.Beverage.query.filter(models.Beverage.id.in_(ids))
+    }
+    return [beverages[beverage_id] for beverage_id in ids if beverage_id in beverages]
+
+def find_by_name(name):
+    """The beverage called ``name``, ignoring case and accents, or None"""
+    beverage = models.Beverage.query.filter_by(name=name).first()
+    if beverage is not None:
+        return beverage
+    if _backend() == 'trigram':
+        return models.Beverage.query.filter(
+            _ordered(_search_key(models.Beverage.name)) == _search_key(db.literal(name.strip()))
+        ).order_by(models.Beverage.id).first()
+    beverage_id = _name_index().find(name)
+    return db.session.get(models.Beverage, beverage_id) if beverage_id is not None else None
+
+def find_names(names, batch_size=500):
+    """``{name: name of the existing beverage}`` for those of ``names``
+    that find_by_name would match, with a query per batch of names instead
+    of per name"""
+    def matches(column, values):
+        values = sorted(values)
+        for start in range(0, len(values), batch_size):
+            yield from db.session.execute(
+                db.select(column, models.Beverage.name).where(column.in_(values[start:start + batch_size]))
+            ).all()
+
+    found = dict(matches(models.Beverage.name, set(names)))
+    rest = set(names) - found.keys()
+    if not rest:
+        return found
+    if _backend() == 'trigram':
+        # Joined in the database, which folds the names like the column
+        rest = sorted(rest)
+        for start in range(0, len(rest), batch_size):
+            wanted = db.func.unnest(
+                db.literal(rest[start:start + batch_size], type_=ARRAY(db.Text))
+            ).table_valued('name')
+            rows = db.session.execute(
+                db.select(wanted.c.name, models.Beverage.name)
+                .join(models.Beverage,
+                      _ordered(_search_key(models.Beverage.name)) == _search_key(db.func.trim(wanted.c.name)))
+                .order_by(models.Beverage.id)
+            ).all()
+            for name, existing in rows:
+                found.setdefault(name, existing)
+        return found
+    index = _name_index()
+    by_id = {}
+    for name in rest:
+        beverage_id = index.find(name)
+        if beverage_id is not None:
+            by_id.setdefault(beverage_id, []).append(name)
+    for beverage_id, existing in matches(models.Beverage.id, by_id):
+        for name in by_id[beverage_id]:
+            found[name] = existing
+    return found
+
+def beverage_page(after=None, limit=BEVERAGE_PAGE_SIZE):
+    """One page of beverages in name order, starting after the name
+    ``after`` (keyset pagination on the unique name index). Returns
+    ``(beverages, cursor of the next page or None)``."""
+    query = models.Beverage.query.order_by(models.Beverage.name)
+    if after:
+        query = query.filter(models.Beverage.name > after)
+    beverages = query.limit(limit + 1).all()
+    if len(beverages) > limit:
+        return beverages[:limit], beverages[limit - 1].name
+    return beverages, None
+
+def install_search_indexes(connection):
+    """Trigram and prefix indexes on the search key of the name,
+    lower(unaccent(name)), for Postgres; other databases use the in-memory
+    index and need nothing"""
+    if connection.dialect.name != 'postgresql':
+        return
+    try:
+        with connection.begin_nested():
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS unaccent")
+    except Exception as e:
+        logger.warning(f"Could not install pg_trgm and unaccent, beverage search will use an in-memory index: {str(e)}")
+        return
+    # unaccent() is only STABLE (its dictionary can change), so it cannot be
+    # indexed directly; naming the dictionary makes the wrapper IMMUTABLE
+    connection.exec_driver_sql(
+        "CREATE OR REPLACE FUNCTION beverage_search_key(text) RETURNS text "
+        "LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE "
+        "AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, $1)) $$"
+    )
+    # Replaced by the indexes on the search key (migration 12)
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_beverage_name_trgm")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_beverage_name_lower")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_beverage_search_key_trgm ON beverage "
+        "USING gin (beverage_search_key(name) gin_trgm_ops)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_beverage_search_key ON beverage "
+        "((beverage_search_key(name) COLLATE \"C\"))"
+    )
@@ -1,34 +1,219 @@
+// Fallback for cards rendered without a reorder point
+const LOW_STOCK_THRESHOLD = 5;
+// Sales made while the server was unreachable, kept until they are uploaded
+const PENDING_SALES_KEY = 'pendingSales';
+const MAX_UPLOAD_SALES = 500;
+const UPLOAD_RETRY_MS = 15000;
+// How often the page asks for changes when the server sends no live events
+const POLL_INTERVAL_MS = 15000;
+
+// Position in the server's change sequence this page is up to date with
+let syncCursor = 0;
+let forecastVersion = null;
+let syncInProgress = null;
+
+function updateCard(beverageId, quantity, reorderPoint) {
+    const quantityElement = document.querySelector(`#quantity-${beverageId}`);
+    if (!quantityElement) {
+        return false;
+    }
+    const cardElement = quantityElement.closest('.beverage-card');
+
+    quantityElement.textContent = quantity;
+    if (reorderPoint !== undefined) {
+        cardElement.dataset.reorderPoint = reorderPoint;
+    }
+
+    // Update low stock indicators; the reorder point comes from the
+    // sales forecast of each beverage
+    const threshold = cardElement.dataset.reorderPoint !== undefined
+        ? Number(cardElement.dataset.reorderPoint) : LOW_STOCK_THRESHOLD;
+    const lowStock = quantity < threshold;
+    cardElement.classList.toggle('low-stock', lowStock);
+    quantityElement.classList.toggle('quantity-warning', lowStock);
+    const badge = cardElement.querySelector('.low-stock-badge');
+    if (lowStock && !badge) {
+        const newBadge = document.createElement('div');
+        newBadge.className = 'low-stock-badge';
+        newBadge.textContent = '¡Stock Bajo!';
+        cardElement.appendChild(newBadge);
+    } else if (!lowStock && badge) {
+        badge.remove();
+    }
+    return true;
+}
+
+function applyInventoryEvent(event) {
+    const column = document.querySelector(`#quantity-${event.beverage_id}`)?.closest('.col-md-4');
+    if (!event.is_active) {
+        if (column) {
+            column.remove();
+        }
+        return;
+    }
+    if (!updateCard(event.beverage_id, event.quantity, event.reorder_point)) {
+        // A beverage that is not on this page yet (new or re-activated)
+        window.location.reload();
+    }
+}
+
+function pendingSales() {
+    try {
+        return JSON.parse(localStorage.getItem(PENDING_SALES_KEY)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function savePendingSales(sales) {
+    localStorage.setItem(PENDING_SALES_KEY, JSON.stringify(sales));
+    const banner = document.querySelector('#offline-banner');
+    banner.textContent = `Sin conexión: ${sales.length} venta(s) pendiente(s) de enviar`;
+    banner.classList.toggle('d-none', sales.length === 0);
+}
+
+function saleKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+}
+
+function queueSale(beverageId) {
+    const sales = pendingSales();
+    sales.push({id: saleKey(), beverage_id: Number(beverageId), quantity: 1});
+    savePendingSales(sales);
+    // Shown right away; the next sync corrects it
+    const quantityElement = document.querySelector(`#quantity-${beverageId}`);
+    updateCard(beverageId, Math.max(0, Number(quantityElement.textContent) - 1));
+}
+
+async function uploadPendingSales() {
+    let sales = pendingSales();
+    while (sales.length) {
+        let data;
+        try {
+            const response = await fetch('/api/sync/sales', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({sales: sales.slice(0, MAX_UPLOAD_SALES)})
+            });
+            if (!response.ok) {
+                return;
+            }
+            data = await response.json();
+        } catch (error) {
+            return;  // Still offline
+        }
+        // Uploading again is safe: every sale carries its own key
+        const done = new Set(data.results.map(result => result.id));
+        sales = pendingSales().filter(sale => !done.has(sale.id));
+        savePendingSales(sales);
+        const conflicts = data.results.filter(result => result.status === 'conflict');
+        if (conflicts.length) {
+            alert('Ventas sin conexión no registradas:\n' + conflicts.map(result => result.error).join('\n'));
+        }
+    }
+}
+
+async function fetchChanges(since) {
+    const response = await fetch(`/api/sync?since=${since}`);
+    return response.json();
+}
+
+async function runSync() {
+    await uploadPendingSales();
+    try {
+        let data = await fetchChanges(syncCursor);
+        if (data.forecast_version !== forecastVersion && syncCursor !== 0) {
+            // Reorder points were recalculated for every beverage
+            data = await fetchChanges(0);
+        }
+        data.beverages.forEach(beverage => applyInventoryEvent({
+            beverage_id: beverage.id,
+            quantity: beverage.quantity,
+            reorder_point: beverage.reorder_point,
+            is_active: beverage.is_active
+        }));
+        syncCursor = data.cursor;
+        forecastVersion = data.forecast_version;
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
+function syncInventory() {
+    // Upload queued sales, then fetch what changed since the last sync;
+    // concurrent callers share the one in progress
+    if (!syncInProgress) {
+        syncInProgress = runSync().finally(() => {
+            syncInProgress = null;
+        });
+    }
+    return syncInProgress;
+}
+
+function subscribeToInventory() {
+    const inventory = document.getElementById('inventory');
+    if (!window.EventSource || (inventory && inventory.dataset.liveEvents === 'off')) {
+        setInterval(syncInventory, POLL_INTERVAL_MS);
+        return;
+    }
+    const source = new EventSource('/api/events');
+    let disconnected = false;
+
+    source.onmessage = function(message) {
+        const event = JSON.parse(message.data);
+        if (event.resync) {
+            syncInventory();
+        } else {
+            applyInventoryEvent(event);
+        }
+    };
+    source.onerror = function() {
+        disconnected = true;
+    };
+    source.onopen = function() {
+        // Catch up on anything missed while the connection was down
+        if (disconnected) {
+            disconnected = false;
+            syncInventory();
+        }
+    };
+}
+
 document.addEventListener('DOMContentLoaded', function() {
+    const inventory = document.querySelector('#inventory');
+    syncCursor = Number(inventory.dataset.syncCursor);
+    forecastVersion = Number(inventory.dataset.forecastVersion);
+
     const decreaseButtons = document.querySelectorAll('.decrease-btn');
-    
+
     decreaseButtons.forEach(button => {
         button.addEventListener('click', async function() {
             const beverageId = this.dataset.beverageId;
+            if (pendingSales().length) {
+                // Keep the order: this sale goes after the ones still queued
+                queueSale(beverageId);
+                syncInventory();
+                return;
+            }
+            let response;
             try {
-                const response = await fetch(`/api/decrease/${beverageId}`, {
+                response = await fetch(`/api/decrease/${beverageId}`, {
                     method: 'POST'
                 });
+            } catch (error) {
+                // Server unreachable: keep the sale and upload it later
+                queueSale(beverageId);
+                return;
+            }
+            try {
                 const data = await response.json();
-                
+
                 if (data.success) {
-                    const quantityElement = document.querySelector(`#quantity-${beverageId}`);
-                    const cardElement = button.closest('.beverage-card');
-                    const newQuantity = data.new_quantity;
-                    
-                    quantityElement.textContent = newQuantity;
-                    
-                    // Update low stock indicators
-                    if (newQuantity < 5) {
-                        cardElement.classList.add('low-stock');
-                        quantityElement.classList.add('quantity-warning');
-                        if (!cardElement.querySelector('.low-stock-badge')) {
-                            const badge = document.createElement('div');
-                            badge.className = 'low-stock-badge';
-                            badge.textContent = '¡Stock Bajo!';
-                            cardElement.appendChild(badge);
-                        }
-                    }
-                    
+                    updateCard(beverageId, data.new_quantity);
+
                     // Add animation effect
                     button.classList.add('btn-success');
                     setTimeout(() => button.classList.remove('btn-success'), 200);
@@ -41,4 +226,17 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
     });
+
+    savePendingSales(pendingSales());
+    window.addEventListener('online', syncInventory);
+    setInterval(() => {
+        if (pendingSales().length) {
+            syncInventory();
+        }
+    }, UPLOAD_RETRY_MS);
+    if (pendingSales().length) {
+        syncInventory();
+    }
+
+    subscribeToInventory();
 });
@@ -1,85 +1,273 @@
 document.addEventListener('DOMContentLoaded', function() {
-    const beverageSelect = document.getElementById('beverage-select');
+    const searchInput = document.getElementById('beverage-search');
+    const searchResults = document.getElementById('beverage-results');
+    const beverageIdInput = document.getElementById('beverage-id');
     const nameInput = document.getElementById('name');
     const priceInput = document.getElementById('price');
     const imageUploadContainer = document.getElementById('imageUploadContainer');
     const imageInput = document.getElementById('image');
-    
-    beverageSelect.addEventListener('change', function() {
-        const selectedOption = this.options[this.selectedIndex];
-        
-        if (selectedOption.value === '') {
-            // New beverage selected
-            nameInput.value = '';
-            nameInput.readOnly = false;
-            priceInput.value = '';
-            priceInput.readOnly = false;
-            imageUploadContainer.style.display = 'block';
-            imageInput.required = true;
+    const tableBody = document.querySelector('#beverage-table tbody');
+    const tableFilter = document.getElementById('table-filter');
+    const loadMoreButton = document.getElementById('load-more');
+
+    function debounce(fn, delay) {
+        let timer;
+        return function(...args) {
+            clearTimeout(timer);
+            timer = setTimeout(() => fn.apply(this, args), delay);
+        };
+    }
+
+    async function searchBeverages(query, limit) {
+        const response = await fetch(`/api/beverages/search?q=${encodeURIComponent(query)}&limit=${limit}`);
+        const data = await response.json();
+        return data.beverages;
+    }
+
+    function newBeverage() {
+        beverageIdInput.value = '';
+        nameInput.value = '';
+        nameInput.readOnly = false;
+        priceInput.value = '';
+        priceInput.readOnly = false;
+        imageUploadContainer.style.display = 'block';
+        imageInput.required = true;
+    }
+
+    function selectBeverage(beverage) {
+        beverageIdInput.value = beverage.beverage_id;
+        searchInput.value = beverage.name;
+        nameInput.value = beverage.name;
+        nameInput.readOnly = true;
+        priceInput.value = beverage.price;
+        priceInput.readOnly = true;
+        imageUploadContainer.style.display = 'none';
+        imageInput.required = false;
+        imageInput.value = ''; // Clear any selected file
+        searchResults.innerHTML = '';
+    }
+
+    // Type-ahead search of existing beverages
+    searchInput.addEventListener('input', debounce(async function() {
+        const query = searchInput.value.trim();
+        if (beverageIdInput.value) {
+            newBeverage();
+        }
+        searchResults.innerHTML = '';
+        if (!query) {
+            return;
+        }
+        try {
+            const beverages = await searchBeverages(query, 10);
+            if (searchInput.value.trim() !== query) {
+                return; // A newer search is on its way
+            }
+            beverages.forEach(beverage => {
+                const item = document.createElement('button');
+                item.type = 'button';
+                item.className = 'list-group-item list-group-item-action';
+                item.textContent = beverage.is_active ? beverage.name : `${beverage.name} (Desactivado)`;
+                item.disabled = !beverage.is_active;
+                item.addEventListener('click', () => selectBeverage(beverage));
+                searchResults.appendChild(item);
+            });
+        } catch (error) {
+            console.error('Error:', error);
+        }
+    }, 200));
+
+    document.addEventListener('click', function(event) {
+        if (!searchResults.contains(event.target) && event.target !== searchInput) {
+            searchResults.innerHTML = '';
+        }
+    });
+
+    function formatValue(value) {
+        return value === null || value === undefined ? '—' : value;
+    }
+
+    function renderRow(beverage) {
+        const row = document.createElement('tr');
+        const cells = [
+            beverage.name,
+            null,
+            formatValue(beverage.daily_sales),
+            formatValue(beverage.reorder_point),
+            formatValue(beverage.days_of_cover),
+            `$${Number(beverage.price).toFixed(2)}`,
+        ];
+        cells.forEach(text => {
+            const cell = document.createElement('td');
+            if (text !== null) {
+                cell.textContent = text;
+            }
+            row.appendChild(cell);
+        });
+        const quantityCell = row.children[1];
+        if (beverage.low_stock) {
+            quantityCell.innerHTML = '<span class="badge bg-warning text-dark"></span>';
+            quantityCell.firstChild.textContent = beverage.quantity;
         } else {
-            // Existing beverage selected
-            nameInput.value = selectedOption.text.replace(' (Desactivado)', '');
-            nameInput.readOnly = true;
-            priceInput.value = selectedOption.dataset.price;
-            priceInput.readOnly = true;
-            imageUploadContainer.style.display = 'none';
-            imageInput.required = false;
-            imageInput.value = ''; // Clear any selected file
+            quantityCell.textContent = beverage.quantity;
+        }
+        const statusCell = document.createElement('td');
+        statusCell.innerHTML = `<span class="badge status-badge ${beverage.is_active ? 'bg-success' : 'bg-danger'}">
+            ${beverage.is_active ? 'Activo' : 'Desactivado'}</span>`;
+        row.appendChild(statusCell);
+        const actionCell = document.createElement('td');
+        const button = document.createElement('button');
+        button.className = `btn btn-sm ${beverage.is_active ? 'btn-warning' : 'btn-success'} toggle-status`;
+        button.dataset.beverageId = beverage.beverage_id;
+        button.dataset.isActive = beverage.is_active;
+        button.textContent = beverage.is_active ? 'Desactivar' : 'Activar';
+        actionCell.appendChild(button);
+        row.appendChild(actionCell);
+        return row;
+    }
+
+    function setNextCursor(cursor) {
+        loadMoreButton.dataset.next = cursor || '';
+        loadMoreButton.hidden = !cursor;
+    }
+
+    async function loadPage(after) {
+        const params = after ? `?after=${encodeURIComponent(after)}` : '';
+        const response = await fetch(`/api/beverages${params}`);
+        const data = await response.json();
+        if (!after) {
+            tableBody.innerHTML = '';
+        }
+        data.beverages.forEach(beverage => tableBody.appendChild(renderRow(beverage)));
+        setNextCursor(data.next);
+    }
+
+    // Next page of the table (keyset pagination by name)
+    loadMoreButton.addEventListener('click', async function() {
+        loadMoreButton.disabled = true;
+        try {
+            await loadPage(loadMoreButton.dataset.next);
+        } catch (error) {
+            console.error('Error:', error);
+        } finally {
+            loadMoreButton.disabled = false;
         }
     });
 
-    // Toggle beverage status functionality
-    document.querySelectorAll('.toggle-status').forEach(button => {
-        button.addEventListener('click', async function() {
-            const beverageId = this.dataset.beverageId;
-            const isActive = this.dataset.isActive === 'true';
-            
-            try {
-                const response = await fetch(`/api/toggle-beverage/${beverageId}`, {
-                    method: 'POST'
-                });
-                const data = await response.json();
-                
-                if (data.success) {
-                    // Update button appearance and text
-                    this.textContent = data.is_active ? 'Desactivar' : 'Activar';
-                    this.classList.toggle('btn-warning', data.is_active);
-                    this.classList.toggle('btn-success', !data.is_active);
-                    this.dataset.isActive = data.is_active;
-                    
-                    // Update status badge
-                    const statusBadge = this.closest('tr').querySelector('.badge');
-                    statusBadge.textContent = data.is_active ? 'Activo' : 'Desactivado';
-                    statusBadge.classList.toggle('bg-success', data.is_active);
-                    statusBadge.classList.toggle('bg-danger', !data.is_active);
-                    
-                    // Update select option
-                    const option = beverageSelect.querySelector(`option[value="${beverageId}"]`);
-                    if (option) {
-                        const beverageName = option.textContent.replace(' (Desactivado)', '');
-                        option.textContent = data.is_active ? beverageName : `${beverageName} (Desactivado)`;
-                        option.disabled = !data.is_active;
-                    }
-                    
-                    // Show success message
-                    const alert = document.createElement('div');
-                    alert.className = 'alert alert-success alert-dismissible fade show';
-                    alert.innerHTML = `
-                        ${data.message}
-                        <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
-                    `;
-                    document.querySelector('.card-body').insertAdjacentElement('afterbegin', alert);
-                }
-            } catch (error) {
-                console.error('Error:', error);
+    // Filtering the table searches the server instead of the loaded rows
+    tableFilter.addEventListener('input', debounce(async function() {
+        const query = tableFilter.value.trim();
+        try {
+            if (!query) {
+                await loadPage(null);
+                return;
+            }
+            const beverages = await searchBeverages(query, 50);
+            if (tableFilter.value.trim() !== query) {
+                return;
+            }
+            tableBody.innerHTML = '';
+            beverages.forEach(beverage => tableBody.appendChild(renderRow(beverage)));
+            setNextCursor(null);
+        } catch (error) {
+            console.error('Error:', error);
+        }
+    }, 250));
+
+    // Toggle beverage status; delegated so loaded rows work too
+    tableBody.addEventListener('click', async function(event) {
+        const button = event.target.closest('.toggle-status');
+        if (!button) {
+            return;
+        }
+        const beverageId = button.dataset.beverageId;
+
+        try {
+            const response = await fetch(`/api/toggle-beverage/${beverageId}`, {
+                method: 'POST'
+            });
+            const data = await response.json();
+
+            if (data.success) {
+                // Update button appearance and text
+                button.textContent = data.is_active ? 'Desactivar' : 'Activar';
+                button.classList.toggle('btn-warning', data.is_active);
+                button.classList.toggle('btn-success', !data.is_active);
+                button.dataset.isActive = data.is_active;
+
+                // Update status badge
+                const statusBadge = button.closest('tr').querySelector('.status-badge');
+                statusBadge.textContent = data.is_active ? 'Activo' : 'Desactivado';
+                statusBadge.classList.toggle('bg-success', data.is_active);
+                statusBadge.classList.toggle('bg-danger', !data.is_active);
+
+                // Show success message
                 const alert = document.createElement('div');
-                alert.className = 'alert alert-danger alert-dismissible fade show';
+                alert.className = 'alert alert-success alert-dismissible fade show';
                 alert.innerHTML = `
-                    Error al actualizar el estado de la bebida
+                    ${data.message}
                     <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
                 `;
                 document.querySelector('.card-body').insertAdjacentElement('afterbegin', alert);
             }
-        });
+        } catch (error) {
+            console.error('Error:', error);
+            const alert = document.createElement('div');
+            alert.className = 'alert alert-danger alert-dismissible fade show';
+            alert.innerHTML = `
+                Error al actualizar el estado de la bebida
+                <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
+            `;
+            document.querySelector('.card-body').insertAdjacentElement('afterbegin', alert);
+        }
+    });
+
+    // Bulk import of a delivery file
+    const importForm = document.getElementById('import-form');
+    const importResult = document.getElementById('import-result');
+    importForm.addEventListener('submit', async function(event) {
+        event.preventDefault();
+        const button = importForm.querySelector('button[type="submit"]');
+        button.disabled = true;
+        importResult.innerHTML = '';
+        try {
+            const response = await fetch('/api/restock/import', {
+                method: 'POST',
+                body: new FormData(importForm)
+            });
+            const data = await response.json();
+            const alert = document.createElement('div');
+            alert.className = `alert ${data.success ? 'alert-success' : 'alert-danger'}`;
+            if (data.dry_run) {
+                alert.textContent = `${data.lines} líneas válidas, no se importó nada`;
+            } else if (data.success) {
+                alert.textContent = `Importadas ${data.lines} líneas: ${data.units} unidades de ${data.beverages} bebidas (${data.created} nuevas)`;
+            } else {
+                alert.textContent = data.error;
+            }
+            importResult.appendChild(alert);
+            if (data.errors && data.errors.length) {
+                const list = document.createElement('ul');
+                list.className = 'small text-danger';
+                data.errors.forEach(error => {
+                    const item = document.createElement('li');
+                    item.textContent = `Línea ${error.line}: ${error.error}`;
+                    list.appendChild(item);
+                });
+                if (data.error_count > data.errors.length) {
+                    const item = document.createElement('li');
+                    item.textContent = `... y ${data.error_count - data.errors.length} errores más`;
+                    list.appendChild(item);
+                }
+                importResult.appendChild(list);
+            }
+            if (data.success && !data.dry_run) {
+                setTimeout(() => window.location.reload(), 1500);
+            }
+        } catch (error) {
+            console.error('Error:', error);
+            importResult.innerHTML = '<div class="alert alert-danger">Error al importar el archivo</div>';
+        } finally {
+            button.disabled = false;
+        }
     });
 });
@@ -113,6 +113,7 @@ async function exportData(type) {
     try {
         const startDate = document.getElementById('startDate').value;
         const endDate = document.getElementById('endDate').value;
+        const format = document.getElementById('exportFormat').value;
         
         // Create a hidden anchor element for download
         const link = document.createElement('a');
@@ -120,7 +121,7 @@ async function exportData(type) {
         document.body.appendChild(link);
         
         // Get the export URL
-        const url = `/api/export/${type}?start_date=${startDate}&end_date=${endDate}`;
+        const url = `/api/export/${type}?start_date=${startDate}&end_date=${endDate}&format=${encodeURIComponent(format)}`;
         
         // Trigger the download
         window.location.href = url;
@@ -0,0 +1,34 @@
+import argparse
+from app import create_app
+import inventory_service
+
+def main():
+    parser = argparse.ArgumentParser(description="Stock ledger maintenance")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('snapshot', help="snapshot every beverage at the last midnight (UTC); run daily")
+    commands.add_parser('rebuild', help="recreate the daily snapshots from the sales rollup")
+    check = commands.add_parser('check', help="compare Beverage.quantity with the ledger")
+    check.add_argument('--fix', action='store_true', help="reset drifted quantities from the ledger")
+    args = parser.parse_args()
+
+    app = create_app({'START_BACKGROUND_JOBS': False})
+    with app.app_context():
+        if args.command == 'snapshot':
+            at, rows = inventory_service.take_stock_snapshot()
+            print(f"Stock snapshot at {at} for {rows} beverages")
+        elif args.command == 'rebuild':
+            rows = inventory_service.rebuild_stock_snapshots()
+            print(f"Stock snapshots rebuilt with {rows} rows")
+        else:
+            drift = inventory_service.fix_stock_drift() if args.fix else inventory_service.check_stock_drift()
+            for beverage_id, name, quantity, ledger_quantity in drift:
+                print(f"{name} (id {beverage_id}): quantity {quantity}, ledger {ledger_quantity}")
+            if not drift:
+                print("Beverage quantities match the ledger")
+            elif args.fix:
+                print(f"Reset {len(drift)} quantities from the ledger")
+            else:
+                raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import os
+import time
+import random
+import logging
+import threading
+import sqlalchemy
+from sqlalchemy.pool import NullPool
+from app import db
+import models
+
+logger = logging.getLogger(__name__)
+
+# Slots given to a beverage by ``stock_slots.py split`` unless told otherwise
+STOCK_SLOTS = int(os.environ.get('STOCK_SLOTS', 16))
+MAX_STOCK_SLOTS = 256
+# How often Beverage.quantity of beverages with slots catches up with them.
+# Each refresh that changes a total bumps the beverage's version (and so the
+# inventory ETag and its change_seq); tills poll every 15 s and sale
+# responses and events carry the exact total, so refreshing much more often
+# only churns versions no till sees.
+STOCK_SLOT_REFRESH_SECONDS = float(os.environ.get('STOCK_SLOT_REFRESH_SECONDS', 5))
+# pg_try_advisory_lock key claimed by the one process that runs the refresher
+REFRESHER_LOCK_ID = 0x510751
+
+# A best seller sold from many tills at once serializes every sale on the
+# lock of its beverage row. Splitting its stock across N slot rows lets N
+# sales commit side by side: each one decrements a random slot that still
+# holds enough units, with the same conditional UPDATE as a single row, so
+# no slot (and therefore no total) ever goes below zero. Sales never write
+# the beverage row; Beverage.quantity becomes a cached total that the
+# refresher brings up to date every STOCK_SLOT_REFRESH_SECONDS, and code
+# that needs the exact stock sums the slots (current_quantity()).
+#
+# Restocks, split/merge and the journal flusher lock the beverage row
+# before the slots, sales only lock slots, so they cannot deadlock.
+
+def slot_total(beverage_id=models.Beverage.id):
+    """Sum of the slots of ``beverage_id`` (an id or a column) as a scalar subquery"""
+    return db.select(
+        db.func.coalesce(db.func.sum(models.StockSlot.quantity), 0)
+    ).where(models.StockSlot.beverage_id == beverage_id).scalar_subquery()
+
+def current_quantity():
+    """SQL expression for the stock of a beverage right now: the sum of its
+    slots when it has any, Beverage.quantity otherwise"""
+    return db.case((models.Beverage.stock_slots > 0, slot_total()), else_=models.Beverage.quantity)
+
+def slot_count(beverage_id):
+    return db.session.scalar(
+        db.select(models.Beverage.stock_slots).where(models.Beverage.id == beverage_id)
+    )
+
+def stock_row(beverage_id):
+    """``(name, quantity, price, is_active)`` of a beverage with slots, as
+    the sale path reads them from the RETURNING of a single row"""
+    return db.session.execute(
+        db.select(
+            models.Beverage.name, slot_total(beverage_id).label('quantity'),
+            models.Beverage.price, models.Beverage.is_active,
+        ).where(models.Beverage.id == beverage_id)
+    ).first()
+
+def take(beverage_id, units, allow_negative=False):
+    """Take ``units`` from the slots of a beverage: from one random slot
+    holding enough of them or, when none does, from the fullest slots
+    together. Returns the first slot decremented, or None when the slots
+    hold fewer than ``units`` altogether or the beverage has no slots.
+    ``allow_negative`` takes them anyway (for sales already acknowledged).
+    The caller commits."""
+    if not allow_negative:
+        chosen = db.select(models.StockSlot.slot).where(
+            models.StockSlot.beverage_id == beverage_id, models.StockSlot.quantity >= units
+        ).order_by(db.func.random()).limit(1).scalar_subquery()
+        # The quantity is checked again: another sale may have taken the
+        # chosen slot's units since the subquery read it
+        slot = db.session.scalar(
+            db.update(models.StockSlot)
+            .where(models.StockSlot.beverage_id == beverage_id, models.StockSlot.slot == chosen,
+                   models.StockSlot.quantity >= units)
+            .values(quantity=models.StockSlot.quantity - units)
+            .returning(models.StockSlot.slot)
+            .execution_options(synchronize_session=False)
+        )
+        if slot is not None:
+            return slot
+    return _take_across(beverage_id, units, allow_negative)
+
+def _take_across(beverage_id, units, allow_negative):
+    # Rare: every slot is short of ``units``. Lock them all in slot order.
+    rows = db.session.execute(
+        db.select(models.StockSlot.slot, models.StockSlot.quantity)
+        .where(models.StockSlot.beverage_id == beverage_id)
+        .order_by(models.StockSlot.slot)
+        .with_for_update()
+    ).all()
+    if not rows or (not allow_negative and sum(quantity for _, quantity in rows) < units):
+        return None
+    remaining = units
+    taken = {}
+    for slot, quantity in sorted(rows, key=lambda row: -row.quantity):
+        part = min(max(quantity, 0), remaining)
+        if part:
+            taken[slot] = part
+            remaining -= part
+    if remaining:
+        fullest = max(rows, key=lambda row: row.quantity).slot
+        taken[fullest] = taken.get(fullest, 0) + remaining
+    for slot, part in taken.items():
+        db.session.execute(
+            db.update(models.StockSlot)
+            .where(models.StockSlot.beverage_id == beverage_id, models.StockSlot.slot == slot)
+            .values(quantity=models.StockSlot.quantity - part)
+            .execution_options(synchronize_session=False)
+        )
+    return next(iter(taken))
+
+def restock(units):
+    """Spread restocked ``{beverage_id: units}`` over the slots of the
+    beverages that have them and set their Beverage.quantity to the new
+    total. Call after writing the beverage rows, whose locks keep
+    resize() out. Returns ``{beverage_id: new quantity}`` for those
+    beverages; the caller commits."""
+    sharded = dict(db.session.execute(
+        db.select(models.Beverage.id, models.Beverage.stock_slots)
+        .where(models.Beverage.id.in_(units), models.Beverage.stock_slots > 0)
+    ).all())
+    if not sharded:
+        return {}
+    for beverage_id, slots in sharded.items():
+        base, extra = divmod(units[beverage_id], slots)
+        # The remainder goes to random slots, one unit each
+        bonus = random.sample(range(slots), extra)
+        db.session.execute(
+            db.update(models.StockSlot)
+            .where(models.StockSlot.beverage_id == beverage_id)
+            .values(quantity=models.StockSlot.quantity + base
+                    + db.case((models.StockSlot.slot.in_(bonus), 1), else_=0))
+            .execution_options(synchronize_session=False)
+        )
+    return dict(db.session.execute(
+        db.update(models.Beverage)
+        .where(models.Beverage.id.in_(sharded))
+        .values(quantity=slot_total())
+        .returning(models.Beverage.id, models.Beverage.quantity)
+        .execution_options(synchronize_session=False)
+    ).all())
+
+def resize(beverage_id, slots, quantity=None):
+    """Spread the stock of a beverage evenly over ``slots`` slots, or
+    return it to its row with 0. ``quantity`` replaces the stock (used to
+    repair drift). Returns the stock, or None for an unknown beverage; the
+    caller commits."""
+    if not 0 <= slots <= MAX_STOCK_SLOTS:
+        raise ValueError(f"Slots must be between 0 and {MAX_STOCK_SLOTS}")
+    # Lock the row first, like restocks do
+    row = db.session.execute(
+        db.update(models.Beverage)
+        .where(models.Beverage.id == beverage_id)
+        .values(version=models.Beverage.version + 1)
+        .returning(models.Beverage.quantity, models.Beverage.stock_slots)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None
+    # Waits for sales holding a slot
+    old = db.session.scalars(
+        db.delete(models.StockSlot)
+        .where(models.StockSlot.beverage_id == beverage_id)
+        .returning(models.StockSlot.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if quantity is None:
+        quantity = sum(old) if row.stock_slots else row.quantity
+    if slots:
+        base, extra = divmod(quantity, slots)
+        db.session.execute(db.insert(models.StockSlot), [
+            {'beverage_id': beverage_id, 'slot': slot, 'quantity': base + (slot < extra)}
+            for slot in range(slots)
+        ])
+    db.session.execute(
+        db.update(models.Beverage)
+        .where(models.Beverage.id == beverage_id)
+        .values(quantity=quantity, stock_slots=slots)
+        .execution_options(synchronize_session=False)
+    )
+    return quantity
+
+def sharded_beverages():
+    """``(beverage_id, name, slots, cached quantity, slot total)`` of every
+    beverage with slots"""
+    return db.session.execute(
+        db.select(
+            models.Beverage.id, models.Beverage.name, models.Beverage.stock_slots,
+            models.Beverage.quantity, slot_total(),
+        ).where(models.Beverage.stock_slots > 0).order_by(models.Beverage.name)
+    ).all()
+
+def refresh_totals():
+    """Copy the slot totals into Beverage.quantity where they differ, so
+    that inventory pages, exports and delta sync see the sales. Beverages
+    whose total did not change are not written, so their version and
+    change_seq stay put and an idle refresh leaves ETags and delta sync
+    alone. Commits; returns the number of beverages updated."""
+    total = slot_total()
+    updated = db.session.execute(
+        db.update(models.Beverage)
+        .where(models.Beverage.stock_slots > 0, models.Beverage.quantity != total)
+        .values(quantity=total, version=models.Beverage.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return updated
+
+# Engines without a pool for the refresher claim, by application engine
+_claim_engines = {}
+
+def claim_refresher():
+    """Claim the refresher for this process among all those sharing the
+    database. Returns the claim, truthy for as long as it is held, or None
+    when another process holds it. On PostgreSQL the claim is a session
+    advisory lock on a connection of its own, outside the pool, so it
+    neither takes a connection from the request threads nor goes back to
+    the pool with the lock; the server releases it if the process dies.
+    SQLite only serves one host and serializes writes anyway: every
+    process gets the claim and no connection is kept for it."""
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return True
+    if engine not in _claim_engines:
+        _claim_engines[engine] = sqlalchemy.create_engine(engine.url, poolclass=NullPool)
+    connection = _claim_engines[engine].connect()
+    try:
+        claimed = connection.scalar(db.select(db.func.pg_try_advisory_lock(REFRESHER_LOCK_ID)))
+        # Session lock: survives the commit, which keeps the connection
+        # from sitting idle in a transaction
+        connection.commit()
+    except Exception:
+        connection.close()
+        raise
+    if claimed:
+        logger.info("This process refreshes the stock slot totals")
+        return connection
+    connection.close()
+    return None
+
+def _claim_alive(claim):
+    # The advisory lock lives as long as its connection
+    if claim is True:
+        return True
+    try:
+        claim.exec_driver_sql('SELECT 1')
+        claim.commit()
+        return True
+    except Exception as e:
+        logger.warning(f"Lost the stock slot refresher lock: {str(e)}")
+        claim.close()
+        return False
+
+def start_refresher(app, interval=STOCK_SLOT_REFRESH_SECONDS):
+    """Refresh the slot totals every ``interval`` seconds in whichever
+    process holds the refresher claim; the others try to take it over
+    at the same pace."""
+    def run():
+        claim = None
+        while True:
+            try:
+                with app.app_context():
+                    if claim is not None and not _claim_alive(claim):
+                        claim = None
+                    if claim is None:
+                        claim = claim_refresher()
+                    if claim is not None:
+                        refresh_totals()
+            except Exception as e:
+                logger.error(f"Error refreshing stock slot totals: {str(e)}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='stock-slot-refresher', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,47 @@
+import argparse
+from app import create_app, db
+import models
+import search_service
+import stock_slot_service
+
+def find_beverage(text):
+    """A beverage by id or by name"""
+    if text.isdigit():
+        return db.session.get(models.Beverage, int(text))
+    return search_service.find_by_name(text)
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the stock of best sellers across slot rows")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="beverages with stock slots")
+    split = commands.add_parser('split', help="split the stock of beverages across slots (again, to change the count)")
+    split.add_argument('beverages', nargs='+', help="ids or names")
+    split.add_argument('--slots', type=int, default=stock_slot_service.STOCK_SLOTS)
+    merge = commands.add_parser('merge', help="return the stock of beverages to their own row")
+    merge.add_argument('beverages', nargs='+', help="ids or names")
+    args = parser.parse_args()
+
+    app = create_app({'START_BACKGROUND_JOBS': False})
+    with app.app_context():
+        if args.command == 'list':
+            rows = stock_slot_service.sharded_beverages()
+            for beverage_id, name, slots, quantity, total in rows:
+                print(f"{name} (id {beverage_id}): {slots} slots, {total} units (cached {quantity})")
+            if not rows:
+                print("No beverage has stock slots")
+            return
+
+        slots = args.slots if args.command == 'split' else 0
+        for text in args.beverages:
+            beverage = find_beverage(text)
+            if beverage is None:
+                raise SystemExit(f"Unknown beverage: {text}")
+            quantity = stock_slot_service.resize(beverage.id, slots)
+            db.session.commit()
+            if slots:
+                print(f"{beverage.name}: {quantity} units in {slots} slots")
+            else:
+                print(f"{beverage.name}: {quantity} units in one row")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import os
+import json
+import logging
+from sqlalchemy import event
+from app import db
+import models
+import inventory_service
+
+logger = logging.getLogger(__name__)
+
+# Most queued sales accepted in one upload
+MAX_OFFLINE_SALES = int(os.environ.get('MAX_OFFLINE_SALES', 500))
+
+# Every INSERT or UPDATE of a beverage takes the next value of one global
+# sequence, whichever code path (ORM, bulk statement, journal flusher,
+# migration) does the write. On Postgres it also records the id of the
+# writing transaction, which the sync cursor is made of (current_cursor).
+_CHANGE_TRACKING = {
+    'postgresql': [
+        "CREATE SEQUENCE IF NOT EXISTS beverage_change_seq",
+        """
+        CREATE OR REPLACE FUNCTION beverage_change_seq() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_seq := nextval('beverage_change_seq');
+            NEW.change_xid := txid_current();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS beverage_change_seq ON beverage",
+        """
+        CREATE TRIGGER beverage_change_seq BEFORE INSERT OR UPDATE ON beverage
+        FOR EACH ROW EXECUTE FUNCTION beverage_change_seq()
+        """,
+    ],
+    # SQLite triggers cannot assign NEW; the nested UPDATE does not fire
+    # them again (recursive triggers are off). Writers are serialized, so
+    # MAX + 1 is both unique and in commit order.
+    'sqlite': [
+        """
+        CREATE TRIGGER IF NOT EXISTS beverage_change_seq_insert AFTER INSERT ON beverage
+        BEGIN
+            UPDATE beverage SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM beverage)
+            WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS beverage_change_seq_update AFTER UPDATE ON beverage
+        BEGIN
+            UPDATE beverage SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM beverage)
+            WHERE id = NEW.id;
+        END
+        """,
+    ],
+}
+
+def install_change_tracking(connection):
+    """Create the change sequence triggers and number the rows that have
+    none yet; safe to run again"""
+    statements = _CHANGE_TRACKING.get(connection.dialect.name)
+    if statements is None:
+        logger.warning(f"Delta sync is not supported on {connection.dialect.name}")
+        return
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+    # Touching the rows makes the triggers number them
+    unnumbered = "change_seq IS NULL"
+    if connection.dialect.name == 'postgresql':
+        unnumbered += " OR change_xid IS NULL"
+    connection.exec_driver_sql(f"UPDATE beverage SET version = version WHERE {unnumbered}")
+
+@event.listens_for(models.Beverage.__table__, 'after_create')
+def _beverage_table_created(target, connection, **kw):
+    install_change_tracking(connection)
+
+def _by_transaction():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+def current_cursor():
+    """Cursor a till can resume from without missing a write.
+
+    SQLite commits in sequence order, so it is the highest change sequence.
+    Postgres hands out sequence values in write order but transactions
+    commit in any order, so there it is a transaction id instead: the
+    oldest transaction still running (txid_snapshot_xmin). A write that had
+    not committed yet carries that id or a later one in change_xid, so it
+    is sent however long its transaction stays open; writes committed
+    meanwhile may be sent twice, which is harmless.
+    """
+    if _by_transaction():
+        return db.session.scalar(db.text("SELECT txid_snapshot_xmin(txid_current_snapshot())"))
+    return db.session.scalar(db.select(db.func.max(models.Beverage.change_seq))) or 0
+
+def changes_since(since):
+    """``(beverages, cursor)``: every beverage written after cursor ``since``
+    (all of them, inactive included, for 0) and the cursor for the next call"""
+    # Taken before reading the rows, so a write in between is sent again
+    # rather than skipped
+    cursor = current_cursor()
+    query = models.Beverage.query.order_by(models.Beverage.change_seq)
+    if since and _by_transaction():
+        query = query.filter(models.Beverage.change_xid >= since)
+    elif since:
+        query = query.filter(models.Beverage.change_seq > since)
+    return query.all(), max(cursor, since)
+
+def record_offline_sales(sales, user_id):
+    """Apply sales a till queued while it was offline.
+
+    ``sales`` is a list of ``(key, beverage_id, units)``. Each sale stands on
+    its own: one that cannot be fulfilled is reported as a conflict and the
+    others still apply. The result of every sale is stored under its key,
+    so uploading the queue again returns the same results without selling
+    twice. Keys belong to ``user_id``: another user's sale under the same
+    key is a different sale. Sales are recorded at upload time, keeping the stock ledger in
+    order. Returns ``(results, {beverage_id: (name, new_quantity,
+    is_active)})``; the caller commits.
+    """
+    keys = [key for key, _, _ in sales]
+    previous = {
+        row.idempotency_key: json.loads(row.response)
+        for row in models.SaleBatch.query.filter(
+            models.SaleBatch.user_id == user_id, models.SaleBatch.idempotency_key.in_(keys))
+    }
+    results = []
+    changed = {}
+    for key, beverage_id, units in sales:
+        if key not in previous:
+            sale = inventory_service.record_sale(beverage_id, user_id, units)
+            if sale is not None:
+                changed[beverage_id] = sale
+                result = {'id': key, 'status': 'applied', 'beverage_id': beverage_id, 'new_quantity': sale[1]}
+            else:
+                # Not session.get(): earlier sales of this upload bypassed the session
+                beverage = db.session.execute(
+                    db.select(models.Beverage.name, models.Beverage.quantity).where(models.Beverage.id == beverage_id)
+                ).first()
+                result = {'id': key, 'status': 'conflict', 'beverage_id': beverage_id}
+                if beverage is None:
+                    result['error'] = 'Bebida no encontrada'
+                else:
+                    result['error'] = f'Sin existencias suficientes de {beverage.name}'
+                    result['quantity'] = beverage.quantity
+            db.session.add(models.SaleBatch(idempotency_key=key, user_id=user_id, response=json.dumps(result)))
+            previous[key] = result
+        results.append(previous[key])
+    return results, changed
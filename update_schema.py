@@ -1,16 +1,181 @@
-from app import app, db
-from sqlalchemy import text
+from datetime import datetime
+from app import create_app, db
+import models
+from sqlalchemy import inspect, text
 
-def update_schema():
+# Ordered schema migrations. Each one must be safe to run against a database
+# created by db.create_all() with the current models, since fresh installs
+# already have every column and index. Indexes are created by name: a
+# migration must not pick up indexes that later migrations add to the model.
+
+def create_index(table, name):
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(db.session.connection(), checkfirst=True)
+
+def add_beverage_is_active():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('beverage')]
+    if 'is_active' not in columns:
+        db.session.execute(text("ALTER TABLE beverage ADD COLUMN is_active BOOLEAN DEFAULT true NOT NULL"))
+
+def add_transaction_indexes():
+    for name in ('ix_transaction_type_timestamp', 'ix_transaction_timestamp', 'ix_transaction_beverage_timestamp'):
+        create_index(models.Transaction.__table__, name)
+
+def add_beverage_image_variants_ready():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('beverage')]
+    if 'image_variants_ready' not in columns:
+        db.session.execute(text("ALTER TABLE beverage ADD COLUMN image_variants_ready BOOLEAN DEFAULT false NOT NULL"))
+
+def add_beverage_version():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('beverage')]
+    if 'version' not in columns:
+        db.session.execute(text("ALTER TABLE beverage ADD COLUMN version INTEGER DEFAULT 0 NOT NULL"))
+
+def add_stock_ledger():
+    # The stock_snapshot table itself comes from db.create_all(). Quantities
+    # changed outside of transactions before the ledger existed become an
+    # opening balance, so the ledger matches Beverage.quantity from day one.
+    import inventory_service
+    changes = dict(db.session.query(
+        models.Transaction.beverage_id, db.func.sum(models.Transaction.quantity_change)
+    ).group_by(models.Transaction.beverage_id).all())
+    for beverage_id, quantity in db.session.query(models.Beverage.id, models.Beverage.quantity):
+        opening = (quantity or 0) - int(changes.get(beverage_id) or 0)
+        if opening:
+            db.session.merge(models.StockSnapshot(
+                beverage_id=beverage_id, taken_at=inventory_service.LEDGER_EPOCH, quantity=opening
+            ))
+    db.session.flush()
+    inventory_service.rebuild_stock_snapshots()
+
+def partition_transaction_table():
+    # Postgres only; SQLite keeps a plain table and archives by deleting rows
+    import archive_service
+    archive_service.partition_transactions()
+
+def add_beverage_change_seq():
+    import sync_service
+    columns = [column['name'] for column in inspect(db.engine).get_columns('beverage')]
+    if 'change_seq' not in columns:
+        db.session.execute(text("ALTER TABLE beverage ADD COLUMN change_seq BIGINT"))
+    # The trigger installed below also fills change_xid (migration 11)
+    if 'change_xid' not in columns:
+        db.session.execute(text("ALTER TABLE beverage ADD COLUMN change_xid BIGINT"))
+    create_index(models.Beverage.__table__, 'ix_beverage_change_seq')
+    sync_service.install_change_tracking(db.session.connection())
+
+def add_beverage_name_search_indexes():
+    # Postgres only; other databases search an in-memory index
+    import search_service
+    search_service.install_search_indexes(db.session.connection())
+
+def add_stock_slots():
+    # The stock_slot table itself comes from db.create_all()
+    inspector = inspect(db.engine)
+    columns = [column['name'] for column in inspector.get_columns('beverage')]
+    if 'stock_slots' not in columns:
+        db.session.execute(text("ALTER TABLE beverage ADD COLUMN stock_slots INTEGER DEFAULT 0 NOT NULL"))
+    create_index(models.Beverage.__table__, 'ix_beverage_stock_slots')
+
+    # Sales of a beverage with slots spread over one rollup row per slot,
+    # so slot joins the primary key of daily_rollup
+    if 'slot' in [column['name'] for column in inspector.get_columns('daily_rollup')]:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        primary_key = inspector.get_pk_constraint('daily_rollup')['name']
+        db.session.execute(text("ALTER TABLE daily_rollup ADD COLUMN slot INTEGER DEFAULT 0 NOT NULL"))
+        db.session.execute(text(f"ALTER TABLE daily_rollup DROP CONSTRAINT {primary_key}"))
+        db.session.execute(text("ALTER TABLE daily_rollup ADD PRIMARY KEY (day, beverage_id, transaction_type, slot)"))
+        return
+    # SQLite cannot change a primary key: rebuild the table
+    db.session.execute(text("ALTER TABLE daily_rollup RENAME TO daily_rollup_old"))
+    models.DailyRollup.__table__.create(db.session.connection())
+    db.session.execute(text(
+        "INSERT INTO daily_rollup (day, beverage_id, transaction_type, slot, units, revenue) "
+        "SELECT day, beverage_id, transaction_type, 0, units, revenue FROM daily_rollup_old"
+    ))
+    db.session.execute(text("DROP TABLE daily_rollup_old"))
+
+def scope_sale_batch_keys_to_user():
+    # Idempotency keys were unique across users; now per user
+    inspector = inspect(db.engine)
+    constraints = inspector.get_unique_constraints('sale_batch')
+    old = [constraint for constraint in constraints if constraint['column_names'] == ['idempotency_key']]
+    if not old:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        for constraint in old:
+            db.session.execute(text(f"ALTER TABLE sale_batch DROP CONSTRAINT {constraint['name']}"))
+        db.session.execute(text(
+            "ALTER TABLE sale_batch ADD CONSTRAINT uq_sale_batch_user_key UNIQUE (user_id, idempotency_key)"
+        ))
+        return
+    # SQLite cannot drop a constraint: rebuild the table
+    db.session.execute(text("ALTER TABLE sale_batch RENAME TO sale_batch_old"))
+    models.SaleBatch.__table__.create(db.session.connection())
+    db.session.execute(text(
+        "INSERT INTO sale_batch (id, idempotency_key, user_id, response, created_at) "
+        "SELECT id, idempotency_key, user_id, response, created_at FROM sale_batch_old"
+    ))
+    db.session.execute(text("DROP TABLE sale_batch_old"))
+
+def add_beverage_change_xid():
+    import sync_service
+    columns = [column['name'] for column in inspect(db.engine).get_columns('beverage')]
+    if 'change_xid' not in columns:
+        db.session.execute(text("ALTER TABLE beverage ADD COLUMN change_xid BIGINT"))
+    create_index(models.Beverage.__table__, 'ix_beverage_change_xid')
+    sync_service.install_change_tracking(db.session.connection())
+
+def index_beverage_search_key():
+    # Postgres only: the name search indexes move from lower(name) to
+    # lower(unaccent(name))
+    import search_service
+    search_service.install_search_indexes(db.session.connection())
+
+MIGRATIONS = [
+    (1, "Add is_active column to beverage table", add_beverage_is_active),
+    (2, "Add timestamp indexes to transaction table", add_transaction_indexes),
+    (3, "Add image_variants_ready column to beverage table", add_beverage_image_variants_ready),
+    (4, "Add version column to beverage table", add_beverage_version),
+    (5, "Record opening stock balances and daily stock snapshots", add_stock_ledger),
+    (6, "Partition transaction table by month (Postgres)", partition_transaction_table),
+    (7, "Add change sequence to beverage table for delta sync", add_beverage_change_seq),
+    (8, "Add trigram name search indexes to beverage table (Postgres)", add_beverage_name_search_indexes),
+    (9, "Add stock slots to beverage table and slot to daily_rollup key", add_stock_slots),
+    (10, "Scope sale batch idempotency keys to their user", scope_sale_batch_keys_to_user),
+    (11, "Record the writing transaction of beverages for delta sync (Postgres)", add_beverage_change_xid),
+    (12, "Index beverage names without accents for search (Postgres)", index_beverage_search_key),
+]
+
+def current_version():
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at TIMESTAMP)"
+    ))
+    return db.session.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+def update_schema(app):
     with app.app_context():
-        sql = text("ALTER TABLE beverage ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT true NOT NULL;")
-        try:
-            db.session.execute(sql)
-            db.session.commit()
-            print("Successfully added is_active column to beverage table")
-        except Exception as e:
-            print(f"Error adding column: {str(e)}")
-            db.session.rollback()
+        # New tables (and their indexes) come straight from the models;
+        # migrations cover columns and indexes added to existing tables
+        db.create_all()
+        version = current_version()
+        for number, description, migration in MIGRATIONS:
+            if number <= version:
+                continue
+            try:
+                migration()
+                db.session.execute(
+                    text("INSERT INTO schema_version (version, applied_at) VALUES (:version, :applied_at)"),
+                    {'version': number, 'applied_at': datetime.utcnow()}
+                )
+                db.session.commit()
+                print(f"Applied migration {number}: {description}")
+            except Exception as e:
+                print(f"Error applying migration {number} ({description}): {str(e)}")
+                db.session.rollback()
+                return
+        print(f"Schema is up to date (version {max(number for number, _, _ in MIGRATIONS)})")
 
 if __name__ == "__main__":
-    update_schema()
+    update_schema(create_app({'START_BACKGROUND_JOBS': False}))
@@ -0,0 +1,82 @@
+import os
+import sys
+import subprocess
+import tempfile
+
+# Settings for _connect_smtp; FakeSMTP replaces smtplib.SMTP
+os.environ.update(SMTP_SERVER='smtp.invalid', SMTP_PORT='587', SMTP_USER='alertas@ejemplo.com', SMTP_PASSWORD='x')
+
+import email_service
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP: records the subjects it is given in
+    ``sent`` (and in ``FAKE_SMTP_LOG`` when set), or refuses them all
+    while ``failing`` is true"""
+    sent = []
+    failing = False
+
+    def __init__(self, host, port):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def send_message(self, msg):
+        if FakeSMTP.failing:
+            raise email_service.smtplib.SMTPDataError(451, b'try again later')
+        FakeSMTP.sent.append(msg['Subject'])
+        if os.environ.get('FAKE_SMTP_LOG'):
+            with open(os.environ['FAKE_SMTP_LOG'], 'a') as f:
+                f.write(msg['Subject'] + '\n')
+
+    def quit(self):
+        pass
+
+email_service.smtplib.SMTP = FakeSMTP
+
+def verify_dispatcher():
+    """Sends, debouncing and retries of LowStockAlertDispatcher against the
+    fake server"""
+    dispatcher = email_service.LowStockAlertDispatcher(debounce=3600, coalesce=0.2)
+
+    # A failed send must not silence the beverage for the debounce period
+    FakeSMTP.failing = True
+    assert dispatcher.enqueue(1, 'Agua', 2)
+    assert not dispatcher.enqueue(1, 'Agua', 1), "queued twice before the send"
+    assert dispatcher.flush(timeout=5)
+    assert not FakeSMTP.sent
+    FakeSMTP.failing = False
+    assert dispatcher.enqueue(1, 'Agua', 1), "alert still debounced after a failed send"
+
+    # Beverages running low together share one email
+    assert dispatcher.enqueue(2, 'Cerveza', 3)
+    assert dispatcher.flush(timeout=5)
+    assert FakeSMTP.sent == ['¡Alerta de Stock Bajo! - 2 productos'], FakeSMTP.sent
+
+    # Sent: debounced until restocked
+    assert not dispatcher.enqueue(1, 'Agua', 0)
+    dispatcher.reset(1)
+    assert dispatcher.enqueue(1, 'Agua', 0)
+    assert dispatcher.flush(timeout=5)
+    assert FakeSMTP.sent[-1] == '¡Alerta de Stock Bajo! - Agua', FakeSMTP.sent
+
+def verify_exit_flush():
+    """A process exiting with an alert still coalescing sends it first"""
+    log = os.path.join(tempfile.mkdtemp(), 'smtp.log')
+    code = (
+        "import verify_alerts, email_service\n"
+        "dispatcher = email_service.LowStockAlertDispatcher(coalesce=60)\n"
+        "dispatcher.enqueue(1, 'Agua', 2)\n"
+    )
+    subprocess.run([sys.executable, '-c', code], check=True, timeout=30,
+                   cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, 'FAKE_SMTP_LOG': log})
+    with open(log) as f:
+        assert f.read().splitlines() == ['¡Alerta de Stock Bajo! - Agua']
+
+if __name__ == "__main__":
+    verify_dispatcher()
+    verify_exit_flush()
+    print("Low stock alerts: sent once, retried after failures and flushed on exit")
@@ -0,0 +1,110 @@
+"""Check that archiving old months changes nothing the application returns.
+
+Builds a scratch database with 20 months of history, records the sales and
+transactions exports, statistics over ranges with partial days and stock at
+several instants, archives every closed month older than --older-than-months
+and compares; then restores the archive and compares again. Exits with
+status 1 on any difference:
+
+    python verify_archive.py
+    python verify_archive.py --database-url postgresql://localhost/archive_check
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+
+import dataset  # noqa: E402
+
+def capture(app, ranges, instants):
+    """Everything an archive must not change"""
+    import inventory_service
+
+    client = app.test_client()
+    client.post('/login', data={'email': dataset.bench_email(0), 'password': dataset.BENCH_PASSWORD})
+    results = {}
+    for start, end in ranges:
+        for kind in ('sales', 'transactions'):
+            response = client.get(f"/api/export/{kind}", query_string={
+                'start_date': start.strftime('%Y-%m-%d'), 'end_date': end.strftime('%Y-%m-%d'),
+            })
+            assert response.status_code == 200, f"{kind} export: {response.status_code}"
+            results[f"export {kind} {start:%Y-%m-%d}..{end:%Y-%m-%d}"] = response.get_data()
+        # Partial days at both edges read raw rows, possibly archived ones
+        edge_start, edge_end = start + timedelta(hours=13, minutes=17), end + timedelta(hours=9, minutes=41)
+        with app.app_context():
+            results[f"stats {edge_start}..{edge_end}"] = sorted(inventory_service.sales_by_beverage(edge_start, edge_end))
+    with app.app_context():
+        for at in instants:
+            results[f"stock {at}"] = inventory_service.stock_as_of(at)
+    return results
+
+def compare(label, expected, actual):
+    differences = [key for key in expected if expected[key] != actual.get(key)]
+    for key in differences:
+        print(f"{label}: {key} differs")
+    print(f"{label}: {len(expected) - len(differences)}/{len(expected)} identical")
+    return not differences
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--transactions', type=int, default=30000)
+    parser.add_argument('--older-than-months', type=int, default=6)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='archive-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'archive.db')}"
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import archive_service
+    import auth_service
+    import inventory_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'UPLOAD_FOLDER': folder,
+                      'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+
+    now = datetime.utcnow()
+    with app.app_context():
+        dataset.generate(users=5, beverages=20, transactions=args.transactions, days=600)
+        cutoff = archive_service.add_months(archive_service.month_start(now), -args.older_than_months)
+        cutoff = datetime.combine(cutoff, datetime.min.time())
+        first = db.session.query(db.func.min(models.Transaction.timestamp)).scalar()
+
+    # Ranges entirely archived, straddling the cutoff and entirely live
+    ranges = [
+        (first, now),
+        (cutoff - timedelta(days=75), cutoff - timedelta(days=20)),
+        (cutoff - timedelta(days=10), cutoff + timedelta(days=10)),
+        (cutoff + timedelta(days=5), now - timedelta(days=1)),
+    ]
+    instants = [first + (now - first) * fraction for fraction in (0.1, 0.35, 0.6, 0.9)]
+    instants.append(cutoff - timedelta(hours=5))
+
+    before = capture(app, ranges, instants)
+    with app.app_context():
+        archived = archive_service.archive_closed_months(args.older_than_months)
+        # Rebuilding must keep the rollup of archived days
+        inventory_service.rebuild_rollup()
+        live = db.session.query(db.func.count(models.Transaction.id)).scalar()
+    print(f"Archived {sum(rows for _, rows in archived)} transactions in {len(archived)} months, {live} left")
+    ok = bool(archived) and compare("after archive", before, capture(app, ranges, instants))
+
+    with app.app_context():
+        for month, _ in archived:
+            archive_service.restore_month(month)
+    ok = compare("after restore", before, capture(app, ranges, instants)) and ok
+
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
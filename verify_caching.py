@@ -0,0 +1,103 @@
+"""Revalidation of the inventory views and bytes served per polling till.
+
+Checks against a scratch database that GET / and GET /api/inventory carry
+an ETag, answer 304 with an empty body while nothing changed and 200 with
+a new ETag after a sale, and that content-hashed uploads are served as
+immutable. Then simulates a till polling GET / ``--polls`` times with a
+sale every ``--sale-every`` polls, once re-downloading the page every time
+and once revalidating, and reports the bytes of each. Exits with status 1
+when a check fails:
+
+    python verify_caching.py --polls 120 --sale-every 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+
+import dataset  # noqa: E402
+
+def check(condition, message):
+    print(f"{'OK' if condition else 'FAILED'}: {message}")
+    return condition
+
+def verify_revalidation(client, path, beverage_id):
+    first = client.get(path)
+    etag = first.headers.get('ETag')
+    ok = check(first.status_code == 200 and etag is not None, f"{path} sends an ETag")
+    again = client.get(path, headers={'If-None-Match': etag})
+    ok &= check(again.status_code == 304 and not again.get_data(), f"{path} answers 304 with no body while unchanged")
+    client.post(f"/api/decrease/{beverage_id}")
+    changed = client.get(path, headers={'If-None-Match': etag})
+    ok &= check(changed.status_code == 200 and changed.headers.get('ETag') != etag,
+                f"{path} answers 200 with a new ETag after a sale")
+    return ok
+
+def verify_immutable_uploads(client, upload_folder):
+    name = f"{uuid.uuid4().hex}.png"
+    path = os.path.join(upload_folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+    try:
+        response = client.get(f"/static/uploads/{name}")
+        response.close()
+        cache_control = response.headers.get('Cache-Control', '')
+        return check('immutable' in cache_control and 'max-age=31536000' in cache_control,
+                     f"hashed uploads are immutable ({cache_control})")
+    finally:
+        os.remove(path)
+
+def poll_bytes(client, polls, sale_every, beverage_id, revalidate):
+    """Body bytes a till downloads polling GET / ``polls`` times"""
+    etag = None
+    total = 0
+    for poll in range(polls):
+        if poll and poll % sale_every == 0:
+            client.post(f"/api/decrease/{beverage_id}")
+        headers = {'If-None-Match': etag} if revalidate and etag else {}
+        response = client.get('/', headers=headers)
+        etag = response.headers.get('ETag')
+        total += len(response.get_data())
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--beverages', type=int, default=50)
+    parser.add_argument('--polls', type=int, default=120)
+    parser.add_argument('--sale-every', type=int, default=10)
+    args = parser.parse_args()
+
+    from app import create_app, db, UPLOAD_FOLDER
+    from update_schema import update_schema
+    import auth_service
+    import models
+
+    auth_service.email_limiter.burst = 0
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'caching.db')}"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(users=1, beverages=args.beverages, transactions=1000, days=30)
+        beverage_id = db.session.scalars(db.select(models.Beverage.id)).first()
+
+    client = app.test_client()
+    client.post('/login', data={'email': dataset.bench_email(0), 'password': dataset.BENCH_PASSWORD})
+    ok = verify_revalidation(client, '/', beverage_id)
+    ok &= verify_revalidation(client, '/api/inventory', beverage_id)
+    ok &= verify_immutable_uploads(client, os.path.join(app.root_path, UPLOAD_FOLDER))
+
+    full = poll_bytes(client, args.polls, args.sale_every, beverage_id, revalidate=False)
+    revalidated = poll_bytes(client, args.polls, args.sale_every, beverage_id, revalidate=True)
+    print(f"\n{args.polls} polls of / with {args.beverages} beverages and a sale every {args.sale_every} polls:")
+    print(f"  without revalidation: {full / 1024:.0f} KB ({full / args.polls / 1024:.1f} KB per poll)")
+    print(f"  with If-None-Match:   {revalidated / 1024:.0f} KB ({revalidated / args.polls / 1024:.1f} KB per poll)")
+    ok &= check(revalidated < full, "revalidating tills download less")
+
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
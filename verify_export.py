@@ -0,0 +1,132 @@
+"""Memory ceiling and time to first byte of the streamed exports.
+
+Fills a scratch database with ``--transactions`` rows from bench/dataset.py
+and exports the whole history from /api/export/sales and
+/api/export/transactions in each of ``--formats``. Every export runs in a
+fresh process that samples its resident memory while it reads the
+response, so the dataset generation does not hide the growth. Fails when
+an export grows the process by more than ``--max-memory-mb``, takes
+longer than ``--max-first-byte`` seconds to send its first chunk, or (CSV)
+does not contain every row of the range:
+
+    python verify_export.py --transactions 2000000
+    python verify_export.py --database-url postgresql://localhost/export_check --formats csv parquet
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+
+import dataset  # noqa: E402
+
+EXPORTS = {'sales': 'sale', 'transactions': None}
+
+def resident_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+def export(database_url, endpoint, export_format, days):
+    """Child process: stream one export and print what it measured as JSON"""
+    from app import create_app
+    import auth_service
+
+    auth_service.email_limiter.burst = 0
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    client = app.test_client()
+    client.post('/login', data={'email': dataset.bench_email(0), 'password': dataset.BENCH_PASSWORD})
+    today = date.today()
+    url = f"/api/export/{endpoint}?format={export_format}"
+    # Warm up (imports, connection pool, first query) on a one-day range
+    client.get(f"{url}&start_date={today}&end_date={today}").get_data()
+
+    baseline = peak = resident_bytes()
+    start = time.perf_counter()
+    response = client.get(f"{url}&start_date={today - timedelta(days=days + 1)}&end_date={today}", buffered=False)
+    assert response.status_code == 200, f"{url}: {response.status_code}"
+    first_byte = None
+    size = lines = 0
+    for index, chunk in enumerate(response.response):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+        if index % 50 == 0:
+            peak = max(peak, resident_bytes())
+    response.close()
+    seconds = time.perf_counter() - start
+    peak = max(peak, resident_bytes())
+    print(json.dumps({
+        'first_byte': first_byte, 'seconds': seconds, 'bytes': size,
+        'rows': lines - 1 if export_format == 'csv' else None,
+        'memory_growth_mb': (peak - baseline) / 2 ** 20,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database (its contents are deleted)")
+    parser.add_argument('--transactions', type=int, default=2000000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--formats', nargs='+', default=['csv', 'csv.gz'])
+    parser.add_argument('--max-memory-mb', type=float, default=64)
+    parser.add_argument('--max-first-byte', type=float, default=2.0)
+    parser.add_argument('--export', nargs=4, metavar=('DATABASE_URL', 'ENDPOINT', 'FORMAT', 'DAYS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.export:
+        database_url, endpoint, export_format, days = args.export
+        export(database_url, endpoint, export_format, int(days))
+        return
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'export.db')}"
+    from app import create_app, db
+    from update_schema import update_schema
+    import models
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        print(f"Generating {args.transactions} transactions...", file=sys.stderr)
+        dataset.generate(transactions=args.transactions, days=args.days)
+        counts = {
+            endpoint: db.session.query(db.func.count(models.Transaction.id)).filter(
+                *([models.Transaction.transaction_type == transaction_type] if transaction_type else [])
+            ).scalar()
+            for endpoint, transaction_type in EXPORTS.items()
+        }
+
+    ok = True
+    for endpoint in EXPORTS:
+        for export_format in args.formats:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--export',
+                 database_url, endpoint, export_format, str(args.days)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            problems = []
+            if result['memory_growth_mb'] > args.max_memory_mb:
+                problems.append(f"memory grew over {args.max_memory_mb:g} MB")
+            if result['first_byte'] is None or result['first_byte'] > args.max_first_byte:
+                problems.append(f"first byte after more than {args.max_first_byte:g}s")
+            if result['rows'] is not None and result['rows'] != counts[endpoint]:
+                problems.append(f"{result['rows']} rows instead of {counts[endpoint]}")
+            first_byte = f"{result['first_byte'] * 1000:.0f} ms" if result['first_byte'] is not None else "never"
+            print(f"{endpoint} ({export_format}): {result['bytes'] / 2 ** 20:.1f} MB in {result['seconds']:.1f}s, "
+                  f"first byte after {first_byte}, memory +{result['memory_growth_mb']:.1f} MB: "
+                  f"{'; '.join(problems) or 'OK'}")
+            ok = ok and not problems
+
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
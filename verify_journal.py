@@ -0,0 +1,234 @@
+"""Kill-and-recover check of the sale journal (write-behind mode).
+
+Each round starts a server process with SALE_JOURNAL_DIR set that sells
+from several threads, some beverages until they run out, and kills it with
+SIGKILL at a random moment, usually with sales journaled but not flushed
+and sometimes in the middle of a group commit. The journal is then
+recovered as on startup, twice, and the database is compared with what the
+journal says was sold: every acknowledged sale must be there exactly once,
+no sale may be there twice and no stock may go below zero. Before the
+rounds, a failed journal write is checked in process: a sale that went out
+with it must be refused even after a later write succeeds. Exits with
+status 1 on any difference:
+
+    python verify_journal.py --rounds 5
+    python verify_journal.py --database-url postgresql://localhost/journal_check
+"""
+import argparse
+import glob
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+
+import dataset  # noqa: E402
+
+LOW_STOCK = 40  # stock of the beverages sold out during the check
+
+def serve(database_url, journal_dir, acks, threads, group_size):
+    """Child process: sell until killed, appending each answer to ``acks``"""
+    from app import create_app
+    import auth_service
+
+    auth_service.email_limiter.burst = 0
+    auth_service.ip_limiter.burst = 0
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False,
+        'SALE_JOURNAL_DIR': journal_dir, 'SALE_JOURNAL_GROUP_SIZE': group_size,
+        'SALE_JOURNAL_FLUSH_SECONDS': 0.02, 'WEB_CONCURRENCY': 1,
+    })
+    import models
+    from app import db
+    with app.app_context():
+        beverage_ids = db.session.scalars(db.select(models.Beverage.id)).all()
+    fd = os.open(acks, os.O_WRONLY | os.O_APPEND)
+
+    def sell(index):
+        rng = random.Random(index)
+        client = app.test_client()
+        client.post('/login', data={'email': dataset.bench_email(index), 'password': dataset.BENCH_PASSWORD})
+        while True:
+            beverage_id = rng.choice(beverage_ids)
+            response = client.post(f"/api/decrease/{beverage_id}")
+            outcome = 'ok' if response.status_code == 200 else f"refused {response.status_code}"
+            os.write(fd, f"{beverage_id} {outcome}\n".encode())
+
+    for index in range(threads):
+        threading.Thread(target=sell, args=(index,), daemon=True).start()
+    threading.Event().wait()
+
+def verify_failed_write(app, journal_dir):
+    """Sale b is buffered, c's write carries it and fails, d refills the
+    buffer and is written: b's seller must still get the failure and the
+    journal must hold only d."""
+    import journal_service
+    import models
+    from app import db
+
+    journal = journal_service.SaleJournal(app, journal_dir)
+    with app.app_context():
+        beverage_id = db.session.scalars(db.select(models.Beverage.id).order_by(models.Beverage.id.desc())).first()
+        user_id = db.session.scalars(db.select(models.User.id)).first()
+        sync = journal._sync
+        journal._sync = lambda sequence: None  # b's seller has not synced yet
+        journal.record_sale(beverage_id, user_id)
+        journal._sync = sync
+        b = journal._next_sequence - 1
+
+        fdatasync = journal_service.os.fdatasync
+
+        def failing(fd):
+            raise OSError("disk full")
+        journal_service.os.fdatasync = failing
+        try:
+            journal.record_sale(beverage_id, user_id)
+            c_failed = False
+        except OSError:
+            c_failed = True
+        finally:
+            journal_service.os.fdatasync = fdatasync
+        d_sold = journal.record_sale(beverage_id, user_id) is not None
+        try:
+            journal._sync(b)
+            b_failed = False
+        except OSError:
+            b_failed = True
+        written = [entry.sequence for entry in journal_service.read_entries(journal.path)]
+        pending = [sequence for sequence, _ in journal._pending.get(beverage_id, ())]
+    os.unlink(journal.path)
+    os.close(journal._fd)
+
+    problems = []
+    if not (c_failed and d_sold):
+        problems.append(f"unexpected outcome of the failing and the next write ({c_failed}, {d_sold})")
+    if not b_failed:
+        problems.append("a sale carried by a failed write was acknowledged")
+    if written != [b + 2]:
+        problems.append(f"journal holds sequences {written} instead of [{b + 2}]")
+    if pending != [b + 2]:
+        problems.append(f"pending sales {pending} instead of [{b + 2}]")
+    print(f"failed write: {'; '.join(problems) or 'OK'}")
+    return not problems
+
+def journal_sales(journal_dir):
+    import journal_service
+
+    sold = Counter()
+    for path in glob.glob(os.path.join(journal_dir, 'sales-*.journal')):
+        for entry in journal_service.read_entries(path):
+            sold[entry.beverage_id] += entry.units
+    return sold
+
+def database_sales(db, models):
+    rows = db.session.query(
+        models.Transaction.beverage_id, db.func.sum(models.Transaction.quantity_change)
+    ).filter(models.Transaction.transaction_type == 'sale').group_by(models.Transaction.beverage_id)
+    return Counter({beverage_id: -int(change) for beverage_id, change in rows})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="default: a temporary SQLite database")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--serve', nargs=5, metavar=('URL', 'DIR', 'ACKS', 'THREADS', 'GROUP'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        url, journal_dir, acks, threads, group_size = args.serve
+        serve(url, journal_dir, acks, int(threads), int(group_size))
+        return
+
+    folder = tempfile.mkdtemp(prefix='journal-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(folder, 'journal.db')}"
+    journal_dir = os.path.join(folder, 'journal')
+    os.makedirs(journal_dir)
+
+    from app import create_app, db
+    from update_schema import update_schema
+    import inventory_service
+    import models
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        dataset.generate(users=args.threads, beverages=8, transactions=1000, days=30)
+        # Half the beverages run out during the check
+        user_id = db.session.scalars(db.select(models.User.id)).first()
+        for beverage in models.Beverage.query.order_by(models.Beverage.id).limit(4).all():
+            inventory_service.record_sale(beverage.id, user_id, units=beverage.quantity - LOW_STOCK)
+        db.session.commit()
+
+    rng = random.Random(args.seed)
+    ok = verify_failed_write(app, journal_dir)
+    for round_number in range(1, args.rounds + 1):
+        with app.app_context():
+            before = database_sales(db, models)
+            quantities = dict(db.session.query(models.Beverage.id, models.Beverage.quantity))
+        acks = os.path.join(folder, f"acks-{round_number}")
+        open(acks, 'w').close()
+        group_size = rng.choice((1, 10, 100))
+        child = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), '--serve',
+            database_url, journal_dir, acks, str(args.threads), str(group_size),
+        ])
+        time.sleep(rng.uniform(1.5, 4.0))
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+
+        with open(acks) as f:
+            answers = [line.split(' ', 1) for line in f if line.endswith('\n')]
+        acknowledged = Counter(int(beverage_id) for beverage_id, outcome in answers if outcome == 'ok\n')
+        refused = sum(1 for _, outcome in answers if outcome != 'ok\n')
+        journaled = journal_sales(journal_dir)
+        with app.app_context():
+            flushed = database_sales(db, models) - before
+
+        # Recovery as on startup; the second one must find nothing to do
+        replayed = []
+        for _ in range(2):
+            recovered = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False,
+                                    'SALE_JOURNAL_DIR': journal_dir, 'WEB_CONCURRENCY': 1})
+            recovered.extensions['sale_journal'].stop()
+            with app.app_context():
+                replayed.append(sum((database_sales(db, models) - before).values()))
+
+        with app.app_context():
+            after = database_sales(db, models) - before
+            final = dict(db.session.query(models.Beverage.id, models.Beverage.quantity))
+            drift = inventory_service.check_stock_drift()
+            checkpoints = db.session.query(db.func.count()).select_from(models.JournalCheckpoint).scalar()
+
+        problems = []
+        if after != journaled:
+            problems.append(f"database sales {dict(after)} != journal {dict(journaled)}")
+        if acknowledged - journaled:
+            problems.append(f"acknowledged sales missing from the journal: {dict(acknowledged - journaled)}")
+        if replayed[0] != replayed[1]:
+            problems.append(f"second recovery applied {replayed[1] - replayed[0]} sales again")
+        if any(final[beverage_id] != quantities[beverage_id] - after[beverage_id] for beverage_id in final):
+            problems.append("quantities do not match the sales")
+        if any(quantity < 0 for quantity in final.values()):
+            problems.append(f"negative stock: {final}")
+        if drift:
+            problems.append(f"ledger drift: {drift}")
+        if glob.glob(os.path.join(journal_dir, '*')) or checkpoints:
+            problems.append("journal files or checkpoints left after recovery")
+        print(f"round {round_number}: group size {group_size}, {sum(acknowledged.values())} acknowledged, "
+              f"{refused} refused, {sum(journaled.values())} journaled, {sum(flushed.values())} flushed before "
+              f"the kill, {sum(after.values()) - sum(flushed.values())} recovered: "
+              f"{'; '.join(problems) or 'OK'}")
+        ok = ok and not problems
+
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import io
+import os
+import re
+import tempfile
+from app import create_app, db
+
+SALES = 7
+
+EXPECTED_SAMPLES = {
+    'http_requests_total{method="POST",route="/api/decrease/<int:beverage_id>",status="200"}': SALES,
+    'http_request_duration_seconds_count{method="POST",route="/api/decrease/<int:beverage_id>"}': SALES,
+    'db_queries_per_request_count{route="/api/decrease/<int:beverage_id>"}': SALES,
+    'export_rows_total{export="sales",format="csv"}': SALES,
+}
+
+EXPECTED_FAMILIES = [
+    'http_request_duration_seconds', 'http_requests_total', 'db_queries_per_request',
+    'db_query_duration_seconds_per_request', 'image_processing_duration_seconds',
+    'image_processing_failures_total', 'smtp_send_duration_seconds', 'smtp_send_failures_total',
+    'export_rows_total', 'export_bytes_total', 'low_stock_alert_queue_depth',
+]
+
+def sample_image():
+    from PIL import Image
+    data = io.BytesIO()
+    Image.new('RGB', (64, 64), 'red').save(data, format='PNG')
+    data.seek(0)
+    return data
+
+def exercise(client):
+    """Log in, restock with an image, sell below the low stock threshold and export"""
+    client.post('/register', data={'email': 'metricas@ejemplo.com', 'password': 'metricas'})
+    client.post('/login', data={'email': 'metricas@ejemplo.com', 'password': 'metricas'})
+    client.post('/api/restock', data={
+        'name': 'Bebida de prueba', 'quantity': 10, 'price': 1.5,
+        'image': (sample_image(), 'prueba.png'),
+    }, content_type='multipart/form-data')
+    for _ in range(SALES):
+        client.post('/api/decrease/1')
+    client.get('/')
+    client.get('/api/export/sales').get_data()
+
+def verify_metrics():
+    """Exercise the main routes against a scratch database and check that
+    /metrics reports them"""
+    folder = tempfile.mkdtemp()
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(folder, 'metrics.db')}",
+        'UPLOAD_FOLDER': folder,
+        'START_BACKGROUND_JOBS': False,
+        'METRICS_ENABLED': True,
+    })
+    with app.app_context():
+        db.create_all()
+
+    import image_service
+    client = app.test_client()
+    exercise(client)
+    # Variants are generated in a worker process; wait for them
+    image_service._get_pool().shutdown(wait=True)
+
+    response = client.get('/metrics')
+    if response.status_code != 200:
+        print(f"/metrics answered {response.status_code}")
+        return False
+    text = response.get_data(as_text=True)
+    samples = dict(
+        line.rsplit(' ', 1) for line in text.splitlines() if line and not line.startswith('#')
+    )
+
+    ok = True
+    for family in EXPECTED_FAMILIES:
+        if not re.search(rf'^# TYPE {family} ', text, re.MULTILINE):
+            ok = False
+            print(f"{family}: missing")
+    for name, expected in EXPECTED_SAMPLES.items():
+        value = float(samples.get(name, 0))
+        if value != expected:
+            ok = False
+            print(f"{name}: {value} (expected {expected})")
+        else:
+            print(f"{name}: {expected}")
+    for name in ['export_bytes_total{export="sales",format="csv"}', 'image_processing_duration_seconds_count']:
+        if float(samples.get(name, 0)) <= 0:
+            ok = False
+            print(f"{name}: not recorded")
+        else:
+            print(f"{name}: {samples[name]}")
+    return ok
+
+if __name__ == "__main__":
+    if not verify_metrics():
+        raise SystemExit(1)
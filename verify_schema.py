@@ -1,20 +1,71 @@
-from app import app, db
-from models import Beverage
-from sqlalchemy import text
+import os
+import sys
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from app import create_app, db
+from models import Beverage, Transaction
+from sqlalchemy import inspect
+import inventory_service
 
-def verify_schema():
+def explain(query):
+    """Return the query plan lines for an ORM query on the current backend"""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    if dialect.name == 'sqlite':
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+    if compiled.positiontup is not None:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    rows = connection.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    return [str(row[-1]) if dialect.name == 'sqlite' else str(row[0]) for row in rows]
+
+def full_scans(plan, table='transaction'):
+    """Plan lines that read the whole table instead of using an index"""
+    scans = []
+    for line in plan:
+        if f"Seq Scan on {table}" in line or f'Seq Scan on "{table}"' in line:
+            scans.append(line)
+        elif line.startswith(("SCAN ", "SCAN TABLE ")) and table in line and "INDEX" not in line:
+            scans.append(line)
+    return scans
+
+def verify_query_plans():
+    """Fail loudly if stats or export queries stop using the transaction indexes"""
+    end = datetime.now()
+    start = end - timedelta(days=30)
+    queries = {
+        'get_stats': inventory_service.raw_sales_query(start, end),
+        'export_sales': inventory_service.sales_export_query(start, end),
+        'export_transactions': inventory_service.transactions_export_query(start, end),
+    }
+    ok = True
+    for name, query in queries.items():
+        plan = explain(query)
+        scans = full_scans(plan)
+        if scans:
+            ok = False
+            print(f"{name}: sequential scan on transaction table!")
+            for line in plan:
+                print(f"    {line}")
+        else:
+            print(f"{name}: uses index")
+    return ok
+
+def verify_schema(app):
     with app.app_context():
+        inspector = inspect(db.engine)
+
         # Check if column exists
-        sql = text("""
-            SELECT column_name, data_type 
-            FROM information_schema.columns 
-            WHERE table_name = 'beverage' AND column_name = 'is_active';
-        """)
-        result = db.session.execute(sql).fetchone()
-        
-        if result:
-            print("is_active column exists with type:", result[1])
-            
+        columns = {column['name']: column['type'] for column in inspector.get_columns('beverage')}
+
+        if 'is_active' in columns:
+            print("is_active column exists with type:", columns['is_active'])
+
             # Check all beverages
             beverages = Beverage.query.all()
             print(f"\nFound {len(beverages)} beverages:")
@@ -23,5 +74,42 @@ def verify_schema():
         else:
             print("is_active column does not exist!")
 
+        existing = {index['name'] for index in inspector.get_indexes('transaction')}
+        missing = [index.name for index in Transaction.__table__.indexes if index.name not in existing]
+        if missing:
+            print(f"\nMissing transaction indexes: {', '.join(missing)} (run update_schema.py)")
+        else:
+            print("\nAll transaction indexes exist")
+
+        return not missing
+
+def verify_plans_on_dataset(database_url, transactions):
+    """Check the query plans on a scratch database filled by bench/dataset.py:
+    Postgres only prefers the indexes once the table holds enough rows and
+    has been analyzed. Everything in ``database_url`` is deleted."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+    import dataset
+    from update_schema import update_schema
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'START_BACKGROUND_JOBS': False})
+    update_schema(app)
+    with app.app_context():
+        print(f"\nGenerating {transactions} transactions in the scratch database...")
+        dataset.generate(transactions=transactions)
+        print("Query plans:")
+        return verify_query_plans()
+
 if __name__ == "__main__":
-    verify_schema()
+    parser = argparse.ArgumentParser(description="Check the schema and the query plans of stats and exports")
+    parser.add_argument('--scratch-url', help="database to fill for the query plans, default: a temporary "
+                                              "SQLite database (its contents are deleted)")
+    parser.add_argument('--transactions', type=int, default=1000000)
+    args = parser.parse_args()
+
+    app = create_app({'START_BACKGROUND_JOBS': False})
+    scratch_url = args.scratch_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+    if scratch_url.replace('postgres://', 'postgresql://', 1) == app.config['SQLALCHEMY_DATABASE_URI']:
+        raise SystemExit("--scratch-url must not be the application database: it is emptied")
+    schema_ok = verify_schema(app)
+    if not verify_plans_on_dataset(scratch_url, args.transactions) or not schema_ok:
+        raise SystemExit(1)
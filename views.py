@@ -0,0 +1,797 @@
+import os
+import re
+import json
+import math
+import logging
+import functools
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, current_app, render_template, request, jsonify, flash, redirect, url_for, Response, stream_with_context, abort, make_response, session
+from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import IntegrityError, DBAPIError
+from app import db, login_manager, DEFAULT_IMAGE
+import models
+import inventory_service
+import auth_service
+import export_service
+import forecast_service
+import import_service
+import journal_service
+import search_service
+import stock_slot_service
+import sync_service
+import image_service
+import event_service
+import metrics_service
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('main', __name__)
+
+def low_stock_alerts():
+    # Imported on first use so that smtplib/email are not loaded at startup
+    from email_service import alert_dispatcher
+    return alert_dispatcher
+
+def publish_beverage_event(beverage_id, quantity, is_active):
+    event_service.get_broker().publish(event_service.beverage_event(beverage_id, quantity, is_active))
+
+# Above this many changed beverages tills reload the inventory instead
+MAX_BEVERAGE_EVENTS = 50
+
+@bp.app_template_filter('image_variant')
+def image_variant(filename, variant, ext):
+    return image_service.variant_filename(filename, variant, ext)
+
+def mark_variants_ready(app, filename):
+    with app.app_context():
+        db.session.execute(
+            db.update(models.Beverage)
+            .where(models.Beverage.image_path == filename)
+            .values(image_variants_ready=True, version=models.Beverage.version + 1)
+        )
+        db.session.commit()
+
+def reconcile_images(app):
+    """Rescan the upload folder and repair beverages whose image files are
+    gone: missing originals fall back to the default image and missing
+    variants are regenerated. Each repair is one batched UPDATE.
+
+    Uploads write the file before committing the beverage, so the
+    beverages are read before the folder is scanned: an image committed in
+    between is then on disk already. Rows written since the scan started
+    (a re-upload of the same image) are left for the next run."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    started = datetime.utcnow()
+    with app.app_context():
+        rows = db.session.query(
+            models.Beverage.image_path,
+            db.func.max(db.case((models.Beverage.image_variants_ready, 1), else_=0))
+        ).filter(
+            models.Beverage.image_path.isnot(None),
+            models.Beverage.image_path != DEFAULT_IMAGE
+        ).group_by(models.Beverage.image_path).all()
+        files = image_service.image_index.refresh(upload_folder)
+        written_before = db.or_(models.Beverage.updated_at < started, models.Beverage.updated_at.is_(None))
+
+        missing = [path for path, _ in rows if path not in files]
+        stale = [
+            path for path, ready in rows
+            if ready and path in files
+            and not all(name in files for name in image_service.variant_filenames(path))
+        ]
+        if missing:
+            logger.warning(f"Image files not found, using default image: {', '.join(missing)}")
+            db.session.execute(
+                db.update(models.Beverage)
+                .where(models.Beverage.image_path.in_(missing), written_before)
+                .values(image_path=DEFAULT_IMAGE, image_variants_ready=False,
+                        version=models.Beverage.version + 1)
+            )
+        if stale:
+            db.session.execute(
+                db.update(models.Beverage)
+                .where(models.Beverage.image_path.in_(stale), written_before)
+                .values(image_variants_ready=False, version=models.Beverage.version + 1)
+            )
+        db.session.commit()
+
+    for path in stale:
+        image_service.submit_variants(
+            os.path.join(upload_folder, path), functools.partial(mark_variants_ready, app)
+        )
+    return missing, stale
+
+@bp.app_errorhandler(DBAPIError)
+def database_error(e):
+    # Without pre-ping a dropped connection surfaces here once; the pool has
+    # been invalidated so the client's retry gets a fresh connection
+    db.session.rollback()
+    if e.connection_invalidated:
+        logger.warning(f"Database connection lost, pool invalidated: {str(e)}")
+        response = jsonify({'success': False, 'error': 'Base de datos no disponible, intente nuevamente'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    logger.error(f"Database error: {str(e)}")
+    return jsonify({'success': False, 'error': 'Error de base de datos'}), 500
+
+@login_manager.user_loader
+def load_user(user_id):
+    return auth_service.user_cache.get(int(user_id))
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        email = request.form.get('email')
+        password = request.form.get('password')
+        try:
+            # Checked before any password work, which is what an attack costs us
+            auth_service.check_login_rate(email, request.remote_addr)
+            user = models.User.query.filter_by(email=email).first()
+
+            if user and auth_service.verify_password(user, password):
+                if auth_service.upgrade_password_hash(user, password):
+                    db.session.commit()
+                login_user(user)
+                flash('¡Inicio de sesión exitoso!', 'success')
+                return redirect(url_for('main.inventory'))
+            auth_service.record_failed_login(email)
+        except auth_service.LoginThrottled as throttled:
+            if throttled.busy:
+                flash('El servidor está ocupado, intente nuevamente en unos segundos', 'danger')
+                status = 503
+            else:
+                flash('Demasiados intentos de inicio de sesión, intente nuevamente más tarde', 'danger')
+                status = 429
+            response = make_response(render_template('login.html'), status)
+            response.headers['Retry-After'] = str(max(1, math.ceil(throttled.retry_after)))
+            return response
+        flash('Email o contraseña incorrectos', 'danger')
+    
+    return render_template('login.html')
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        email = request.form.get('email')
+        password = request.form.get('password')
+        
+        if models.User.query.filter_by(email=email).first():
+            flash('El email ya está registrado', 'danger')
+            return redirect(url_for('main.register'))
+        
+        try:
+            password_hash = auth_service.hash_password(password)
+        except auth_service.LoginThrottled:
+            flash('El servidor está ocupado, intente nuevamente en unos segundos', 'danger')
+            return redirect(url_for('main.register'))
+        user = models.User(email=email, password_hash=password_hash)
+        db.session.add(user)
+        db.session.commit()
+        
+        flash('Registro exitoso. Por favor inicie sesión', 'success')
+        return redirect(url_for('main.login'))
+    
+    return render_template('register.html')
+
+@bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    flash('Has cerrado sesión exitosamente', 'success')
+    return redirect(url_for('main.login'))
+
+def cached_response(tag, last_modified, build):
+    """Answer 304 when the client already has version ``tag``, otherwise
+    call ``build()`` and attach the validators. Responses embed the user's
+    email and flashed messages, so the ETag is per user and pages with
+    pending flashes are always rendered."""
+    etag = f"{tag}-u{current_user.id}"
+    if '_flashes' not in session and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/')
+@login_required
+def inventory():
+    # Read only: missing image files are repaired by reconcile_images()
+    forecast = forecast_service.forecast_cache.get()
+
+    def render():
+        # Cursor first: anything written meanwhile is sent again by the first sync
+        sync_cursor = sync_service.current_cursor()
+        beverages = models.Beverage.query.filter_by(is_active=True).all()
+        return render_template('inventory.html', beverages=beverages, reorder_point=forecast.reorder_point,
+                               sync_cursor=sync_cursor, forecast_version=forecast.version)
+
+    tag, last_modified = inventory_service.inventory_version()
+    return cached_response(f"{tag}-f{forecast.version}", last_modified, render)
+
+def beverage_json(beverage, forecast):
+    return {
+        'id': beverage.id,
+        'name': beverage.name,
+        'quantity': beverage.quantity,
+        'reorder_point': forecast.reorder_point(beverage.id),
+        'price': beverage.price,
+        'image_path': beverage.image_path,
+        'is_active': beverage.is_active
+    }
+
+@bp.route('/api/inventory')
+@login_required
+def inventory_snapshot():
+    forecast = forecast_service.forecast_cache.get()
+
+    def snapshot():
+        beverages = models.Beverage.query.filter_by(is_active=True).all()
+        return jsonify({'beverages': [beverage_json(beverage, forecast) for beverage in beverages]})
+
+    tag, last_modified = inventory_service.inventory_version()
+    return cached_response(f"{tag}-f{forecast.version}", last_modified, snapshot)
+
+@bp.route('/api/sync')
+@login_required
+def sync_changes():
+    # Beverages changed since the till's cursor; a till whose
+    # forecast_version differs from the one it has asks again with since=0
+    # to refresh every reorder point
+    try:
+        since = int(request.args.get('since', 0))
+        if since < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Cursor de sincronización inválido'}), 400
+    forecast = forecast_service.forecast_cache.get()
+    beverages, cursor = sync_service.changes_since(since)
+    return jsonify({
+        'cursor': cursor,
+        'forecast_version': forecast.version,
+        'beverages': [beverage_json(beverage, forecast) for beverage in beverages]
+    })
+
+@bp.route('/api/sync/sales', methods=['POST'])
+@login_required
+def sync_sales():
+    data = request.get_json(silent=True) or {}
+    sales = []
+    try:
+        for sale in data.get('sales') or []:
+            key = str(sale['id'])
+            beverage_id = int(sale['beverage_id'])
+            units = int(sale.get('quantity', 1))
+            if not key or len(key) > 64 or units <= 0:
+                raise ValueError
+            sales.append((key, beverage_id, units))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Formato de venta inválido'}), 400
+    if len(sales) > sync_service.MAX_OFFLINE_SALES:
+        return jsonify({
+            'success': False,
+            'error': f'Demasiadas ventas en una sincronización (máximo {sync_service.MAX_OFFLINE_SALES})'
+        }), 400
+
+    for attempt in range(2):
+        try:
+            results, changed = sync_service.record_offline_sales(sales, current_user.id)
+            db.session.commit()
+            break
+        except IntegrityError:
+            # The same queue uploaded concurrently; the retry finds its results
+            db.session.rollback()
+            if attempt:
+                raise
+
+    for beverage_id, (name, new_quantity, is_active) in changed.items():
+        publish_beverage_event(beverage_id, new_quantity, is_active)
+        if new_quantity < forecast_service.reorder_point(beverage_id):
+            low_stock_alerts().enqueue(beverage_id, name, new_quantity)
+
+    return jsonify({'success': True, 'results': results})
+
+@bp.route('/api/events')
+@login_required
+def inventory_events():
+    # Long lived: gunicorn.conf.py serves these with gevent workers so idle
+    # tills do not each hold a worker thread
+    if not current_app.config['SSE_ENABLED']:
+        abort(404)
+    subscription = event_service.get_broker().subscribe()
+    return Response(
+        event_service.sse_stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Uploaded images are named after their content hash (plus a variant
+# suffix), so a given URL never changes and can be cached forever
+HASHED_UPLOAD = re.compile(r'^uploads/[0-9a-f]{32}(_[a-z]+)?\.[a-z]+$')
+
+@bp.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint; restrict access to it at the proxy
+    if not metrics_service.enabled:
+        abort(404)
+    return Response(metrics_service.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.after_app_request
+def cache_hashed_uploads(response):
+    if request.endpoint == 'static' and response.status_code == 200 \
+            and HASHED_UPLOAD.match(request.view_args.get('filename', '')):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+@bp.route('/restock')
+@login_required
+def restock():
+    # First page only; the table loads the next ones from /api/beverages
+    beverages, next_cursor = search_service.beverage_page()
+    return render_template('restock.html', beverages=beverages, rows=beverage_rows(beverages),
+                           next_cursor=next_cursor)
+
+def beverage_rows(beverages):
+    """Restock table rows: each beverage with its forecast"""
+    rows = []
+    for beverage, row in zip(beverages, forecast_service.forecast_rows(beverages)):
+        del row['weekday_factors'], row['hourly_profile']
+        row.update(price=beverage.price, is_active=beverage.is_active)
+        rows.append(row)
+    return rows
+
+def limit_arg(default, maximum):
+    try:
+        return min(max(int(request.args.get('limit', default)), 1), maximum)
+    except ValueError:
+        return default
+
+@bp.route('/api/beverages')
+@login_required
+def list_beverages():
+    beverages, next_cursor = search_service.beverage_page(
+        request.args.get('after'), limit_arg(search_service.BEVERAGE_PAGE_SIZE, search_service.MAX_PAGE_SIZE)
+    )
+    return jsonify({'beverages': beverage_rows(beverages), 'next': next_cursor})
+
+@bp.route('/api/beverages/search')
+@login_required
+def search_beverages():
+    beverages = search_service.search(
+        request.args.get('q', ''), limit_arg(search_service.SEARCH_LIMIT, search_service.MAX_SEARCH_LIMIT)
+    )
+    return jsonify({'beverages': beverage_rows(beverages)})
+
+@bp.route('/statistics')
+@login_required
+def statistics():
+    return render_template('statistics.html')
+
+@bp.route('/api/decrease/<int:beverage_id>', methods=['POST'])
+@login_required
+def decrease_inventory(beverage_id):
+    # In write-behind mode the sale is acknowledged once it is in the local
+    # journal; the flusher applies it to the database shortly after
+    journal = journal_service.get_journal()
+    if journal is not None:
+        sale = journal.record_sale(beverage_id, current_user.id)
+    else:
+        sale = inventory_service.record_sale(beverage_id, current_user.id)
+    if sale is None:
+        db.session.rollback()
+        if db.session.get(models.Beverage, beverage_id) is None:
+            abort(404)
+        return jsonify({'success': False, 'error': 'Sin existencias'}), 400
+
+    name, new_quantity, is_active = sale
+    if journal is None:
+        db.session.commit()
+    publish_beverage_event(beverage_id, new_quantity, is_active)
+
+    # Queue low stock alert if quantity falls below the reorder point; the
+    # dispatcher sends it from a background thread
+    if new_quantity < forecast_service.reorder_point(beverage_id):
+        low_stock_alerts().enqueue(beverage_id, name, new_quantity)
+
+    return jsonify({'success': True, 'new_quantity': new_quantity})
+
+def previous_sale_batch(idempotency_key):
+    """The batch the current user already recorded under this key"""
+    return models.SaleBatch.query.filter_by(idempotency_key=idempotency_key, user_id=current_user.id).first()
+
+@bp.route('/api/sales/batch', methods=['POST'])
+@login_required
+def batch_sale():
+    data = request.get_json(silent=True) or {}
+    idempotency_key = data.get('idempotency_key')
+    # Same limit as the column and as offline sale ids (sync_sales)
+    if idempotency_key is not None and (not isinstance(idempotency_key, str) or len(idempotency_key) > 64):
+        return jsonify({'success': False, 'error': 'Clave de idempotencia inválida'}), 400
+
+    items = {}
+    try:
+        for line in data.get('items') or []:
+            beverage_id = int(line['beverage_id'])
+            quantity = int(line.get('quantity', 1))
+            if quantity <= 0:
+                raise ValueError
+            items[beverage_id] = items.get(beverage_id, 0) + quantity
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Formato de venta inválido'}), 400
+    if not items:
+        return jsonify({'success': False, 'error': 'La venta no contiene productos'}), 400
+
+    if idempotency_key:
+        previous = previous_sale_batch(idempotency_key)
+        if previous:
+            return jsonify(json.loads(previous.response))
+
+    try:
+        results, failed_id = inventory_service.record_sales(items, current_user.id)
+        if failed_id is not None:
+            db.session.rollback()
+            beverage = db.session.get(models.Beverage, failed_id)
+            error = f'Sin existencias suficientes de {beverage.name}' if beverage else 'Bebida no encontrada'
+            return jsonify({'success': False, 'error': error, 'beverage_id': failed_id}), 409
+
+        response = {
+            'success': True,
+            'items': [
+                {'beverage_id': beverage_id, 'new_quantity': new_quantity}
+                for beverage_id, (_, new_quantity, _) in results.items()
+            ]
+        }
+        if idempotency_key:
+            db.session.add(models.SaleBatch(
+                idempotency_key=idempotency_key,
+                user_id=current_user.id,
+                response=json.dumps(response)
+            ))
+        db.session.commit()
+    except IntegrityError:
+        # Same idempotency key committed concurrently by another request
+        db.session.rollback()
+        previous = previous_sale_batch(idempotency_key)
+        if previous is None:
+            raise
+        return jsonify(json.loads(previous.response))
+
+    for beverage_id, (name, new_quantity, is_active) in results.items():
+        publish_beverage_event(beverage_id, new_quantity, is_active)
+        if new_quantity < forecast_service.reorder_point(beverage_id):
+            low_stock_alerts().enqueue(beverage_id, name, new_quantity)
+
+    return jsonify(response)
+
+@bp.route('/api/restock', methods=['POST'])
+@login_required
+def add_restock():
+    try:
+        name = request.form.get('name')
+        quantity = int(request.form.get('quantity', 0))
+        price = float(request.form.get('price', 0))
+        
+        if not name or quantity <= 0 or price <= 0:
+            flash('Por favor complete todos los campos correctamente', 'danger')
+            return redirect(url_for('main.restock'))
+        
+        # The restock form sends the id of a beverage picked from the search;
+        # a typed name also matches an existing one written differently
+        beverage_id = request.form.get('beverage_id', type=int)
+        if beverage_id:
+            beverage = db.session.get(models.Beverage, beverage_id)
+        else:
+            beverage = search_service.find_by_name(name)
+        if not beverage:
+            beverage = models.Beverage(name=name, quantity=0, price=price, image_path=DEFAULT_IMAGE)
+            db.session.add(beverage)
+            db.session.commit()
+        
+        if 'image' in request.files:
+            file = request.files['image']
+            if file and file.filename:
+                try:
+                    upload_folder = current_app.config['UPLOAD_FOLDER']
+                    filename, created = image_service.store_upload(file, upload_folder)
+                    old_image = beverage.image_path
+
+                    beverage.image_path = filename
+                    beverage.version += 1
+                    beverage.image_variants_ready = (
+                        not created and image_service.variants_exist(filename, upload_folder)
+                    )
+                    db.session.commit()
+                    logger.info(f"Image uploaded successfully for {beverage.name}: {filename}")
+
+                    if not beverage.image_variants_ready:
+                        image_service.submit_variants(
+                            os.path.join(upload_folder, filename),
+                            functools.partial(mark_variants_ready, current_app._get_current_object())
+                        )
+
+                    # Images are shared by content, only delete unreferenced ones
+                    if old_image and old_image not in (DEFAULT_IMAGE, filename):
+                        if not models.Beverage.query.filter_by(image_path=old_image).first():
+                            image_service.remove_image(old_image, upload_folder)
+                except ValueError as ve:
+                    logger.error(f"Validation error for {beverage.name}: {str(ve)}")
+                    flash(str(ve), 'danger')
+                    if not beverage.image_path:
+                        beverage.image_path = DEFAULT_IMAGE
+                except Exception as e:
+                    logger.error(f"Error saving image for {beverage.name}: {str(e)}")
+                    flash('Error al subir la imagen. Por favor, intente nuevamente', 'danger')
+                    if not beverage.image_path:
+                        beverage.image_path = DEFAULT_IMAGE
+        
+        # Added in SQL like sales subtract, so neither overwrites the other
+        db.session.flush()
+        row = db.session.execute(
+            db.update(models.Beverage)
+            .where(models.Beverage.id == beverage.id)
+            .values(quantity=models.Beverage.quantity + quantity, version=models.Beverage.version + 1)
+            .returning(models.Beverage.quantity, models.Beverage.price, models.Beverage.is_active)
+            .execution_options(synchronize_session=False)
+        ).first()
+        now = datetime.utcnow()
+        transaction = models.Transaction(
+            beverage_id=beverage.id,
+            user_id=current_user.id,
+            quantity_change=quantity,
+            timestamp=now,
+            transaction_type='restock'
+        )
+        db.session.add(transaction)
+        inventory_service.add_to_rollup([(now, beverage.id, 'restock', quantity, quantity * row.price)])
+        # With the row written (and locked), spread the units over its stock slots
+        new_quantity = stock_slot_service.restock({beverage.id: quantity}).get(beverage.id, row.quantity)
+        db.session.commit()
+
+        publish_beverage_event(beverage.id, new_quantity, row.is_active)
+        if new_quantity >= forecast_service.reorder_point(beverage.id):
+            low_stock_alerts().reset(beverage.id)
+        
+        flash('¡Inventario actualizado exitosamente!', 'success')
+        return redirect(url_for('main.restock'))
+    except Exception as e:
+        logger.error(f"Error in add_restock: {str(e)}")
+        db.session.rollback()
+        flash('Error al actualizar el inventario: ' + str(e), 'danger')
+        return redirect(url_for('main.restock'))
+
+def announce_import(app, result):
+    """After an import has been committed: notify tills, re-arm low stock
+    alerts and process new images, as add_restock does for one beverage"""
+    if len(result.beverages) > MAX_BEVERAGE_EVENTS:
+        event_service.get_broker().publish({'resync': True})
+    else:
+        for beverage_id, _, quantity, is_active in result.beverages:
+            publish_beverage_event(beverage_id, quantity, is_active)
+    for beverage_id, _, quantity, _ in result.beverages:
+        if quantity >= forecast_service.reorder_point(beverage_id):
+            low_stock_alerts().reset(beverage_id)
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    for filename in result.pending_variants:
+        image_service.submit_variants(
+            os.path.join(upload_folder, filename), functools.partial(mark_variants_ready, app)
+        )
+    import_service.remove_unused_images(result.replaced_images, upload_folder)
+
+@bp.route('/api/restock/import', methods=['POST'])
+@login_required
+def import_restock():
+    try:
+        file = request.files.get('file')
+        if not file or not file.filename:
+            return jsonify({'success': False, 'error': 'Seleccione un archivo de entrega'}), 400
+        file_format = import_service.detect_format(file.filename)
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+
+        delivery = import_service.parse_delivery(file.stream, file_format, upload_folder)
+        summary = delivery.summary()
+        if delivery.error_count:
+            return jsonify({'success': False, 'error': 'El archivo contiene errores, no se importó ninguna línea', **summary}), 400
+        if not delivery.lines:
+            return jsonify({'success': False, 'error': 'El archivo no contiene líneas', **summary}), 400
+        if request.form.get('dry_run') in ('1', 'true'):
+            return jsonify({'success': True, 'dry_run': True, **summary})
+
+        result = import_service.apply_delivery(delivery, current_user.id, upload_folder)
+        db.session.commit()
+    except ValueError as ve:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(ve)}), 400
+    except Exception as e:
+        logger.error(f"Error importing delivery: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    logger.info(f"Imported delivery {file.filename}: {result.lines} lines, {result.units} units")
+    announce_import(current_app._get_current_object(), result)
+    return jsonify({
+        'success': True,
+        **summary,
+        'units': result.units,
+        'beverages': len(result.beverages),
+        'created': result.created,
+    })
+
+@bp.route('/api/toggle-beverage/<int:beverage_id>', methods=['POST'])
+@login_required
+def toggle_beverage(beverage_id):
+    try:
+        beverage = models.Beverage.query.get_or_404(beverage_id)
+        beverage.is_active = not beverage.is_active
+        beverage.version += 1
+        db.session.commit()
+        publish_beverage_event(beverage.id, beverage.quantity, beverage.is_active)
+        status = 'activado' if beverage.is_active else 'desactivado'
+        flash(f'Bebida {beverage.name} ha sido {status}', 'success')
+        return jsonify({
+            'success': True,
+            'is_active': beverage.is_active,
+            'message': f'Bebida {status} exitosamente'
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error toggling beverage status: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def parse_date_range():
+    """Read start_date/end_date (YYYY-MM-DD) from the query string; the end
+    date is inclusive and the default range is the last 30 days"""
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    
+    if start_date:
+        start_date = datetime.strptime(start_date, '%Y-%m-%d')
+    else:
+        start_date = datetime.now() - timedelta(days=30)
+        
+    if end_date:
+        end_date = datetime.strptime(end_date, '%Y-%m-%d')
+        end_date = end_date + timedelta(days=1)
+    else:
+        end_date = datetime.now()
+    return start_date, end_date
+
+@bp.route('/api/stats')
+@login_required
+def get_stats():
+    try:
+        start_date, end_date = parse_date_range()
+
+        sales_data = []
+        total_sales = 0
+        top_product = None
+        max_sales = 0
+        
+        for _, name, sales_count in inventory_service.sales_by_beverage(start_date, end_date):
+            sales_data.append({
+                'name': name,
+                'sales': sales_count
+            })
+            total_sales += sales_count
+            
+            if sales_count > max_sales:
+                max_sales = sales_count
+                top_product = name
+        
+        return jsonify({
+            'sales_data': sales_data,
+            'total_sales': total_sales,
+            'top_product': top_product
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/stock')
+@login_required
+def stock_at():
+    """Stock per beverage at ``at`` (ISO date/time, UTC; default now),
+    derived from the transaction ledger. ``beverage_id`` may be repeated."""
+    try:
+        at = request.args.get('at')
+        try:
+            at = datetime.fromisoformat(at) if at else datetime.utcnow()
+        except ValueError:
+            return jsonify({'error': 'Fecha inválida, use el formato AAAA-MM-DDTHH:MM:SS'}), 400
+        if at.tzinfo is not None:
+            at = at.astimezone(timezone.utc).replace(tzinfo=None)
+        beverage_ids = request.args.getlist('beverage_id', type=int) or None
+
+        stock = inventory_service.stock_as_of(at, beverage_ids)
+        names = dict(db.session.query(models.Beverage.id, models.Beverage.name).filter(
+            models.Beverage.id.in_(stock)
+        ).all())
+        return jsonify({
+            'at': at.isoformat(),
+            'stock': [
+                {'beverage_id': beverage_id, 'name': names.get(beverage_id), 'quantity': quantity}
+                for beverage_id, quantity in sorted(stock.items())
+            ]
+        })
+    except Exception as e:
+        logger.error(f"Error getting stock: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/forecast')
+@login_required
+def get_forecast():
+    try:
+        beverage_ids = request.args.getlist('beverage_id', type=int)
+        query = models.Beverage.query.order_by(models.Beverage.id)
+        if beverage_ids:
+            query = query.filter(models.Beverage.id.in_(beverage_ids))
+        forecast = forecast_service.forecast_cache.get()
+        return jsonify({
+            'computed_at': forecast.computed_at.isoformat(),
+            'lead_time_days': forecast_service.LEAD_TIME_DAYS,
+            'beverages': forecast_service.forecast_rows(query.all()),
+        })
+    except Exception as e:
+        logger.error(f"Error getting forecast: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/export/sales')
+@login_required
+def export_sales():
+    try:
+        start_date, end_date = parse_date_range()
+
+        export_format = request.args.get('format', 'csv')
+        export_service.check_format(export_format)
+        mimetype, extension = export_service.EXPORT_FORMATS[export_format]
+
+        rows = export_service.stream_export(
+            inventory_service.sales_export_rows(start_date, end_date),
+            export_service.SALES,
+            export_format
+        )
+
+        output = Response(stream_with_context(rows), mimetype=mimetype)
+        output.headers["Content-Disposition"] = f"attachment; filename=ventas_{start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}.{extension}"
+        return output
+
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logger.error(f"Error exporting sales: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/export/transactions')
+@login_required
+def export_transactions():
+    try:
+        start_date, end_date = parse_date_range()
+
+        export_format = request.args.get('format', 'csv')
+        export_service.check_format(export_format)
+        mimetype, extension = export_service.EXPORT_FORMATS[export_format]
+
+        rows = export_service.stream_export(
+            inventory_service.transactions_export_rows(start_date, end_date),
+            export_service.TRANSACTIONS,
+            export_format
+        )
+
+        output = Response(stream_with_context(rows), mimetype=mimetype)
+        output.headers["Content-Disposition"] = f"attachment; filename=transacciones_{start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}.{extension}"
+        return output
+
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logger.error(f"Error exporting transactions: {str(e)}")
+        return jsonify({'error': str(e)}), 500